@@ -0,0 +1,344 @@
+
+"""
+Benchmark of the evaluation, the search, the value network and the dataset
+building.
+
+Results are printed as JSON and can be compared with a previous run saved
+as baseline. The total number of nodes searched at a fixed depth is a
+signature of the search: it changes as soon as the search or the
+evaluation behave differently, whatever the speed of the machine.
+
+    python bench.py --save bench.json
+    python bench.py --baseline bench.json --threshold 0.1
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import contextlib
+import chess
+
+from node import Node
+from minmax import MinMax
+from valuator import Valuator
+from network import ValueNetwork, NetworkValuator, boards_to_features
+from process import GameParser, DataSetBuilder, read_games
+
+
+POSITIONS = {
+    'opening': [
+        chess.STARTING_FEN,
+        "r1bqkbnr/1ppp1ppp/p1n5/1B2p3/4P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 0 4",
+        "rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2",
+    ],
+    'middlegame': [
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP3PPP/R2QKB1R w KQ - 0 8",
+    ],
+    'tactics': [
+        "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4",
+        "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1",
+        "4k3/8/2p5/3p4/8/8/3Q4/4K3 w - - 0 1",
+    ],
+    'endgame': [
+        "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        "8/8/8/4k3/8/8/4P3/4K3 w - - 0 1",
+        "8/8/8/4k3/8/8/8/R3K3 w - - 0 1",
+        "1K1k4/1P6/8/8/8/8/r7/2R5 w - - 0 1",
+    ],
+}
+
+# Metrics compared with the baseline, higher is better
+METRICS = [('eval', 'value', 'evals_per_s'),
+        ('eval', 'bitboard_value', 'evals_per_s'),
+        ('eval', 'static_value', 'evals_per_s'),
+        ('search', 'nps'),
+        ('network', 'unbatched', 'evals_per_s'),
+        ('network', 'batched', 'evals_per_s'),
+        ('network', 'prefetch', 'evals_per_s'),
+        ('dataset', 'positions_per_s')]
+
+
+def positions():
+    return [fen for fens in POSITIONS.values() for fen in fens]
+
+
+def peak_memory():
+    """
+    Peak resident memory of the process and of its children, in KB
+    """
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def bench_eval(fens, repeat=50):
+    """
+    Evaluations per second of each evaluation function
+    """
+    valuator = Valuator()
+    nodes = [Node(chess.Board(fen)) for fen in fens]
+    functions = {
+        'value': lambda n: valuator.value(n.board),
+        'bitboard_value': lambda n: valuator.bitboard_value(n.board),
+        'static_value': valuator.static_value,
+    }
+
+    results = {}
+    for name, function in functions.items():
+        start = time.time()
+        for _ in range(repeat):
+            for node in nodes:
+                function(node)
+        eta = time.time() - start
+        evals = repeat * len(nodes)
+        results[name] = {'evals': evals, 'time': eta,
+                'evals_per_s': evals / eta}
+    return results
+
+
+def bench_network(fens, repeat=20, depth=2, seed=0):
+    """
+    Evaluations per second of the value network: one position per pass,
+    all the children of the positions in one pass, and the children of
+    each position from its first layer as the search does. Then speed of
+    a search with and without batched evaluations. The network has random
+    weights.
+    """
+    network = ValueNetwork.random(seed=seed)
+    valuator = NetworkValuator(network)
+    parents = [Node(chess.Board(fen)) for fen in fens]
+    moves = [list(node.board.legal_moves) for node in parents]
+    children = []
+    for node, legal_moves in zip(parents, moves):
+        for move in legal_moves:
+            node.push(move)
+            children.append(Node(node.board.copy()))
+            node.pop()
+    boards = [node.board for node in children]
+
+    def unbatched():
+        for node in children:
+            valuator.static_value(node)
+
+    def batched():
+        valuator.batch_values(boards_to_features(boards))
+
+    def prefetch():
+        for node, legal_moves in zip(parents, moves):
+            valuator.prefetch(node, legal_moves)
+
+    evals = repeat * len(children)
+    results = {'positions': len(children)}
+    for name, function in (('unbatched', unbatched), ('batched', batched),
+            ('prefetch', prefetch)):
+        start = time.time()
+        for _ in range(repeat):
+            function()
+        eta = time.time() - start
+        results[name] = {'evals': evals, 'time': eta,
+                'evals_per_s': evals / eta}
+
+    for name, batch in (('search_unbatched', False), ('search_batched', True)):
+        nodes = 0
+        eta = 0.
+        for fen in fens:
+            minmax = MinMax(max_depth=depth, valuator=NetworkValuator(network,
+                batch=batch), verbose=False)
+            node = Node(chess.Board(fen))
+            start = time.time()
+            minmax.next_move(node)
+            eta += time.time() - start
+            nodes += minmax.nodes + minmax.qnodes
+        results[name] = {'depth': depth, 'nodes': nodes, 'time': eta,
+                'nps': nodes / eta if eta else 0}
+    return results
+
+
+def bench_search(fens, depth):
+    """
+    Search each position at a fixed depth with a new engine
+    return: dict with nodes, nps, evaluations, cache hit rate and effective
+    branching factors
+    """
+    nodes = qnodes = evals = hits = 0
+    moves = []
+    # nodes of each iteration of the iterative deepening
+    depth_nodes = [0] * depth
+    eta = 0.
+    for fen in fens:
+        valuator = Valuator()
+        minmax = MinMax(max_depth=depth, valuator=valuator)
+        node = Node(chess.Board(fen))
+
+        start = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            move = minmax.next_move(node)
+        eta += time.time() - start
+
+        nodes += minmax.nodes
+        qnodes += minmax.qnodes
+        evals += valuator.count
+        hits += valuator.hits
+        moves.append(move.uci() if move else None)
+        for it in minmax.stats.iterations:
+            depth_nodes[it['depth'] - 1] += it['nodes'] + it['qnodes']
+
+    return {'depth': depth,
+            'positions': len(fens),
+            'nodes': nodes,
+            'qnodes': qnodes,
+            'time': eta,
+            'nps': (nodes + qnodes) / eta if eta else 0,
+            'evals': evals,
+            'evals_per_s': evals / eta if eta else 0,
+            'cache_hit_rate': hits / evals if evals else 0,
+            'moves': moves,
+            'depth_nodes': depth_nodes,
+            # effective branching factor of each depth from the second one
+            'ebf': [n / p if p else None
+                for p, n in zip(depth_nodes, depth_nodes[1:])],
+            'signature': nodes + qnodes}
+
+
+def random_pgn(games, seed=0, max_plies=80):
+    """
+    PGN text of random games, always the same for a given seed
+    """
+    rng = random.Random(seed)
+    text = []
+    for _ in range(games):
+        board = chess.Board()
+        for _ in range(max_plies):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(rng.choice(moves))
+        result = board.result()
+        if result == '*':
+            result = rng.choice(['1-0', '0-1', '1/2-1/2'])
+        movetext = chess.Board().variation_san(board.move_stack)
+        text.append('[Event "bench"]\n[Result "%s"]\n\n%s %s\n' % (result,
+            movetext, result))
+    return '\n'.join(text)
+
+
+def bench_dataset(games=50, seed=0):
+    """
+    Parse a sample PGN and build a dataset labelled with all the features
+    types from it
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        pgn = os.path.join(directory, 'bench.pgn')
+        with open(pgn, 'w') as f:
+            f.write(random_pgn(games, seed))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.time()
+            GameParser(pgn, directory).run()
+            parse_time = time.time() - start
+
+            jsonl = os.path.join(directory, 'bench.jsonl')
+            builder = DataSetBuilder(jsonl, directory)
+            start = time.time()
+            total = builder._dispatch_job(DataSetBuilder.FEATURES_TYPES,
+                    read_games(jsonl), 1)
+            build_time = time.time() - start
+
+    return {'games': games,
+            'positions': total,
+            'parse_time': parse_time,
+            'build_time': build_time,
+            'positions_per_s': total / build_time if build_time else 0}
+
+
+def run(depth=3, games=50, eval_repeat=50):
+    """
+    Run all the benchmarks
+    return: dict of results
+    """
+    fens = positions()
+    results = {'eval': bench_eval(fens, eval_repeat)}
+    results['search'] = bench_search(fens, depth)
+    results['network'] = bench_network(fens)
+    results['dataset'] = bench_dataset(games)
+    results['signature'] = results['search']['signature']
+    results['peak_memory_kb'] = peak_memory()
+    return results
+
+
+def _metric(results, path):
+    for name in path:
+        if not isinstance(results, dict) or name not in results:
+            return None
+        results = results[name]
+    return results
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Compare results with a baseline
+    threshold: allowed slowdown, 0.1 for 10%
+    return: list of regressions messages
+    """
+    regressions = []
+    if baseline.get('signature') != results.get('signature'):
+        regressions.append("signature changed: %s -> %s" % (
+            baseline.get('signature'), results.get('signature')))
+
+    for path in METRICS:
+        old = _metric(baseline, path)
+        new = _metric(results, path)
+        if not old or new is None:
+            continue
+        if new < old * (1 - threshold):
+            regressions.append("%s: %.1f -> %.1f (%+.1f%%)" % ('.'.join(path),
+                old, new, (new / old - 1) * 100))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BalooChessEngine benchmark")
+    parser.add_argument('--depth', type=int, default=3,
+            help="search depth")
+    parser.add_argument('--games', type=int, default=50,
+            help="number of games of the dataset benchmark")
+    parser.add_argument('--signature', action='store_true',
+            help="only print the nodes count signature of the search")
+    parser.add_argument('--baseline', help="results to compare with")
+    parser.add_argument('--threshold', type=float, default=0.1,
+            help="allowed slowdown before reporting a regression")
+    parser.add_argument('--save', help="save the results in this file")
+    args = parser.parse_args(argv)
+
+    if args.signature:
+        search = bench_search(positions(), args.depth)
+        print("Nodes searched: %d" % search['signature'])
+        print("Effective branching factors: %s" % " ".join("%.2f" % ebf
+            for ebf in search['ebf'] if ebf is not None))
+        return 0
+
+    results = run(depth=args.depth, games=args.games)
+    print(json.dumps(results, indent=2))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print("Regression: %s" % regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+"""
+Endgame bitbases of a king and a queen, rook or pawn against a lone king,
+generated by retrograde analysis.
+
+A position is indexed by the side to move, relative to the strong side,
+and the squares of the strong king, of the lone king and of the piece:
+index = ((side * 64 + strong king) * 64 + lone king) * 64 + piece. A
+table file holds one win bit for each index, packed 8 per byte, then the
+distance to mate in plies of each index on one byte. Positions with the
+black piece are probed with the colors flipped.
+"""
+import os
+import sys
+import time
+import chess
+import numpy as np
+
+
+# Number of positions of a table with a given side to move
+POSITIONS = 64 * 64 * 64
+
+# Distance to mate of the positions that are not won
+NOT_WON = 255
+
+# Tables generated, by piece of the strong side. The pawn table needs the
+# queen and rook tables for the promotions.
+TABLES = {chess.QUEEN: "KQK", chess.ROOK: "KRK", chess.PAWN: "KPK"}
+
+ROOK_DIRECTIONS = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+BISHOP_DIRECTIONS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+
+
+def _rays(directions):
+    """
+    Squares reached from each square in each direction, in order
+    return: (directions, 64, 7) int array padded with -1
+    """
+    rays = np.full((len(directions), 64, 7), -1, dtype=np.int64)
+    for d, (df, dr) in enumerate(directions):
+        for square in chess.SQUARES:
+            f, r = chess.square_file(square), chess.square_rank(square)
+            for step in range(7):
+                f, r = f + df, r + dr
+                if not (0 <= f < 8 and 0 <= r < 8):
+                    break
+                rays[d, square, step] = chess.square(f, r)
+    return rays
+
+
+def _square_table(function):
+    """
+    (64, 64) table of function(a, b) for all pairs of squares
+    """
+    return np.array([[function(a, b) for b in chess.SQUARES]
+        for a in chess.SQUARES])
+
+
+DISTANCE = _square_table(chess.square_distance)
+KING_TARGETS = np.array([list(chess.SquareSet(chess.BB_KING_ATTACKS[s])) +
+    [-1] * (8 - len(chess.SquareSet(chess.BB_KING_ATTACKS[s])))
+    for s in chess.SQUARES])
+# squares strictly between two aligned squares, as bitboards
+BETWEEN = _square_table(chess.between).astype(np.uint64)
+ROOK_LINES = _square_table(lambda a, b: a != b and (
+    chess.square_file(a) == chess.square_file(b) or
+    chess.square_rank(a) == chess.square_rank(b)))
+BISHOP_LINES = _square_table(lambda a, b: a != b and
+        chess.square_distance(a, b) == abs(chess.square_file(a) -
+            chess.square_file(b)) == abs(chess.square_rank(a) -
+                chess.square_rank(b)))
+PAWN_ATTACKS = _square_table(lambda a, b: bool(
+    chess.BB_PAWN_ATTACKS[chess.WHITE][a] & chess.BB_SQUARES[b]))
+RANKS = np.arange(64) >> 3
+
+
+def attacks(piece_type, square, target, blocker):
+    """
+    Tell if a white piece attacks target squares, a single blocker can
+    stand in the way. Arrays are broadcast together.
+    piece_type: chess.QUEEN, chess.ROOK or chess.PAWN
+    square: square of the piece
+    target: attacked square
+    blocker: square of another piece
+    return: bool array
+    """
+    if piece_type == chess.PAWN:
+        return PAWN_ATTACKS[square, target]
+    lines = ROOK_LINES[square, target]
+    if piece_type == chess.QUEEN:
+        lines = lines | BISHOP_LINES[square, target]
+    between = BETWEEN[square, target]
+    blocked = (between >> np.asarray(blocker, dtype=np.uint64)) & \
+            np.uint64(1)
+    return lines & (blocked == 0)
+
+
+class BitbaseBuilder:
+    """
+    Retrograde analysis of a table. The moves of all positions are
+    generated at once with NumPy, then positions are solved ply by ply:
+    the strong side wins in n plies when a move reaches a position lost
+    in n - 1 plies, the lone king is lost in n plies when all its moves
+    reach positions won in at most n - 1 plies.
+    """
+
+    def __init__(self, piece_type, promotions=None):
+        """
+        piece_type: piece of the strong side
+        promotions: for the pawn, distances to mate of the positions with
+        the lone king to move of the tables of the promoted pieces, dict
+        piece type -> (POSITIONS,) array
+        """
+        self.piece_type = piece_type
+        self.promotions = promotions or {}
+        squares = np.indices((64, 64, 64)).reshape(3, -1)
+        self.wk, self.bk, self.p = squares
+
+    def _legal(self):
+        """
+        Legal positions with the strong side and the lone king to move
+        """
+        wk, bk, p = self.wk, self.bk, self.p
+        legal = (wk != p) & (bk != p) & (DISTANCE[wk, bk] > 1)
+        if self.piece_type == chess.PAWN:
+            legal &= (RANKS[p] > 0) & (RANKS[p] < 7)
+        self.check = legal & attacks(self.piece_type, p, bk, wk)
+        return legal & ~self.check, legal
+
+    def _strong_moves(self):
+        """
+        Moves of the strong side, as indexes of positions with the lone
+        king to move, POSITIONS when there is no move
+        return: (POSITIONS, moves) array, and the distance to mate reached
+        by the best promotion of each position
+        """
+        wk, bk, p = self.wk[:, None], self.bk[:, None], self.p[:, None]
+        moves = []
+
+        targets = KING_TARGETS[self.wk]
+        valid = (targets >= 0) & (targets != p) & \
+                (DISTANCE[targets, bk] > 1)
+        moves.append(np.where(valid, (targets * 64 + bk) * 64 + p,
+            POSITIONS))
+
+        promotion = np.full(POSITIONS, NOT_WON, dtype=np.int64)
+        if self.piece_type == chess.PAWN:
+            # pawns of the illegal positions on the last rank stay there
+            push = np.minimum(p + 8, 63)
+            free = (push != wk) & (push != bk) & (RANKS[p] < 7)
+            last = RANKS[push] == 7
+            moves.append(np.where(free & ~last, (wk * 64 + bk) * 64 + push,
+                POSITIONS))
+            double = np.minimum(p + 16, 63)
+            valid = free & (RANKS[p] == 1) & (double != wk) & (double != bk)
+            moves.append(np.where(valid, (wk * 64 + bk) * 64 + double,
+                POSITIONS))
+
+            promoted = (free & last)[:, 0]
+            index = ((wk * 64 + bk) * 64 + push)[:, 0]
+            for dtm in self.promotions.values():
+                promotion = np.where(promoted, np.minimum(promotion,
+                    dtm[index]), promotion)
+            promotion = np.where(promotion < NOT_WON, promotion + 1,
+                    NOT_WON)
+        else:
+            directions = ROOK_DIRECTIONS
+            if self.piece_type == chess.QUEEN:
+                directions = directions + BISHOP_DIRECTIONS
+            rays = _rays(directions)
+            for d in range(len(directions)):
+                targets = rays[d][self.p]
+                hit = (targets == wk) | (targets == bk)
+                valid = (targets >= 0) & ~np.logical_or.accumulate(hit,
+                        axis=1)
+                moves.append(np.where(valid, (wk * 64 + bk) * 64 + targets,
+                    POSITIONS))
+
+        return np.concatenate(moves, axis=1), promotion
+
+    def _lone_moves(self):
+        """
+        Moves of the lone king, as indexes of positions with the strong
+        side to move: POSITIONS when there is no move, POSITIONS + 1 when
+        the piece is captured
+        return: (POSITIONS, 8) array
+        """
+        wk, p = self.wk[:, None], self.p[:, None]
+        targets = KING_TARGETS[self.bk]
+        valid = (targets >= 0) & (DISTANCE[targets, wk] > 1) & \
+                ~attacks(self.piece_type, p, np.maximum(targets, 0), wk)
+        capture = targets == p
+        return np.where(valid, np.where(capture, POSITIONS + 1,
+            (wk * 64 + targets) * 64 + p), POSITIONS)
+
+    def build(self):
+        """
+        Solve all the positions
+        return: distances to mate in plies, (2 * POSITIONS,) uint8 array,
+        the positions with the strong side to move first
+        """
+        legal_strong, legal_lone = self._legal()
+        strong_moves, promotion = self._strong_moves()
+        lone_moves = self._lone_moves()
+        has_moves = (lone_moves != POSITIONS).any(axis=1)
+
+        # an extra entry for the missing moves, and one for the captures
+        strong = np.full(POSITIONS + 2, NOT_WON, dtype=np.int64)
+        lone = np.full(POSITIONS + 1, NOT_WON, dtype=np.int64)
+        strong[POSITIONS] = 0
+        lone[:POSITIONS][legal_lone & ~has_moves & self.check] = 0
+
+        # solved when two plies in a row find nothing
+        ply = 0
+        idle = 0
+        while idle < 2:
+            ply += 1
+            if ply % 2:
+                todo = np.flatnonzero(legal_strong & (strong[:-2] ==
+                    NOT_WON))
+                won = (lone[strong_moves[todo]] == ply - 1).any(axis=1) | \
+                        (promotion[todo] == ply)
+                strong[todo[won]] = ply
+            else:
+                todo = np.flatnonzero(legal_lone & has_moves &
+                        (lone[:-1] == NOT_WON))
+                won = (strong[lone_moves[todo]] < NOT_WON).all(axis=1)
+                lone[todo[won]] = ply
+            idle = 0 if won.any() else idle + 1
+
+        return np.concatenate([strong[:POSITIONS],
+            lone[:POSITIONS]]).astype(np.uint8)
+
+    def write(self, path, dtm=None):
+        """
+        Write the table: the packed win bits then the distances to mate
+        return: number of won positions
+        """
+        if dtm is None:
+            dtm = self.build()
+        wins = dtm < NOT_WON
+        with open(path, 'wb') as output:
+            output.write(np.packbits(wins, bitorder='little').tobytes())
+            output.write(dtm.tobytes())
+        return int(wins.sum())
+
+
+def build_bitbases(path):
+    """
+    Generate all the tables in a directory
+    return: dict table name -> number of won positions
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    counts = {}
+    lone_dtm = {}
+    for piece_type, name in TABLES.items():
+        start = time.time()
+        builder = BitbaseBuilder(piece_type, promotions=lone_dtm if
+                piece_type == chess.PAWN else None)
+        dtm = builder.build()
+        lone_dtm[piece_type] = dtm[POSITIONS:]
+        counts[name] = builder.write(os.path.join(path, name + ".bb"), dtm)
+        print("%s: %d won positions, longest mate in %d plies, in %.3f "
+                "seconds" % (name, counts[name], dtm[dtm < NOT_WON].max(),
+                    time.time() - start))
+    return counts
+
+
+class Bitbases:
+    """
+    Tables of a directory memory-mapped from disk, a probe reads one bit,
+    and one byte for the won positions
+    """
+
+    def __init__(self, path):
+        if not os.path.isdir(path):
+            raise Exception("Couldn't found bitbases: %s" % path)
+
+        self.tables = {}
+        size = 2 * POSITIONS
+        for piece_type, name in TABLES.items():
+            table = os.path.join(path, name + ".bb")
+            if not os.path.exists(table):
+                continue
+            if os.path.getsize(table) != size // 8 + size:
+                raise Exception("Bad bitbase size: %s" % table)
+            self.tables[piece_type] = (
+                    np.memmap(table, dtype=np.uint8, mode='r',
+                        shape=(size // 8,)),
+                    np.memmap(table, dtype=np.uint8, mode='r',
+                        offset=size // 8, shape=(size,)))
+
+    def __len__(self):
+        return len(self.tables)
+
+    def probe(self, board):
+        """
+        Result of a position of the tables
+        board: chess.Board
+        return: None when the position is not in the tables, or (result,
+        plies), result is 1 when white wins, -1 when black wins and 0 for a
+        draw, plies the distance to mate
+        """
+        occupied = board.occupied
+        if chess.popcount(occupied) != 3 or board.castling_rights:
+            return None
+        square = chess.lsb(occupied & ~board.kings)
+        table = self.tables.get(board.piece_type_at(square))
+        if table is None:
+            return None
+
+        color = board.color_at(square)
+        strong_king = board.king(color)
+        lone_king = board.king(not color)
+        if color == chess.BLACK:
+            # flip the board so that the strong side is white
+            square ^= 56
+            strong_king ^= 56
+            lone_king ^= 56
+        side = 0 if board.turn == color else 1
+        index = ((side * 64 + strong_king) * 64 + lone_king) * 64 + square
+
+        wins, dtm = table
+        if not wins[index >> 3] >> (index & 7) & 1:
+            return 0, None
+        return 1 if color == chess.WHITE else -1, int(dtm[index])
+
+
+if __name__ == "__main__":
+    build_bitbases(sys.argv[1] if len(sys.argv) > 1 else 'data/bitbases')
@@ -0,0 +1,226 @@
+
+"""
+Opening book built from the parsed games, in the Polyglot format: sorted
+16 bytes big-endian entries (key, move, weight, learn). Node keys are
+Polyglot Zobrist keys so the book can be probed during a game without
+hashing the board again.
+"""
+import os
+import sys
+import time
+import chess
+import random
+import numpy as np
+
+from node import Node
+from process import read_games, replay_moves
+
+
+ENTRY_DTYPE = np.dtype([('key', '>u8'), ('move', '>u2'), ('weight', '>u2'),
+    ('learn', '>u4')])
+
+
+def move_to_polyglot(board, move):
+    """
+    Polyglot code of a move: to square, from square and promotion.
+    Castling moves are encoded as the king taking its own rook.
+    """
+    to_square = move.to_square
+    if board.is_castling(move):
+        rook_file = 7 if chess.square_file(to_square) > 4 else 0
+        to_square = chess.square(rook_file, chess.square_rank(to_square))
+    promotion = move.promotion - 1 if move.promotion else 0
+    return to_square | move.from_square << 6 | promotion << 12
+
+
+def polyglot_to_move(board, code):
+    """
+    Move of a Polyglot code in the given position
+    """
+    from_square = (code >> 6) & 0x3f
+    to_square = code & 0x3f
+    promotion = (code >> 12) & 0x7
+    if board.piece_type_at(from_square) == chess.KING and \
+            board.piece_at(to_square) == chess.Piece(chess.ROOK, board.turn):
+        rank = chess.square_rank(to_square)
+        king_file = 6 if to_square > from_square else 2
+        to_square = chess.square(king_file, rank)
+    return chess.Move(from_square, to_square,
+            promotion=promotion + 1 if promotion else None)
+
+
+class BookBuilder:
+    """
+    Count the moves played in the first plies of the games. A move weights
+    2 when its side won the game and 1 on a draw, lost games don't count.
+    """
+
+    # Number of plies of a game added to the book
+    MAX_PLY = 16
+
+    # Moves played less than that are not written
+    MIN_WEIGHT = 2
+
+    def __init__(self, max_ply=MAX_PLY, min_weight=MIN_WEIGHT):
+        self.max_ply = max_ply
+        self.min_weight = min_weight
+        self.weights = {}
+        self.games = 0
+
+    def _move_weight(self, result, turn):
+        """
+        Weight of a move from the game result, see GameParser._to_result
+        """
+        if result == 0.5:
+            return 1
+        white_won = result == 1.
+        return 2 if white_won == (turn == chess.WHITE) else 0
+
+    def add_game(self, game):
+        """
+        Add the first moves of a parsed game
+        game: dict with the moves and the result, see process.replay_moves
+        """
+        node = Node()
+        board = node.board
+        moves = replay_moves(game, board)
+        for _ in range(self.max_ply):
+            try:
+                move = next(moves, None)
+            except ValueError:
+                break
+            if move is None:
+                break
+            weight = self._move_weight(game['result'], board.turn)
+            if weight:
+                entry = (node.key(), move_to_polyglot(board, move))
+                self.weights[entry] = self.weights.get(entry, 0) + weight
+            node.push(move)
+        self.games += 1
+
+    def add_games(self, games):
+        """
+        Add games from any iterable, e.g. process.read_games
+        """
+        for game in games:
+            self.add_game(game)
+
+    def entries(self):
+        """
+        Book entries sorted by key and by decreasing weight
+        return: ENTRY_DTYPE array
+        """
+        items = [(k, m, w) for (k, m), w in self.weights.items()
+                if w >= self.min_weight]
+        entries = np.zeros(len(items), dtype=ENTRY_DTYPE)
+        if not items:
+            return entries
+
+        keys, moves, weights = zip(*items)
+        weights = np.array(weights, dtype=np.int64)
+        # weights are stored on 16 bits
+        if weights.max() > 0xffff:
+            weights = np.maximum(weights * 0xffff // weights.max(), 1)
+
+        entries['key'] = np.array(keys, dtype=np.uint64)
+        entries['move'] = moves
+        entries['weight'] = weights
+        order = np.lexsort((-weights, entries['key'].astype(np.uint64)))
+        return entries[order]
+
+    def write(self, path):
+        """
+        Write the book
+        return: number of entries
+        """
+        entries = self.entries()
+        entries.tofile(path)
+        return len(entries)
+
+
+class OpeningBook:
+    """
+    Polyglot book memory-mapped from disk. A sparse index of the keys is
+    kept in memory, so a probe only reads a few entries of the file.
+    """
+
+    # Number of entries between two keys of the index
+    INDEX_STRIDE = 64
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise Exception("Couldn't found opening book: %s" % path)
+
+        if os.path.getsize(path) == 0:
+            self.entries = np.zeros(0, dtype=ENTRY_DTYPE)
+        else:
+            self.entries = np.memmap(path, dtype=ENTRY_DTYPE, mode='r')
+        self.keys = self.entries['key']
+        self.index = np.array(self.keys[::self.INDEX_STRIDE], dtype=np.uint64)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _find(self, key):
+        """
+        Index of the first entry of a key
+        """
+        key = np.uint64(key)
+        block = int(self.index.searchsorted(key))
+        start = max(block - 1, 0) * self.INDEX_STRIDE
+        keys = np.array(self.keys[start:start + self.INDEX_STRIDE + 1],
+                dtype=np.uint64)
+        return start + int(keys.searchsorted(key))
+
+    def probe(self, node):
+        """
+        Legal book moves of a position
+        return: list of (chess.Move, weight) by decreasing weight
+        """
+        key = node.key()
+        board = node.board
+        moves = []
+        i = self._find(key)
+        while i < len(self.entries) and int(self.keys[i]) == key:
+            entry = self.entries[i]
+            move = polyglot_to_move(board, int(entry['move']))
+            if board.is_legal(move):
+                moves.append((move, int(entry['weight'])))
+            i += 1
+        return moves
+
+    def move(self, node, random_choice=False):
+        """
+        Book move of a position, the heaviest one or a random move with
+        probability proportional to its weight
+        return: chess.Move or None when the position is out of book
+        """
+        moves = self.probe(node)
+        if not moves:
+            return None
+        if not random_choice:
+            return moves[0][0]
+        return random.choices([m for m, _ in moves],
+                weights=[w for _, w in moves])[0]
+
+
+def build_book(games_path, book_path, max_ply=BookBuilder.MAX_PLY,
+        min_weight=BookBuilder.MIN_WEIGHT):
+    """
+    Build a book from a file of parsed games, read one game at a time
+    return: number of entries
+    """
+    start = time.time()
+    builder = BookBuilder(max_ply=max_ply, min_weight=min_weight)
+    builder.add_games(read_games(games_path))
+    count = builder.write(book_path)
+    print("Saved %d book entries from %d games in %.3f seconds." % (count,
+        builder.games, time.time() - start))
+    return count
+
+
+if __name__ == "__main__":
+    games_path = sys.argv[1] if len(sys.argv) > 1 \
+            else 'data/ficsgames_2018.jsonl'
+    book_path = sys.argv[2] if len(sys.argv) > 2 else 'data/book.bin'
+    build_book(games_path, book_path)
@@ -1,18 +1,166 @@
+
+import os
+import json
 import numpy as np
-from process import FEATURES_TYPE
+from node import POSITION_DTYPE, unpack_planes
 
 
 class ChessValueDataset():
+    """
+    Dataset built by process.DataSetBuilder. Shards are memory-mapped, so
+    positions are only read from disk when they are accessed and datasets
+    larger than the memory can be used.
+    """
+
+    def __init__(self, path, feature_type="material"):
+        """
+        Load data from files
+        path: directory of the dataset
+        feature_type: one of the DataSetBuilder features types
+        """
+        self.features = []
+        self.labels = []
+        # results counts of deduplicated datasets
+        self.stats = []
 
-    def __init__(self):
         # Load data from files
+        manifest_path = os.path.join(path, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+            if feature_type not in manifest['features_types']:
+                raise Exception("Dataset %s has no %s labels." % (path,
+                    feature_type))
+            # records of all the features types, see
+            # DataSetBuilder.records_dtype
+            for shard in manifest['shards']:
+                records = np.load(os.path.join(path, shard['positions']),
+                        mmap_mode='r')
+                self.features.append(records['position'])
+                self.labels.append(records[feature_type])
+                self.stats.append(records['stats'])
+        else:
+            self._load_files(path, feature_type)
+
+        counts = [len(f) for f in self.features]
+        # offsets[i] is the index of the first position of shard i
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(int)
+
+    def _load_files(self, path, feature_type):
+        """
+        Load a dataset built with one feature type at a time: sharded with
+        a manifest for each feature type, or single features and labels
+        files
+        """
+        manifest_path = os.path.join(path,
+                "manifest-{}.json".format(feature_type))
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+            shards = manifest['shards']
+        else:
+            shards = [{'features': "feature-{}.npy".format(feature_type),
+                'labels': "labels-{}.npy".format(feature_type)}]
+
+        if not all('stats' in s for s in shards):
+            self.stats = None
+        for shard in shards:
+            self.features.append(np.load(os.path.join(path,
+                shard['features']), mmap_mode='r'))
+            self.labels.append(np.load(os.path.join(path, shard['labels']),
+                mmap_mode='r'))
+            if self.stats is not None:
+                self.stats.append(np.load(os.path.join(path, shard['stats']),
+                    mmap_mode='r'))
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _locate(self, indexes):
+        """
+        Shard and index in the shard of global indexes
+        """
+        shards = np.searchsorted(self.offsets, indexes, side='right') - 1
+        return shards, indexes - self.offsets[shards]
+
+    def get(self, idx):
+        """
+        Return the features and the labels of a position, or of a slice of
+        positions. Slices inside a shard are views of the memory map.
+        """
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step == 1 and stop > start:
+                shards, local = self._locate(np.array([start, stop - 1]))
+                if shards[0] == shards[1]:
+                    shard = shards[0]
+                    return (self.features[shard][local[0]:local[1] + 1],
+                            self.labels[shard][local[0]:local[1] + 1])
+            return self.take(np.arange(start, stop, step))
+
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("index %d out of range" % idx)
+        shard, i = self._locate(np.array([idx]))
+        return (self.features[shard[0]][i[0]], self.labels[shard[0]][i[0]])
 
-        def __len__(self):
-            return self.features.shape[0]
+    __getitem__ = get
 
-        def get(self, idx):
-            return (self.features[idx], self.labels[idx])
+    def _gather(self, arrays, indexes):
+        """
+        Read the given global indexes from a list of shard arrays
+        """
+        shards, local = self._locate(indexes)
+        output = np.empty((len(indexes),) + arrays[0].shape[1:],
+                arrays[0].dtype)
+        for shard in np.unique(shards):
+            mask = shards == shard
+            output[mask] = arrays[shard][local[mask]]
+        return output
 
+    def take(self, indexes):
+        """
+        Return the features and the labels of several positions, only the
+        requested positions are read from the shards.
+        indexes: array of global indexes
+        """
+        indexes = np.asarray(indexes, dtype=int)
+        return (self._gather(self.features, indexes),
+                self._gather(self.labels, indexes))
 
+    def soft_labels(self, indexes):
+        """
+        Results frequencies of several positions, from the results counts of
+        a deduplicated dataset
+        indexes: array of global indexes
+        return: (N, 3) float array
+        """
+        if self.stats is None:
+            raise Exception("Dataset has no results counts.")
+        stats = self._gather(self.stats, np.asarray(indexes, dtype=int))
+        stats = stats.astype(np.float64)
+        return stats / np.maximum(stats.sum(axis=1, keepdims=True), 1)
 
+    def batches(self, batch_size, shuffle=True, seed=None, planes=False,
+            soft=False):
+        """
+        Iterate over the dataset by batches
+        batch_size: number of positions of a batch
+        shuffle: shuffle positions across all shards
+        planes: unpack compact positions into (N, 12, 64) planes
+        soft: labels are the results frequencies, see soft_labels
+        """
+        if shuffle:
+            order = np.random.RandomState(seed).permutation(len(self))
+        else:
+            order = np.arange(len(self))
 
+        for start in range(0, len(order), batch_size):
+            indexes = order[start:start + batch_size]
+            features, labels = self.take(indexes)
+            if soft:
+                labels = self.soft_labels(indexes)
+            if planes and features.dtype == POSITION_DTYPE:
+                features = unpack_planes(features)
+            yield features, labels
@@ -1,92 +1,820 @@
 import time
 import chess
 from node import Node
+from transposition import TranspositionTable
+from ordering import MoveOrderer, mvv_lva, see
+from stats import SearchStats, profile_call
+
+
+class SearchTimeout(Exception):
+    """
+    Raised when the search is out of time or nodes
+    """
+    pass
+
 
 class MinMax:
 
     DEFAULT_MAX_DEPTH = 4
 
-    def __init__(self, max_depth=DEFAULT_MAX_DEPTH, valuator=None):
+    # Maximum depth reached by iterative deepening with a time budget
+    MAX_ITERATIVE_DEPTH = 64
+
+    # Number of nodes between two checks of the clock and of the stop event
+    CHECK_INTERVAL = 256
+
+    # Safety margin of delta pruning, in centipawns
+    DELTA_MARGIN = 200
+
+    # Null-move pruning: depth reduction of the null move search, one more
+    # from NULL_MOVE_DEEP_DEPTH, and minimum depth to try it
+    NULL_MOVE_REDUCTION = 2
+    NULL_MOVE_DEEP_DEPTH = 6
+    NULL_MOVE_MIN_DEPTH = 3
+
+    # Late-move reductions: quiet moves searched after the first LMR_MOVES
+    # ones are reduced by one ply, by two after LMR_LATE_MOVES
+    LMR_MIN_DEPTH = 3
+    LMR_MOVES = 3
+    LMR_LATE_MOVES = 6
+
+    # Futility pruning: margins in centipawns by remaining depth, quiet
+    # moves are skipped when the static value plus the margin can't reach
+    # the search window
+    FUTILITY_MARGINS = {1: 200, 2: 500}
+
+    # Aspiration windows: half width of the root window around the value of
+    # the previous iteration, in centipawns, doubled on each fail low or
+    # high, and first depth using them
+    ASPIRATION_WINDOW = 50
+    ASPIRATION_MIN_DEPTH = 3
+
+    def __init__(self, max_depth=DEFAULT_MAX_DEPTH, valuator=None,
+            table=None, ordering=True, quiescence=True, book=None,
+            timing=False, verbose=True, null_move=True, reductions=True,
+            futility=True, pvs=True, aspiration=True, bitbases=None):
         self.max_depth = max_depth
         if valuator is None:
             raise Exception("MinMax need a valuator.")
         self.valuator = valuator
+        # valuators evaluating the children of frontier nodes at once, see
+        # network.NetworkValuator.prefetch
+        self._prefetch = getattr(valuator, 'prefetch', None)
+
+        if table is None:
+            table = TranspositionTable()
+        self.table = table
+
+        # Without ordering, moves are searched in generation order
+        self.orderer = MoveOrderer() if ordering else None
+        self.use_quiescence = quiescence
+
+        # Selective search, each technique can be disabled
+        self.use_null_move = null_move
+        self.use_reductions = reductions
+        self.use_futility = futility
+        # Principal variation search and aspiration windows at the root
+        self.use_pvs = pvs
+        self.use_aspiration = aspiration
+
+        # Optional book.OpeningBook probed before searching
+        self.book = book
+        # Optional bitbase.Bitbases probed in positions of three pieces
+        self.bitbases = bitbases
+
+        # main search and quiescence search nodes
+        self.nodes = 0
+        self.qnodes = 0
+        # deepest ply reached
+        self.seldepth = 0
+        self.pv = []
+        self._deadline = None
+        self._max_nodes = None
+
+        # depth and value of the last search
+        self.depth = 0
+        self.value = None
+
+        # statistics of the last search, the time spent in move generation
+        # and evaluation is only measured with timing as it slows the
+        # search down
+        self.stats = SearchStats()
+        self.timing = timing
+
+        # print a summary of each search
+        self.verbose = verbose
+        # Optional function called with a dict describing each completed
+        # iteration, see _iterative_deepening
+        self.on_iteration = None
+
+        # Optional object with an is_set method, like threading.Event, used
+        # to stop the search from outside
+        self.stop_event = None
+
+    def _check_limits(self):
+        """
+        Abort the search if the time or nodes budget is exhausted
+        """
+        nodes = self.nodes + self.qnodes
+        if self._max_nodes is not None and nodes >= self._max_nodes:
+            raise SearchTimeout()
+        if nodes % self.CHECK_INTERVAL:
+            return
+        # the stop event can be shared between processes, which makes it
+        # as slow to check as the clock
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise SearchTimeout()
+        if self._deadline is not None and time.time() >= self._deadline:
+            raise SearchTimeout()
 
-    def minmax(self, node, depth, alpha, beta):
+    def minmax(self, node, depth, alpha, beta, ply=1):
         """
         AI function that choice the best move
         :param node: current node of the board
-        :param depth: node index in the tree
-        :param count: int that is the number of times the minmax func is called
+        :param depth: remaining depth to search
+        :param alpha: lower bound of the search window
+        :param beta: upper bound of the search window
+        :param ply: distance from the root node
         :return: best value depends of who's turn it is
         """
         b = node.board
 
-        # check if depth is max depth or if game is over
-        # then we return the value of the board
-        if depth == self.max_depth or b.is_game_over():
+        # at max depth we only look at captures
+        if depth <= 0 and self.use_quiescence:
+            return self.quiescence(node, alpha, beta, ply)
+
+        self.nodes += 1
+        if ply > self.seldepth:
+            self.seldepth = ply
+        self._check_limits()
+
+        # checkmate and stalemate are found by the moves search below
+        if self.valuator.is_draw(b):
+            return 0
+
+        value = self._probe_bitbases(b, ply)
+        if value is not None:
+            return value
+
+        # at max depth we return the value of the board
+        if depth <= 0:
+            return self._leaf_value(node, ply)
+
+        # look for a previous search of this position
+        key = node.key()
+        tt_move = None
+        entry = self.table.probe(key)
+        if entry is not None:
+            tt_depth, flag, score, tt_move = entry
+            score = self._from_table(score, ply)
+            if tt_depth >= depth:
+                if flag == TranspositionTable.EXACT:
+                    return score
+                if flag == TranspositionTable.LOWER:
+                    alpha = max(alpha, score)
+                elif flag == TranspositionTable.UPPER:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score
+
+        maximize = b.turn == chess.WHITE
+        in_check = b.is_check()
+        if not in_check and self._null_move_cutoff(node, depth, alpha, beta,
+                ply):
+            self.stats.null_cutoffs += 1
+            return beta if maximize else alpha
+
+        # near the horizon, quiet moves can't bring the value back in the
+        # window when the static value is too far from it
+        futile = False
+        if self.use_futility and not in_check and \
+                depth in self.FUTILITY_MARGINS and \
+                not self.valuator.is_mate(alpha if maximize else beta):
+            margin = self.FUTILITY_MARGINS[depth] * 10
+            static = self._evaluate(node)
+            if maximize:
+                futile = static + margin <= alpha
+            else:
+                futile = static - margin >= beta
+
+        best_val, best_move = self._search_moves(node, depth, alpha, beta,
+                ply, tt_move, in_check, futile)
+        if best_move is None:
+            # no legal moves
+            best_val = self.valuator.terminal_value(b, ply)
+
+        self._store(key, depth, alpha, beta, best_val, best_move, ply)
+        return best_val
+
+    def _null_move_cutoff(self, node, depth, alpha, beta, ply):
+        """
+        Let the opponent play twice: if the side to move still fails high
+        with a reduced search, the node is cut. Not tried after a null
+        move, nor when the side to move only has pawns, as zugzwang is
+        likely in pawn endgames.
+        :return: True if the node can be cut
+        """
+        b = node.board
+        if not self.use_null_move or depth < self.NULL_MOVE_MIN_DEPTH:
+            return False
+        if b.move_stack and not b.move_stack[-1]:
+            return False
+        if not b.occupied_co[b.turn] & ~(b.pawns | b.kings):
+            return False
+
+        maximize = b.turn == chess.WHITE
+        # mates can't be proven with a null move
+        if self.valuator.is_mate(beta if maximize else alpha):
+            return False
+
+        reduction = self.NULL_MOVE_REDUCTION
+        if depth >= self.NULL_MOVE_DEEP_DEPTH:
+            reduction += 1
+
+        node.push(chess.Move.null())
+        if maximize:
+            value = self.minmax(node, depth - 1 - reduction, beta - 1, beta,
+                    ply + 1)
+        else:
+            value = self.minmax(node, depth - 1 - reduction, alpha,
+                    alpha + 1, ply + 1)
+        node.pop()
+        return value >= beta if maximize else value <= alpha
+
+    def _leaf_value(self, node, ply):
+        """
+        Value of a leaf searched without quiescence
+        :param ply: distance from the root node
+        """
+        b = node.board
+        if self.timing:
+            start = time.perf_counter()
+            has_moves = any(b.generate_legal_moves())
+            self.stats.movegen_time += time.perf_counter() - start
+        else:
+            has_moves = any(b.generate_legal_moves())
+        if not has_moves:
+            return self.valuator.terminal_value(b, ply)
+        return self._evaluate(node)
+
+    def _evaluate(self, node):
+        """
+        Static value of a node, timed when timing is enabled
+        """
+        if not self.timing:
             return self.valuator(node)
+        start = time.perf_counter()
+        value = self.valuator(node)
+        self.stats.eval_time += time.perf_counter() - start
+        return value
 
-        if b.turn == chess.WHITE:
-            best_val = self.valuator.MINVALUE
+    def _prefetch_children(self, node, moves):
+        """
+        Evaluate the children of a node in one batch, see
+        network.NetworkValuator.prefetch
+        """
+        if not self.timing:
+            self._prefetch(node, moves)
+            return
+        start = time.perf_counter()
+        self._prefetch(node, moves)
+        self.stats.eval_time += time.perf_counter() - start
+
+    def _quiescence_moves(self, b, in_check):
+        """
+        Moves of the quiescence search sorted by MVV-LVA: all evasions when
+        in check, captures and promotions otherwise
+        """
+        if in_check:
+            moves = list(b.legal_moves)
         else:
-            best_val = self.valuator.MAXVALUE
+            moves = list(b.generate_legal_captures())
+            moves.extend(b.generate_legal_moves(b.pawns,
+                    chess.BB_BACKRANKS & ~b.occupied))
 
+        moves.sort(key=lambda m: mvv_lva(b, m) if m.promotion or
+                b.is_capture(m) else 0, reverse=True)
+        return moves
 
-        # check value for each moves
-        for m in node.edges():
+    def _probe_bitbases(self, board, ply):
+        """
+        Exact value of a position of the bitbases
+        :param board: chess.Board
+        :param ply: distance from the root node
+        :return: value, None when the position is not in the bitbases
+        """
+        if self.bitbases is None or chess.popcount(board.occupied) != 3:
+            return None
+        result = self.bitbases.probe(board)
+        if result is None:
+            return None
+        self.stats.bitbase_hits += 1
+        outcome, plies = result
+        if not outcome:
+            return 0
+        return outcome * (self.valuator.MAXVALUE - ply - plies)
 
-            b.push(m)
-            tval = self.minmax(node, depth+1, alpha, beta)
-            b.pop()
+    def quiescence(self, node, alpha, beta, ply=0):
+        """
+        Search captures and promotions only (or all evasions when in check)
+        until the position is quiet, so that leaves are never evaluated in
+        the middle of an exchange.
+        :param node: current node of the board
+        :param alpha: lower bound of the search window
+        :param beta: upper bound of the search window
+        :param ply: distance from the root node
+        :return: best value depends of who's turn it is
+        """
+        b = node.board
+        self.qnodes += 1
+        if ply > self.seldepth:
+            self.seldepth = ply
+        self._check_limits()
 
-            # if it's white turn then your goal is to maximize
-            if b.turn == chess.WHITE:
-                best_val = max(best_val, tval)
-                alpha = max(alpha, best_val)
-                if (alpha <= beta):
-                    return best_val
+        if self.valuator.is_draw(b):
+            return 0
 
-            # if it's black turn then you want to minimize
+        value = self._probe_bitbases(b, ply)
+        if value is not None:
+            return value
+
+        maximize = b.turn == chess.WHITE
+        in_check = b.is_check()
+
+        if in_check:
+            # no stand pat when in check, every evasion is searched
+            stand_pat = None
+        else:
+            # stand pat: the side to move can choose not to capture, and
+            # stalemates are not detected here
+            stand_pat = self._evaluate(node)
+            best_val = stand_pat
+            if maximize:
+                if stand_pat >= beta:
+                    return stand_pat
+                alpha = max(alpha, stand_pat)
+            else:
+                if stand_pat <= alpha:
+                    return stand_pat
+                beta = min(beta, stand_pat)
+
+        if self.timing:
+            start = time.perf_counter()
+            moves = self._quiescence_moves(b, in_check)
+            self.stats.movegen_time += time.perf_counter() - start
+        else:
+            moves = self._quiescence_moves(b, in_check)
+
+        if in_check:
+            if not moves:
+                return self.valuator.terminal_value(b, ply)
+            if maximize:
+                best_val = self.valuator.MINVALUE
+            else:
+                best_val = self.valuator.MAXVALUE
+
+        values = self.valuator.PIECES_VALUES
+        for m in moves:
+            if stand_pat is not None:
+                # delta pruning: even winning the piece can't raise alpha
+                if b.is_en_passant(m):
+                    gain = values[chess.PAWN]
+                else:
+                    victim = b.piece_type_at(m.to_square)
+                    gain = values[victim] if victim else 0
+                if m.promotion:
+                    gain += values[m.promotion] - values[chess.PAWN]
+                gain = (gain + self.DELTA_MARGIN) * 10
+                if maximize and stand_pat + gain <= alpha:
+                    continue
+                if not maximize and stand_pat - gain >= beta:
+                    continue
+
+                # skip captures losing material
+                if see(b, m) < 0:
+                    continue
+
+            node.push(m)
+            tval = self.quiescence(node, alpha, beta, ply + 1)
+            node.pop()
+
+            if maximize:
+                if tval > best_val:
+                    best_val = tval
+                alpha = max(alpha, best_val)
             else:
-                best_val = min(best_val, tval)
-                beta = min(best_val, beta)
-                if (alpha >= beta):
-                    return best_val
+                if tval < best_val:
+                    best_val = tval
+                beta = min(beta, best_val)
+
+            if alpha >= beta:
+                break
 
         return best_val
 
-    def next_move(self, node):
-        b = node.board
-        depth = 0
-        best_move = None
+    def _ordered_moves(self, node, ply, tt_move):
+        """
+        Moves of a node in the order they will be searched
+        """
+        if self.orderer is not None:
+            return self.orderer.moves(node.board, ply, tt_move)
 
-        start = time.time()
+        moves = node.edges()
+        if tt_move in moves:
+            moves.remove(tt_move)
+            moves.insert(0, tt_move)
+        return moves
+
+    def _timed_moves(self, moves):
+        """
+        Iterate over moves generated lazily, adding the generation time to
+        the search statistics
+        """
+        moves = iter(moves)
+        while True:
+            start = time.perf_counter()
+            m = next(moves, None)
+            self.stats.movegen_time += time.perf_counter() - start
+            if m is None:
+                return
+            yield m
+
+    def _reduction(self, depth, index, in_check):
+        """
+        Depth reduction of a quiet move by its index in the search order
+        """
+        if not self.use_reductions or in_check or \
+                depth < self.LMR_MIN_DEPTH or index < self.LMR_MOVES:
+            return 0
+        reduction = 1 if index < self.LMR_LATE_MOVES else 2
+        # the reduced search is at least one ply deep
+        return min(reduction, depth - 2)
 
-        if b.turn == chess.WHITE:
+    def _search_moves(self, node, depth, alpha, beta, ply, tt_move=None,
+            in_check=False, futile=False):
+        """
+        Search all moves of a node with alpha-beta pruning. Principal
+        variation search: only the first move is searched with the full
+        window, the others with a null window proving they are not better,
+        and again with the full window when they are.
+        :param ply: distance from the root node
+        :param tt_move: move to search first
+        :param in_check: the side to move is in check, no move is reduced
+        :param futile: skip the quiet moves, see futility pruning in minmax
+        :return: best value and best move
+        """
+        b = node.board
+        maximize = b.turn == chess.WHITE
+        if maximize:
             best_val = self.valuator.MINVALUE
         else:
             best_val = self.valuator.MAXVALUE
+        best_move = None
+
+        moves = self._ordered_moves(node, ply, tt_move)
+        if self.timing:
+            moves = self._timed_moves(moves)
 
-        for m in node.edges():
-            b.push(m)
-            tval = self.minmax(node, depth, self.valuator.MINVALUE,
-                    self.valuator.MAXVALUE)
-            b.pop()
+        # the children of a frontier node are evaluated at once by the
+        # valuators supporting it, once the first move didn't cut
+        prefetch = depth == 1 and self._prefetch is not None
+
+        # check value for each moves
+        for i, m in enumerate(moves):
+            if i == 1 and prefetch:
+                self._prefetch_children(node, b.generate_legal_captures()
+                        if futile else b.legal_moves)
+
+            # the first move is always searched, so that a node with legal
+            # moves has a best move
+            reduction = 0
+            if best_move is not None:
+                reduction = self._reduction(depth, i, in_check)
+                if (futile or reduction) and (b.is_capture(m) or
+                        m.promotion or b.gives_check(m)):
+                    reduction = 0
+                elif futile:
+                    self.stats.futility_prunes += 1
+                    continue
+
+            node.push(m)
+            if best_move is None:
+                tval = self.minmax(node, depth-1, alpha, beta, ply+1)
+            else:
+                tval = self._scout(node, depth, alpha, beta, ply, reduction,
+                        maximize)
+            node.pop()
 
-            if b.turn == chess.WHITE:
-                if tval >= best_val:
+            # if it's white turn then your goal is to maximize
+            if maximize:
+                if best_move is None or tval > best_val:
                     best_val = tval
                     best_move = m
+                alpha = max(alpha, best_val)
+
+            # if it's black turn then you want to minimize
             else:
-                if tval <= best_val:
+                if best_move is None or tval < best_val:
                     best_val = tval
                     best_move = m
+                beta = min(beta, best_val)
 
-        eta = time.time() - start
-        print("Best value: %.2f -> %s : explored %d nodes in %.3f seconds" %
-                (best_val, str(best_move), self.valuator.count, eta))
+            if alpha >= beta:
+                self.stats.cutoffs += 1
+                if i == 0:
+                    self.stats.first_move_cutoffs += 1
+                if self.orderer is not None:
+                    self.orderer.cutoff(b, m, ply, depth)
+                break
 
-        return best_move
+        return best_val, best_move
 
+    def _scout(self, node, depth, alpha, beta, ply, reduction, maximize):
+        """
+        Search a move played on node after the first one with a null window,
+        or with the full window without principal variation search
+        :param depth: remaining depth before the move
+        :param reduction: late move reduction of the move
+        :return: value of the move
+        """
+        if not self.use_pvs:
+            low, high = alpha, beta
+        elif maximize:
+            low, high = alpha, alpha + 1
+        else:
+            low, high = beta - 1, beta
+        tval = self.minmax(node, depth-1-reduction, low, high, ply+1)
+
+        # the reduced move is better than expected, search it again at full
+        # depth
+        if reduction:
+            if tval > alpha if maximize else tval < beta:
+                self.stats.researches += 1
+                tval = self.minmax(node, depth-1, low, high, ply+1)
+            else:
+                self.stats.reductions += 1
 
+        # better than the best move so far and inside the window: search it
+        # again with the full window to get its exact value
+        if self.use_pvs and alpha < tval < beta:
+            self.stats.pvs_researches += 1
+            tval = self.minmax(node, depth-1, alpha, beta, ply+1)
+        return tval
+
+    def _to_table(self, value, ply):
+        """
+        Mate values are stored as distances from the stored node, and not
+        from the root, so that they can be used at any ply
+        """
+        if self.valuator.is_mate(value):
+            return value + ply if value > 0 else value - ply
+        return value
+
+    def _from_table(self, value, ply):
+        """
+        Value of a table entry seen at ply, see _to_table
+        """
+        if self.valuator.is_mate(value):
+            return value - ply if value > 0 else value + ply
+        return value
+
+    def _store(self, key, depth, alpha, beta, value, move, ply=0):
+        """
+        Save a search result into the transposition table with its bound type
+        :param alpha: lower bound of the search window
+        :param beta: upper bound of the search window
+        :param ply: distance from the root node
+        """
+        if value <= alpha:
+            flag = TranspositionTable.UPPER
+        elif value >= beta:
+            flag = TranspositionTable.LOWER
+        else:
+            flag = TranspositionTable.EXACT
+        self.table.store(key, depth, flag, self._to_table(value, ply), move)
+
+    def principal_variation(self, node, depth):
+        """
+        Follow the best moves stored in the transposition table
+        :param depth: maximum length of the variation
+        :return: list of moves
+        """
+        pv = []
+        for _ in range(depth):
+            entry = self.table.probe(node.key())
+            if entry is None or entry[3] is None or \
+                    not node.board.is_legal(entry[3]):
+                break
+            pv.append(entry[3])
+            node.push(entry[3])
+        for _ in pv:
+            node.pop()
+        return pv
+
+    def _search_root(self, node, depth, alpha=None, beta=None):
+        """
+        Search the root node at a fixed depth
+        :param alpha: lower bound of the search window, none by default
+        :param beta: upper bound of the search window, none by default
+        :return: best value and best move
+        """
+        key = node.key()
+        entry = self.table.probe(key)
+        tt_move = entry[3] if entry is not None else None
+
+        if alpha is None:
+            alpha = self.valuator.MINVALUE
+        if beta is None:
+            beta = self.valuator.MAXVALUE
+        best_val, best_move = self._search_moves(node, depth, alpha, beta,
+                0, tt_move, node.board.is_check())
+        self._store(key, depth, alpha, beta, best_val, best_move)
+        return best_val, best_move
+
+    def _aspiration_search(self, node, depth, previous):
+        """
+        Search the root node with a narrow window around the value of the
+        previous iteration, widened each time the value falls outside
+        :param previous: value of the previous iteration or None
+        :return: best value and best move
+        """
+        if not self.use_aspiration or previous is None or \
+                depth < self.ASPIRATION_MIN_DEPTH or \
+                self.valuator.is_mate(previous):
+            return self._search_root(node, depth)
+
+        delta = self.ASPIRATION_WINDOW * 10
+        alpha, beta = previous - delta, previous + delta
+        while True:
+            val, move = self._search_root(node, depth, alpha, beta)
+            if val <= alpha and alpha > self.valuator.MINVALUE:
+                alpha = max(val - delta, self.valuator.MINVALUE)
+            elif val >= beta and beta < self.valuator.MAXVALUE:
+                beta = min(val + delta, self.valuator.MAXVALUE)
+            else:
+                return val, move
+            self.stats.aspiration_researches += 1
+            delta *= 2
+
+    def next_move(self, node, movetime=None, nodes=None, start_depth=1):
+        """
+        Best move of a node, see search
+        :return: chess.Move
+        """
+        move, _ = self.search(node, movetime=movetime, nodes=nodes,
+                start_depth=start_depth)
+        return move
+
+    def search(self, node, movetime=None, nodes=None, start_depth=1,
+            profile=None):
+        """
+        Search the best move of a node and collect statistics
+        :param movetime: time budget in milliseconds
+        :param nodes: nodes budget
+        :param start_depth: depth of the first iteration
+        :param profile: optional profiler, one of stats.PROFILERS
+        :return: best move and SearchStats
+        """
+        self.stats = SearchStats()
+        if self.timing:
+            self.stats.movegen_time = 0.
+            self.stats.eval_time = 0.
+
+        if profile is None:
+            move = self._iterative_deepening(node, movetime, nodes,
+                    start_depth)
+        else:
+            move, self.stats.profile = profile_call(profile,
+                    self._iterative_deepening, node, movetime, nodes,
+                    start_depth)
+        return move, self.stats
+
+    def _iterative_deepening(self, node, movetime, nodes, start_depth):
+        """
+        Iterative deepening search of the best move. Depths 1, 2, 3... are
+        searched until max_depth is reached or the budget is exhausted.
+        The best move of the previous iteration is searched first.
+        :param movetime: time budget in milliseconds
+        :param nodes: nodes budget
+        :param start_depth: depth of the first iteration
+        :return: best move of the last completed iteration
+        """
+        b = node.board
+        root_ply = len(b.move_stack)
+        stats = self.stats
+
+        start = time.time()
+        if self.book is not None:
+            book_move = self.book.move(node)
+            if book_move is not None:
+                self.depth = 0
+                self.value = None
+                self.pv = [book_move]
+                stats.move = book_move
+                stats.pv = self.pv
+                stats.book = True
+                stats.time = time.time() - start
+                if self.verbose:
+                    print("Book move: %s in %.6f seconds" % (book_move,
+                        stats.time))
+                return book_move
+
+        self.nodes = 0
+        self.qnodes = 0
+        self.seldepth = 0
+        self._max_nodes = None
+        self._deadline = None
+        if self.orderer is not None:
+            self.orderer.new_search()
+
+        evals, eval_hits = self.valuator.count, self.valuator.hits
+        tt_hits, tt_misses = self.table.hits, self.table.misses
+
+        max_depth = self.max_depth
+        if movetime is not None or nodes is not None:
+            max_depth = self.MAX_ITERATIVE_DEPTH
+
+        best_val, best_move = None, None
+        completed = 0
+        for depth in range(start_depth, max_depth + 1):
+            nodes_before, qnodes_before = self.nodes, self.qnodes
+            # the static value depends on the side to move, the value of an
+            # iteration is closer to the one two plies shallower
+            previous = None
+            if len(stats.iterations) >= 2:
+                previous = stats.iterations[-2]['value']
+            try:
+                val, move = self._aspiration_search(node, depth, previous)
+            except SearchTimeout:
+                while len(b.move_stack) > root_ply:
+                    node.pop()
+                break
+
+            best_val, best_move = val, move
+            completed = depth
+            # effective branching factor: growth of the tree from the
+            # previous depth
+            searched = self.nodes + self.qnodes - nodes_before - qnodes_before
+            ebf = None
+            if stats.iterations:
+                previous = stats.iterations[-1]
+                previous = previous['nodes'] + previous['qnodes']
+                ebf = searched / previous if previous else None
+            stats.iterations.append({'depth': depth,
+                'nodes': self.nodes - nodes_before,
+                'qnodes': self.qnodes - qnodes_before,
+                'ebf': ebf,
+                'time': time.time() - start,
+                'value': val,
+                'move': move.uci() if move else None})
+            if self.on_iteration is not None:
+                self.on_iteration({'depth': depth,
+                    'seldepth': self.seldepth,
+                    'nodes': self.nodes + self.qnodes,
+                    'time': time.time() - start,
+                    'value': val,
+                    'pv': self.principal_variation(node, depth)})
+
+            # The first iteration is always completed
+            if movetime is not None:
+                self._deadline = start + movetime / 1000.
+                if time.time() >= self._deadline:
+                    break
+            self._max_nodes = nodes
+
+            # No legal move or forced mate found
+            if best_move is None or self.valuator.is_mate(best_val):
+                break
+
+        self._deadline = None
+        self._max_nodes = None
+
+        # Stopped before the end of the first iteration
+        if best_move is None and completed == 0:
+            best_move = next(iter(self._ordered_moves(node, 0, None)), None)
+
+        self.depth = completed
+        self.value = best_val
+        self.pv = self.principal_variation(node, completed)
+
+        eta = time.time() - start
+        stats.move = best_move
+        stats.value = best_val
+        stats.pv = self.pv
+        stats.depth = completed
+        stats.seldepth = self.seldepth
+        stats.nodes = self.nodes
+        stats.qnodes = self.qnodes
+        stats.eval_hits = self.valuator.hits - eval_hits
+        stats.evals = self.valuator.count - evals - stats.eval_hits
+        stats.tt_hits = self.table.hits - tt_hits
+        stats.tt_misses = self.table.misses - tt_misses
+        stats.time = eta
+
+        if self.verbose:
+            print("Best value: %s -> %s : depth %d, explored %d nodes and %d "
+                    "quiescence nodes in %.3f seconds" % (best_val,
+                        str(best_move), completed, self.nodes, self.qnodes,
+                        eta))
+
+        return best_move
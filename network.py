@@ -0,0 +1,324 @@
+"""
+Value network implemented with NumPy only: a small multilayer perceptron
+trained on the datasets of process.DataSetBuilder, see train.py
+"""
+import numpy as np
+
+from valuator import Valuator, PLANES, board_to_bitboards
+from node import POSITION_DTYPE
+
+# Inputs of the network: the 12 piece planes and the side to move
+FEATURES = len(PLANES) * 64 + 1
+
+
+def bitboards_to_features(bitboards, turns):
+    """
+    Input features of N positions
+    bitboards: (N, 12) piece bitboards in PLANES order
+    turns: (N,) side to move, True for white
+    return: (N, FEATURES) float array
+    """
+    bitboards = np.asarray(bitboards, dtype='<u8').reshape(-1, len(PLANES))
+    features = np.empty((len(bitboards), FEATURES))
+    features[:, :-1] = np.unpackbits(np.ascontiguousarray(
+        bitboards).view(np.uint8), bitorder='little').reshape(
+                len(bitboards), -1)
+    features[:, -1] = np.asarray(turns, dtype=bool)
+    return features
+
+
+def boards_to_features(boards):
+    """
+    Input features of a list of chess.Board
+    return: (N, FEATURES) float array
+    """
+    return bitboards_to_features([board_to_bitboards(b) for b in boards],
+            [b.turn for b in boards])
+
+
+def positions_to_features(positions):
+    """
+    Input features of compact positions, see node.encode_boards
+    positions: (N,) array of POSITION_DTYPE
+    return: (N, FEATURES) float array
+    """
+    if positions.dtype != POSITION_DTYPE:
+        raise Exception("Positions must be compact positions, not %s" %
+                positions.dtype)
+    return bitboards_to_features(positions['bitboards'],
+            positions['flags'] & 1)
+
+
+class ValueNetwork:
+    """
+    Multilayer perceptron with ReLU hidden layers and a softmax over the
+    three outcomes of the dataset labels: white wins, draw, black wins
+    """
+
+    HIDDEN_SIZES = (64, 32)
+    OUTPUTS = 3
+
+    def __init__(self, weights, biases):
+        """
+        weights: list of (inputs, outputs) arrays, one per layer
+        biases: list of (outputs,) arrays
+        """
+        if len(weights) != len(biases) or not weights:
+            raise Exception("Each layer needs weights and biases.")
+        if weights[0].shape[0] != FEATURES or \
+                weights[-1].shape[1] != self.OUTPUTS:
+            raise Exception("Network must map %d features to %d outputs." %
+                    (FEATURES, self.OUTPUTS))
+        self.weights = [np.asarray(w, dtype=float) for w in weights]
+        self.biases = [np.asarray(b, dtype=float) for b in biases]
+
+    @classmethod
+    def random(cls, hidden_sizes=HIDDEN_SIZES, seed=None):
+        """
+        Network with He initialized weights
+        hidden_sizes: number of units of each hidden layer
+        """
+        rng = np.random.RandomState(seed)
+        sizes = [FEATURES] + list(hidden_sizes) + [cls.OUTPUTS]
+        weights = [rng.randn(n, m) * np.sqrt(2. / n)
+                for n, m in zip(sizes, sizes[1:])]
+        biases = [np.zeros(m) for m in sizes[1:]]
+        return cls(weights, biases)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a network saved by save
+        path: .npz file
+        """
+        with np.load(path) as data:
+            layers = len([k for k in data.files if k.startswith('w')])
+            return cls([data['w%d' % i] for i in range(layers)],
+                    [data['b%d' % i] for i in range(layers)])
+
+    def save(self, path):
+        """
+        Save the weights in a .npz file, w0, b0, w1, b1... arrays
+        """
+        arrays = {}
+        for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+            arrays['w%d' % i] = w
+            arrays['b%d' % i] = b
+        np.savez(path, **arrays)
+
+    def forward(self, features):
+        """
+        Activations of each layer, the last one are the logits
+        features: (N, FEATURES) array
+        return: list of arrays
+        """
+        activations = [np.asarray(features, dtype=float)]
+        last = len(self.weights) - 1
+        for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+            x = activations[-1] @ w + b
+            if i < last:
+                np.maximum(x, 0, out=x)
+            activations.append(x)
+        return activations
+
+    def _probabilities(self, x):
+        """
+        Outcome probabilities from the first layer before its activation
+        x: (N, units of the first layer) array
+        """
+        for w, b in zip(self.weights[1:], self.biases[1:]):
+            x = np.maximum(x, 0) @ w + b
+        x -= x.max(axis=1, keepdims=True)
+        probabilities = np.exp(x)
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+    def predict(self, features):
+        """
+        Outcome probabilities of N positions
+        features: (N, FEATURES) array
+        return: (N, 3) array
+        """
+        return self._probabilities(np.asarray(features, dtype=float) @
+                self.weights[0] + self.biases[0])
+
+    def _first_layer(self, features):
+        """
+        First layer of one position before its activation, from the rows of
+        the features set: a position only sets about 33 of them
+        features: (FEATURES,) array
+        """
+        return self.weights[0][np.flatnonzero(features)].sum(axis=0) + \
+                self.biases[0]
+
+    def predict_one(self, features):
+        """
+        Outcome probabilities of one position, see predict
+        features: (FEATURES,) array
+        return: (3,) array
+        """
+        return self._probabilities(self._first_layer(features)[None])[0]
+
+    def predict_children(self, features, starts, columns, signs):
+        """
+        Outcome probabilities of positions differing from a parent position
+        by a few features. The first layer of each child is the one of the
+        parent updated with the rows of the changed features, which is much
+        cheaper than multiplying all features again.
+        features: (FEATURES,) features of the parent
+        starts: (N,) index of the first change of each child, the changes
+        of a child are contiguous
+        columns: (M,) feature changed
+        signs: (M,) 1 when the feature is set, -1 when it is cleared
+        return: (N, 3) array
+        """
+        changes = self.weights[0][columns] * np.asarray(signs,
+                dtype=float)[:, None]
+        return self._probabilities(self._first_layer(features) +
+                np.add.reduceat(changes, starts))
+
+    def gradients(self, features, labels):
+        """
+        Cross entropy loss of a batch and its gradients
+        features: (N, FEATURES) array
+        labels: (N, 3) one-hot or soft labels
+        return: loss, list of weights gradients, list of biases gradients
+        """
+        activations = self.forward(features)
+        logits = activations[-1]
+        logits -= logits.max(axis=1, keepdims=True)
+        log_probabilities = logits - np.log(np.exp(logits).sum(axis=1,
+            keepdims=True))
+        labels = np.asarray(labels, dtype=float)
+        n = len(features)
+        loss = -float((labels * log_probabilities).sum()) / n
+
+        delta = (np.exp(log_probabilities) - labels) / n
+        weights_gradients = [None] * len(self.weights)
+        biases_gradients = [None] * len(self.weights)
+        for i in reversed(range(len(self.weights))):
+            weights_gradients[i] = activations[i].T @ delta
+            biases_gradients[i] = delta.sum(axis=0)
+            if i:
+                delta = (delta @ self.weights[i].T) * (activations[i] > 0)
+        return loss, weights_gradients, biases_gradients
+
+
+class NetworkValuator(Valuator):
+    """
+    Valuator using a ValueNetwork as static value. The game over detection,
+    the mate values and the memory are the ones of Valuator.
+
+    With batch, the search calls prefetch on its frontier nodes: all their
+    children are evaluated at once, without playing the moves, from the
+    first layer of the node updated with the pieces each move changes.
+    """
+
+    # Value of a certain win for white, the expected score is scaled to it
+    VALUE_SCALE = 10000
+
+    # Maximum number of prefetched nodes kept in memory
+    FRONTIER_SIZE = 1 << 12
+
+    # Index of the first feature of each (color, piece type) plane
+    PLANE_OFFSETS = {plane: 64 * i for i, plane in enumerate(PLANES)}
+
+    def __init__(self, network, memory_size=Valuator.MEMORY_SIZE,
+            batch=True):
+        """
+        network: ValueNetwork, or path of a .npz file
+        batch: evaluate the children of frontier nodes at once
+        """
+        super().__init__(memory_size)
+        if isinstance(network, str):
+            network = ValueNetwork.load(network)
+        self.network = network
+        self.batch = batch
+        # values of the children of the prefetched nodes: node key -> move
+        # -> value
+        self.frontier = {}
+        # number of batches and of positions evaluated in them
+        self.batches = 0
+        self.batch_evals = 0
+
+    def _to_values(self, probabilities):
+        """
+        Expected score of white scaled to VALUE_SCALE
+        probabilities: (N, 3) white wins, draw, black wins, the order of
+        the dataset labels, see DataSetBuilder._result_to_label
+        return: (N,) int array
+        """
+        scores = probabilities[:, 0] - probabilities[:, 2]
+        return np.rint(scores * self.VALUE_SCALE).astype(int)
+
+    def batch_values(self, features):
+        """
+        Values of N positions, positive for white
+        features: (N, FEATURES) array
+        return: (N,) int array
+        """
+        return self._to_values(self.network.predict(features))
+
+    def static_value(self, node):
+        """
+        Value of a position that is not over, from one pass of the network
+        unless it is the child of a prefetched node
+        node: Node
+        return: int
+        """
+        board = node.board
+        if self.frontier:
+            values = self.frontier.get(node.parent_key())
+            if values is not None and board.move_stack:
+                value = values.get(board.peek())
+                if value is not None:
+                    return value
+
+        features = bitboards_to_features([board_to_bitboards(board)],
+                [board.turn])[0]
+        return int(self._to_values(self.network.predict_one(features)[None])[0])
+
+    def prefetch(self, node, moves):
+        """
+        Evaluate the positions reached by moves from node at once, their
+        values are used by static_value
+        node: Node
+        moves: iterable of legal moves of node
+        return: number of evaluated positions
+        """
+        if not self.batch:
+            return 0
+        moves = list(moves)
+        if not moves:
+            return 0
+
+        board = node.board
+        features = bitboards_to_features([board_to_bitboards(board)],
+                [board.turn])[0]
+        # the pieces moved and the side to move
+        turn = -1 if board.turn else 1
+        starts = []
+        columns = []
+        signs = []
+        for move in moves:
+            starts.append(len(columns))
+            for piece_type, color, square, sign in node.move_pieces(move):
+                columns.append(self.PLANE_OFFSETS[color, piece_type] +
+                        square)
+                signs.append(sign)
+            columns.append(FEATURES - 1)
+            signs.append(turn)
+
+        values = self._to_values(self.network.predict_children(features,
+            starts, columns, signs))
+        if len(self.frontier) >= self.FRONTIER_SIZE:
+            self.frontier.clear()
+        self.frontier[node.key()] = dict(zip(moves, values.tolist()))
+        self.batches += 1
+        self.batch_evals += len(moves)
+        return len(moves)
+
+    def reset(self):
+        super().reset()
+        self.frontier.clear()
+        self.batches = 0
+        self.batch_evals = 0
@@ -1,5 +1,101 @@
+
 import chess
+import chess.polyglot
 import numpy as np
+from valuator import Valuator, PLANES, board_to_bitboards
+
+# Zobrist keys use the Polyglot random array so that node keys are
+# compatible with chess.polyglot.zobrist_hash
+ZOBRIST = chess.polyglot.POLYGLOT_RANDOM_ARRAY
+zobrist_hasher = chess.polyglot.ZobristHasher(ZOBRIST)
+
+
+def zobrist_piece(piece_type, color, square):
+    """
+    Return the zobrist key of a piece standing on a square
+    """
+    return ZOBRIST[64 * ((piece_type - 1) * 2 + int(color)) + square]
+
+
+# Compact encoding of a position (102 bytes): the 12 piece bitboards in
+# PLANES order and a header with the side to move (bit 0) and castling
+# rights (bits 1 to 4: K, Q, k, q), the en passant square (64 if none)
+# and the move counters.
+POSITION_DTYPE = np.dtype([
+    ('bitboards', '<u8', (len(PLANES),)),
+    ('flags', 'u1'),
+    ('ep', 'u1'),
+    ('halfmove', '<u2'),
+    ('fullmove', '<u2')])
+
+NO_EP_SQUARE = 64
+
+# Castling rights bits and the rook square they stand for
+CASTLING_SQUARES = [chess.H1, chess.A1, chess.H8, chess.A8]
+
+
+def board_record(board):
+    """
+    Fields of the compact encoding of a board, see POSITION_DTYPE
+    board: chess.Board
+    return: tuple
+    """
+    flags = int(board.turn)
+    for i, square in enumerate(CASTLING_SQUARES):
+        if board.castling_rights & chess.BB_SQUARES[square]:
+            flags |= 2 << i
+    return (board_to_bitboards(board), flags,
+            NO_EP_SQUARE if board.ep_square is None else board.ep_square,
+            min(board.halfmove_clock, 0xffff),
+            min(board.fullmove_number, 0xffff))
+
+
+def encode_boards(boards):
+    """
+    Encode boards into a contiguous array of compact positions
+    boards: list of chess.Board
+    return: (N,) array of POSITION_DTYPE
+    """
+    return np.array([board_record(b) for b in boards], dtype=POSITION_DTYPE)
+
+
+def decode_position(position):
+    """
+    Decode a compact position back into a board
+    position: record of POSITION_DTYPE, or its 102 bytes
+    return: chess.Board
+    """
+    if not isinstance(position, np.void):
+        position = np.frombuffer(bytes(position), dtype=POSITION_DTYPE)[0]
+
+    board = chess.Board(None)
+    for (color, piece_type), bb in zip(PLANES, position['bitboards']):
+        for square in chess.scan_forward(int(bb)):
+            board.set_piece_at(square, chess.Piece(piece_type, color))
+
+    flags = int(position['flags'])
+    board.turn = bool(flags & 1)
+    for i, square in enumerate(CASTLING_SQUARES):
+        if flags & (2 << i):
+            board.castling_rights |= chess.BB_SQUARES[square]
+    ep = int(position['ep'])
+    board.ep_square = None if ep == NO_EP_SQUARE else ep
+    board.halfmove_clock = int(position['halfmove'])
+    board.fullmove_number = int(position['fullmove'])
+    return board
+
+
+def unpack_planes(encoded):
+    """
+    Unpack compact positions into a (N, 12, 64) bool array, without any
+    Python loop over squares
+    encoded: (N,) array of POSITION_DTYPE
+    return: numpy array, see valuator.boards_to_planes
+    """
+    bitboards = np.ascontiguousarray(encoded['bitboards'], dtype='<u8')
+    bits = np.unpackbits(bitboards.view(np.uint8), bitorder='little')
+    return bits.reshape(-1, len(PLANES), 64).astype(bool)
+
 
 class Node(object):
     """
@@ -12,23 +108,158 @@ class Node(object):
             self.board = chess.Board()
         else:
             self.board = board
+        self._sync()
+
+    def _sync(self):
+        """
+        Recompute the zobrist key and the evaluation totals from scratch.
+        Used at creation and whenever the board has been modified without
+        going through the node.
+        """
+        material = 0
+        squares = [0, 0]
+        for square, piece in self.board.piece_map().items():
+            material += Valuator.PIECES_VALUES[piece.piece_type] * \
+                    (1 if piece.color else -1)
+            squares[piece.color] += \
+                    Valuator.SQUARE_TABLES[piece.color][piece.piece_type][square]
+
+        # stack of (key, material, black squares, white squares)
+        self._states = [(zobrist_hasher(self.board), material,
+            squares[chess.BLACK], squares[chess.WHITE])]
+        self._base = len(self.board.move_stack)
+
+    def _state_key(self):
+        """
+        Zobrist key of the castling rights, en passant file and turn
+        """
+        return (zobrist_hasher.hash_castling(self.board) ^
+                zobrist_hasher.hash_ep_square(self.board) ^
+                zobrist_hasher.hash_turn(self.board))
+
+    def move_pieces(self, move):
+        """
+        Pieces removed from and added to the board by a move, computed
+        before the move is pushed.
+        return: list of (piece_type, color, square, sign) where sign is -1
+        for a removed piece and 1 for an added one
+        """
+        b = self.board
+        if not move:
+            return []
+
+        turn = b.turn
+        piece_type = b.piece_type_at(move.from_square)
+        pieces = [(piece_type, turn, move.from_square, -1),
+                (move.promotion or piece_type, turn, move.to_square, 1)]
+
+        if piece_type == chess.KING and b.is_castling(move):
+            # python-chess only generates standard castling moves here
+            rank = move.to_square & ~7
+            if move.to_square > move.from_square:
+                rook_from, rook_to = rank + 7, rank + 5
+            else:
+                rook_from, rook_to = rank, rank + 3
+            pieces.append((chess.ROOK, turn, rook_from, -1))
+            pieces.append((chess.ROOK, turn, rook_to, 1))
+        elif piece_type == chess.PAWN and b.is_en_passant(move):
+            captured = move.to_square + (-8 if turn == chess.WHITE else 8)
+            pieces.append((chess.PAWN, not turn, captured, -1))
+        else:
+            captured = b.piece_type_at(move.to_square)
+            if captured:
+                pieces.append((captured, not turn, move.to_square, -1))
+
+        return pieces
+
+    def _check_sync(self):
+        if len(self._states) != len(self.board.move_stack) - self._base + 1:
+            self._sync()
 
     def key(self):
         """
-        Return a hash of the node
+        Return the zobrist key of the node. The key is updated incrementally
+        by push and pop.
+        """
+        self._check_sync()
+        return self._states[-1][0]
+
+    def parent_key(self):
+        """
+        Return the zobrist key of the position before the last move, or None
+        if the node doesn't know it
         """
-        return hash((self.board.board_fen(), self.board.turn,
-                self.board.castling_rights, self.board.ep_square))
+        self._check_sync()
+        if len(self._states) < 2:
+            return None
+        return self._states[-2][0]
 
+    def evaluation(self):
+        """
+        Return the running material (white minus black) and piece-square
+        totals of both colors, updated incrementally by push and pop.
+        return: material, [black squares, white squares]
+        """
+        self._check_sync()
+        _, material, black, white = self._states[-1]
+        return material, [black, white]
+
+    def push(self, move):
+        """
+        Play a move on the board and update the zobrist key and the
+        evaluation totals
+        move: chess.Move
+        """
+        self._check_sync()
+        key, material, black, white = self._states[-1]
+        squares = [black, white]
+
+        key ^= self._state_key()
+        for piece_type, color, square, sign in self.move_pieces(move):
+            key ^= zobrist_piece(piece_type, color, square)
+            value = Valuator.PIECES_VALUES[piece_type] * sign
+            material += value if color else -value
+            squares[color] += \
+                    Valuator.SQUARE_TABLES[color][piece_type][square] * sign
+
+        self.board.push(move)
+        key ^= self._state_key()
+        self._states.append((key, material, squares[chess.BLACK],
+            squares[chess.WHITE]))
+
+    def pop(self):
+        """
+        Take back the last move
+        return: chess.Move
+        """
+        move = self.board.pop()
+        if len(self._states) > 1:
+            self._states.pop()
+        else:
+            self._sync()
+        return move
+
+    def reset(self):
+        """
+        Reset the board to the starting position
+        """
+        self.board.reset()
+        self._sync()
 
     def serialize(self):
         """
-        This method return a 1*64 numpy array as a representation of the state
-        It will be necessary for the NeuralNet
+        This method return the compact encoding of the state, a record of
+        POSITION_DTYPE (102 bytes). It will be necessary for the NeuralNet
+        """
+        return encode_boards([self.board])[0]
+
+    @classmethod
+    def deserialize(cls, state):
+        """
+        Build a node from the output of serialize
+        return: Node
         """
-        state = np.zeros(64, np.uint8)
-        # TODO: Implement serialize method
-        return state
+        return cls(decode_position(state))
 
     def edges(self):
         """
@@ -37,5 +268,3 @@ class Node(object):
         """
 
         return list(self.board.legal_moves)
-
-
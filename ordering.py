@@ -0,0 +1,194 @@
+
+import chess
+from valuator import Valuator
+
+
+def mvv_lva(board, move):
+    """
+    Most Valuable Victim - Least Valuable Attacker score of a capture
+    board: chess.Board before the move
+    move: capture or promotion
+    return: int, higher is better
+    """
+    values = Valuator.PIECES_VALUES
+    if board.is_en_passant(move):
+        victim = chess.PAWN
+    else:
+        victim = board.piece_type_at(move.to_square)
+
+    score = 0
+    if victim:
+        score += values[victim] * 100
+    if move.promotion:
+        score += values[move.promotion] * 100
+    return score - values[board.piece_type_at(move.from_square)]
+
+
+class MoveOrderer:
+    """
+    Staged move generator that yields the most promising moves first:
+    the transposition table move, captures by MVV-LVA, killer moves and
+    then quiet moves sorted by the history heuristic.
+
+    Each stage is only generated once the previous one is exhausted, so
+    nothing else is generated when the first move produces a cutoff.
+    """
+
+    MAX_PLY = 128
+    KILLERS = 2
+
+    def __init__(self):
+        self.killers = [[None] * self.KILLERS for _ in range(self.MAX_PLY)]
+        # history[color][from_square * 64 + to_square]
+        self.history = [[0] * 64 * 64, [0] * 64 * 64]
+
+    def moves(self, board, ply, tt_move=None):
+        """
+        Generate legal moves of a board, best ones first.
+        The board must be back in the same state each time a move is
+        requested.
+        board: chess.Board
+        ply: distance from the root
+        tt_move: move to search first, usually from the transposition table
+        """
+        if tt_move is not None and board.is_legal(tt_move):
+            yield tt_move
+        else:
+            tt_move = None
+
+        # Captures and promotions
+        captures = list(board.generate_legal_captures())
+        captures.extend(board.generate_legal_moves(board.pawns,
+                chess.BB_BACKRANKS & ~board.occupied))
+        if tt_move is not None and tt_move in captures:
+            captures.remove(tt_move)
+        captures.sort(key=lambda m: mvv_lva(board, m), reverse=True)
+        for m in captures:
+            yield m
+
+        # Killer moves
+        killers = []
+        if ply < self.MAX_PLY:
+            for m in self.killers[ply]:
+                if m is not None and m != tt_move and \
+                        not m.promotion and not board.is_capture(m) and \
+                        board.is_legal(m):
+                    killers.append(m)
+                    yield m
+
+        # Remaining quiet moves
+        history = self.history[board.turn]
+        quiets = [m for m in board.generate_legal_moves(chess.BB_ALL,
+                ~board.occupied_co[not board.turn])
+                if not m.promotion and not board.is_en_passant(m) and
+                m != tt_move and m not in killers]
+        quiets.sort(key=lambda m: history[m.from_square * 64 + m.to_square],
+                reverse=True)
+        for m in quiets:
+            yield m
+
+    def cutoff(self, board, move, ply, depth):
+        """
+        Remember a quiet move that produced a beta cutoff
+        board: chess.Board before the move
+        depth: remaining depth of the node
+        """
+        if move.promotion or board.is_capture(move):
+            return
+
+        if ply < self.MAX_PLY:
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers[1:] = killers[:-1]
+                killers[0] = move
+
+        self.history[board.turn][move.from_square * 64 + move.to_square] += \
+                depth * depth
+
+    def new_search(self):
+        """
+        Forget killer moves and age the history table between searches
+        """
+        for killers in self.killers:
+            killers[:] = [None] * self.KILLERS
+        for history in self.history:
+            for i in range(len(history)):
+                history[i] >>= 1
+
+
+def attackers_mask(board, square, occupied):
+    """
+    Bitboard of the pieces of both colors attacking a square, with a given
+    occupancy so that pieces can be removed during an exchange
+    """
+    rank_pieces = chess.BB_RANK_MASKS[square] & occupied
+    file_pieces = chess.BB_FILE_MASKS[square] & occupied
+    diag_pieces = chess.BB_DIAG_MASKS[square] & occupied
+
+    queens_and_rooks = board.queens | board.rooks
+    queens_and_bishops = board.queens | board.bishops
+
+    attackers = (
+        (chess.BB_KING_ATTACKS[square] & board.kings) |
+        (chess.BB_KNIGHT_ATTACKS[square] & board.knights) |
+        (chess.BB_RANK_ATTACKS[square][rank_pieces] & queens_and_rooks) |
+        (chess.BB_FILE_ATTACKS[square][file_pieces] & queens_and_rooks) |
+        (chess.BB_DIAG_ATTACKS[square][diag_pieces] & queens_and_bishops) |
+        (chess.BB_PAWN_ATTACKS[chess.WHITE][square] & board.pawns &
+            board.occupied_co[chess.BLACK]) |
+        (chess.BB_PAWN_ATTACKS[chess.BLACK][square] & board.pawns &
+            board.occupied_co[chess.WHITE]))
+
+    return attackers & occupied
+
+
+def see(board, move):
+    """
+    Static Exchange Evaluation: material won by the side to move after all
+    the captures on the destination square of a move
+    board: chess.Board before the move
+    move: chess.Move
+    return: int, in Valuator.PIECES_VALUES units
+    """
+    values = Valuator.PIECES_VALUES
+    to_square = move.to_square
+    occupied = board.occupied ^ chess.BB_SQUARES[move.from_square]
+
+    if board.is_en_passant(move):
+        captured = values[chess.PAWN]
+        occupied ^= chess.BB_SQUARES[to_square ^ 8]
+    else:
+        victim = board.piece_type_at(to_square)
+        captured = values[victim] if victim else 0
+
+    attacker = board.piece_type_at(move.from_square)
+    if move.promotion:
+        captured += values[move.promotion] - values[chess.PAWN]
+        attacker = move.promotion
+
+    gain = [captured]
+    color = not board.turn
+    while True:
+        attackers = attackers_mask(board, to_square, occupied)
+        own = attackers & board.occupied_co[color]
+        if not own:
+            break
+
+        for piece_type in chess.PIECE_TYPES:
+            bb = own & board.pieces_mask(piece_type, color)
+            if bb:
+                break
+
+        # The king can't capture a defended piece
+        if piece_type == chess.KING and \
+                attackers & board.occupied_co[not color]:
+            break
+
+        gain.append(values[attacker] - gain[-1])
+        attacker = piece_type
+        occupied ^= chess.BB_SQUARES[chess.lsb(bb)]
+        color = not color
+
+    for i in range(len(gain) - 1, 0, -1):
+        gain[i - 1] = -max(-gain[i - 1], gain[i])
+    return gain[0]
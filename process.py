@@ -6,22 +6,39 @@ Pre-process the PGN files
 import re
 import os
 import json
+import time
 import chess
 import multiprocessing
 import numpy as np
 
 from valuator import Valuator
-from node import Node
+from node import Node, POSITION_DTYPE, board_record, unpack_planes
+from transposition import move_to_code, code_to_move
 
 
 class GameParser:
     """
     Process data and convert them into numpy arrays
     All files must be PGN files
+
+    Games are streamed from the PGN files to line-delimited JSON files (one
+    game per line), so memory usage doesn't depend on the size of the files.
+    Moves are stored as 16 bits codes (see transposition.move_to_code), so
+    games are replayed without parsing SAN again.
     """
+
+    # Tokens of the movetext that are not moves
+    COMMENT_RE = re.compile(r'\{[^}]*\}|;[^\n]*')
+    VARIATION_RE = re.compile(r'\([^()]*\)')
+    NOISE_RE = re.compile(r'\$\d+|[1-9][0-9]*\.(\.\.)?')
+    RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+    # Number of games between two progress reports
+    REPORT_INTERVAL = 10000
+
     def __init__(self, data_path, destination):
         """
-        Verify all paths and init processed list.
+        Verify all paths.
         """
 
         if not os.path.exists(data_path):
@@ -33,74 +50,177 @@ class GameParser:
         self.data_path = data_path
         self.destination_path = destination
 
-        self.processed = []
-
     def _to_result(self, str_result):
         """
-        Return a game result from a string
+        Return a game result from a string: 1. when white wins, 0. when
+        black wins and 0.5 otherwise
         """
         if str_result == '1-0':
-            return 0.
-        if str_result == '0-1':
             return 1.
+        if str_result == '0-1':
+            return 0.
         return 0.5
 
-    def _parse_games(self, data_file):
+    def _parse_movetext(self, movetext, result_header):
+        """
+        Parse the movetext of a game
+        movetext: all the movetext lines of a game
+        result_header: value of the Result tag, or None
+
+        return: dict with the list of moves codes and the result, or None if
+        the game must be skipped
+        """
+        # Avoid all game winned by disconnection
+        if "by disconnection" in movetext:
+            return None
+
+        text = self.COMMENT_RE.sub(' ', movetext)
+        # remove nested variations from the inside out
+        while '(' in text:
+            cleaned = self.VARIATION_RE.sub(' ', text)
+            if cleaned == text:
+                break
+            text = cleaned
+        text = self.NOISE_RE.sub(' ', text)
+
+        moves = []
+        result = result_header
+        for token in text.split():
+            if token in self.RESULTS:
+                result = token
+            else:
+                moves.append(token)
+
+        if not moves:
+            return None
+
+        # SAN moves are only parsed here, games with an illegal move are
+        # skipped
+        board = chess.Board()
+        codes = []
+        try:
+            for san in moves:
+                move = board.parse_san(san)
+                codes.append(move_to_code(move))
+                board.push(move)
+        except ValueError:
+            return None
+
+        return {'moves': codes, 'result': self._to_result(result)}
+
+    def iter_games(self, data_file):
         """
-        Process PGN file. Avoid all game winned by disconnection"
+        Generator of the games of a PGN file, parsed one at a time.
+        Movetext can span several lines.
         """
-        disconnection = "by disconnection"
+        result_header = None
+        movetext = []
         with open(data_file, 'r') as data:
-            print("Parsing %s" % data_file)
             for line in data:
-                if line[:2] == "1." or disconnection in line:
-                    end_idx = line.index('{')
-                    result_idx = line.index('}') + 1
-                    game_line = line[:end_idx]
-                    # clean line
-                    # game_line = game_line.replace('#', '').replace('+', '')
-                    game_line = re.sub(r'[1-9][0-9]*\.\s', '', game_line)
-                    result_str = line[result_idx:].replace(' ',
-                            '').replace('\n', '')
-                    game_result = self._to_result(result_str)
-                    parsed_game = game_line.strip().split(' ')
-                    if parsed_game[-1] == '':
-                        del parsed_game[-1]
-
-                    self.processed.append({'game': parsed_game,
-                        'result': game_result})
-
-    def _save_processed_games(self, destination):
-        """
-        Save processed games into json file.
+                line = line.strip()
+                if line.startswith('['):
+                    # a new header section ends the previous game
+                    if movetext:
+                        game = self._parse_movetext(' '.join(movetext),
+                                result_header)
+                        if game is not None:
+                            yield game
+                        movetext = []
+                        result_header = None
+                    if line.startswith('[Result '):
+                        result_header = line.split('"')[1]
+                elif line:
+                    movetext.append(line)
+
+        if movetext:
+            game = self._parse_movetext(' '.join(movetext), result_header)
+            if game is not None:
+                yield game
+
+    def _parse_games(self, data_file, destination):
+        """
+        Process PGN file and write the games in a line-delimited JSON file.
+        return: number of games
         """
+        print("Parsing %s" % data_file)
+        start = time.time()
+        count = 0
         with open(destination, 'w') as output:
-            json.dump(self.processed, output)
-            print("Saved %d processed games." % len(self.processed))
-            self.processed = []
-
+            for game in self.iter_games(data_file):
+                output.write(json.dumps(game))
+                output.write('\n')
+                count += 1
+                if count % self.REPORT_INTERVAL == 0:
+                    print("Parsed %d games (%.0f games/s)" % (count,
+                        count / (time.time() - start)))
+
+        eta = time.time() - start
+        print("Saved %d processed games in %.3f seconds (%.0f games/s)." %
+                (count, eta, count / eta if eta else 0))
+        return count
+
+    def _output_file(self, pgn_file):
+        """
+        Path of the line-delimited JSON file of a PGN file
+        """
+        name = os.path.basename(pgn_file)[:-len('pgn')] + 'jsonl'
+        if os.path.isdir(self.destination_path):
+            return os.path.join(self.destination_path, name)
+        return self.destination_path
 
     def run(self):
         """
         Parse all game for all pgn files in data_path
         """
         if os.path.isfile(self.data_path) and self.data_path.endswith('.pgn'):
-            output_file = self.destination_path.replace('pgn', 'json')
-            self._parse_games(self.data_path)
-            self._save_processed_games(output_file)
+            self._parse_games(self.data_path,
+                    self._output_file(self.data_path))
         else:
             for f in os.listdir(self.data_path):
                 path = os.path.join(self.data_path, f)
                 if os.path.isfile(path) and f.endswith('pgn'):
-                    output_file = os.path.join(self.destination_path,
-                            f.replace('pgn', 'json'))
+                    self._parse_games(path, self._output_file(path))
+
+
+def read_games(path):
+    """
+    Generator of the parsed games of a line-delimited JSON file. Plain JSON
+    files holding a list of games are still supported.
+    """
+    with open(path, 'r') as f:
+        if not path.endswith('.jsonl'):
+            for game in json.load(f):
+                yield game
+            return
+
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def replay_moves(game, board):
+    """
+    Generator of the moves of a parsed game. The moves of games parsed
+    before moves codes were stored are SAN, parsed on board: each move
+    must be pushed on it before the next one is requested.
+    game: dict with the moves codes, or the SAN moves
+    board: chess.Board at the starting position
+    """
+    if 'moves' in game:
+        for code in game['moves']:
+            yield code_to_move(code)
+    else:
+        for san in game['game']:
+            yield board.parse_san(san)
 
-                    self._parse_games(path)
-                    self._save_processed_games(output_file)
 
 class DataSetBuilder:
     """
     Build data set from parsed game
+
+    Each game is replayed once: the compact encoding of its positions and
+    the labels of all the requested features types are extracted at once
+    into a record array, see records_dtype.
     """
 
     # Available features types to extract
@@ -108,6 +228,12 @@ class DataSetBuilder:
     MATERIAL = "material"
     PIECE_SQUARE = "square"
     LEGAL_MOVES = "moves"
+    FEATURES_TYPES = (RESULT, MATERIAL, PIECE_SQUARE, LEGAL_MOVES)
+
+    # Number of games of a shard
+    CHUNK_SIZE = 1000
+
+    MANIFEST_VERSION = 2
 
     def __init__(self, data_path, destination_path):
         if not os.path.exists(data_path):
@@ -117,173 +243,336 @@ class DataSetBuilder:
         self.destination_path = destination_path
         self.valuator = Valuator()
 
+    def records_dtype(self, features_types):
+        """
+        Record of a position: its compact encoding, zobrist key, results
+        counts (see _game_to_dataset) and a one-hot label for each feature
+        type, [1-0-0] or [0-0-1] or [0-1-0] if white wins, black wins or
+        even
+        features_types: list of features types
+        return: numpy dtype
+        """
+        for ftype in features_types:
+            if ftype not in self.FEATURES_TYPES:
+                raise Exception("Unknown feature type: %s" % ftype)
+        fields = [('position', POSITION_DTYPE), ('key', '<u8'),
+                ('stats', '<u4', (3,))]
+        fields.extend((ftype, 'i1', (3,)) for ftype in features_types)
+        return np.dtype(fields)
+
     def _result_to_label(self, result):
+        """
+        One-hot label of a game result, see GameParser._to_result
+        """
         if result == 1:
             return np.array([1, 0, 0])
         elif result == 0:
             return np.array([0, 0, 1])
-        return np.array([0-1-0])
-
-    def _moves_to_label(self, node):
-        val = self.valuator.get_number_of_legal_moves_value(node.board)
-        if val < 0:
-            return np.array([0, 0, 1])
-        if val > 0:
-            return np.array([1, 0, 0])
-        return np.array([0, 1, 0])
-
-    def _material_to_label(self, node):
-        val = self.valuator.get_material_value(node.board)
-        if val < 0:
-            return np.array([0, 0, 1])
-        if val > 0:
-            return np.array([1, 0, 0])
-        return np.array([0, 1, 0])
-
-    def _square_to_label(self, node):
-        val = self.valuator.get_all_masks_value(node.board, node.board.turn)
-        if val < 0:
-            return np.array([0, 0, 1])
-        if val > 0:
-            return np.array([1, 0, 0])
         return np.array([0, 1, 0])
 
-
-    def _extract_label(self, node, result, feature_type):
+    def _values_to_labels(self, values):
         """
-        Extract the label for a specific feature
-        node: nnode with a board
-        result: result of the game 1, 0 or 0.5
-        feature_type: Look at available features types
-
-        return: [1-0-0] or [0-0-1] or [0-1-0] if white wins, black wins or
-        even
+        One-hot labels of the sign of values
+        values: (N,) array
+        return: (N, 3) array
         """
-        if feature_type == self.RESULT:
-            return self._result_to_label(result)
-
-        if feature_type == self.MATERIAL:
-            return self._material_to_label(node)
+        labels = np.zeros((len(values), 3), dtype=np.int8)
+        labels[values > 0, 0] = 1
+        labels[values == 0, 1] = 1
+        labels[values < 0, 2] = 1
+        return labels
 
-        if feature_type == self.LEGAL_MOVES:
-            return self._moves_to_label(node)
-
-        if feature_type == self.PIECE_SQUARE:
-            return self._square_to_label(node)
-
-
-    def _node_to_feature(self, node):
+    def _stats_to_labels(self, stats):
         """
-        Serialize a node into a numpy array
-        return: 1*64 numpy array
+        One-hot label of the most frequent result of each position
+        stats: (N, 3) results counts, in the order of _result_to_label
+        return: (N, 3) array
         """
-        feature = np.zeros(64)
-        pieces = node.board.piece_map()
-        for idx in pieces:
-            p = pieces[idx]
-            feature[idx] = self.valuator.piece_to_value(p.piece_type, p.color)
-        return feature
+        labels = np.zeros(stats.shape, dtype=np.int8)
+        labels[np.arange(len(stats)), np.argmax(stats, axis=1)] = 1
+        return labels
 
-    def _game_to_dataset(self, process_id, data, feature_type, features,
-            labels):
+    def _extract_labels(self, records, ftype, mobile):
         """
-        Transform a game to a dataset
-        process_id: process id
-        game: array of moves
-        result: result of the game
+        Labels of a feature type for all the positions at once
+        records: records of the positions, see records_dtype
+        mobile: (N,) bool array, the side to move has legal moves
 
-        return features, labels
+        return: (N, 3) array
         """
-        print("Starting extrating %s features with process %d" % (feature_type,
-            process_id))
+        if ftype == self.RESULT:
+            return self._stats_to_labels(records['stats'])
+
+        turns = (records['position']['flags'] & 1).astype(bool)
+        if ftype == self.LEGAL_MOVES:
+            # sign of Valuator.get_number_of_legal_moves_value
+            values = np.where(turns, 1, -1) * mobile
+            return self._values_to_labels(values)
+
+        planes = unpack_planes(records['position'])
+        if ftype == self.MATERIAL:
+            values = self.valuator.batch_material_value(planes)
+        else:
+            values = self.valuator.batch_mask_value(planes, turns)
+        return self._values_to_labels(values)
 
+    def _game_to_dataset(self, games, features_types, dedup=True):
+        """
+        Transform games to a dataset, each game is replayed once for all
+        the features types
+        games: list of parsed games
+        features_types: list of features types, see FEATURES_TYPES
+        dedup: keep each position once, with the results of all the games
+        it was reached in
+
+        return: (N,) array of records_dtype, stats are the results counts
+        of the positions
+        """
         node = Node()
         board = node.board
-        tfeatures = []
-        tlabels = []
-        count = 0
-        for game in data:
-            if count % 500 == 0:
-                print("Process %d completed %d/%d game" % (process_id, count,
-                    len(data)))
-
-            moves = game['game']
-            result = game['result']
-            board.reset()
-
-            for m in moves:
-                board.push_san(m)
-                tfeatures.append(self._node_to_feature(node))
-                tlabels.append(self._extract_label(node, result, feature_type))
-
-            count += 1
-
-        features.append(tfeatures)
-        labels.append(tlabels)
-
-    def _chunk(self, l, n):
+        index = {}
+        positions = []
+        keys = []
+        stats = []
+        # the legal moves label only needs to know if there is a legal move
+        mobile = []
+        with_moves = self.LEGAL_MOVES in features_types
+        for game in games:
+            outcome = self._result_to_label(game['result'])
+            node.reset()
+
+            for move in replay_moves(game, board):
+                node.push(move)
+                key = node.key()
+                if dedup and key in index:
+                    stats[index[key]] += outcome
+                    continue
+
+                index[key] = len(keys)
+                keys.append(key)
+                stats.append(outcome.copy())
+                positions.append(board_record(board))
+                if with_moves:
+                    mobile.append(any(board.generate_legal_moves()))
+
+        records = np.zeros(len(keys), dtype=self.records_dtype(
+            features_types))
+        if not len(records):
+            return records
+        records['position'] = np.array(positions, dtype=POSITION_DTYPE)
+        records['key'] = keys
+        records['stats'] = stats
+        mobile = np.array(mobile, dtype=bool)
+        for ftype in features_types:
+            records[ftype] = self._extract_labels(records, ftype, mobile)
+        return records
+
+    def _chunk(self, iterable, n):
         """
-        Split a list into evenly sized chunk
-        l: list to split
+        Split an iterable into evenly sized chunk
+        iterable: games to split, can be a generator
         n: chunk_size
-        return: list of slice
+        return: generator of lists
         """
-        slices = [l[i:i+n] for i in range(0, len(l), n)]
-        return slices
-
-    def _dispatch_job(self, feature_type, data, process_number):
+        chunk = []
+        for item in iterable:
+            chunk.append(item)
+            if len(chunk) == n:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _shard_path(self, shard):
+        return os.path.join(self.destination_path,
+                "positions-{:05d}.npy".format(shard))
+
+    def _build_shard(self, job):
         """
-        Dispatch a job on a list of data
-        feature_type: type of feature to extract
-        data: list
-        process_number: number of jobs
+        Build the dataset of a chunk of games and save it in a shard file.
+        Runs in the worker processes.
+        job: shard index, games, features types and dedup flag
 
-        return: list of jobs result
+        return: shard index, number of positions
         """
-        chunk_size = len(data)//process_number
-        slices = self._chunk(data, chunk_size)
-        features = []
-        labels = []
-        jobs = []
-        for i, chunk in enumerate(slices):
-            process = multiprocessing.Process(target=self._game_to_dataset,
-                    args=(i, chunk, feature_type, features, labels))
-            jobs.append(process)
-
-        for j in jobs:
-            j.start()
-
-        # flatten list
-        all_features = np.array(features).flatten()
-        all_labels = np.array(labels).flatten()
-
-        features_path = os.path.join(self.destination_path,
-                "feature-{}".format(feature_type))
-        np.save(features_path, all_features)
-
-        labels_path = os.path.join(self.destination_path,
-                "labels-{}".format(feature_type))
-        np.save(labels_path, all_labels)
+        shard, games, features_types, dedup = job
+        records = self._game_to_dataset(games, features_types, dedup)
+        np.save(self._shard_path(shard), records)
+        return shard, len(records)
 
+    def _deduplicate_shards(self, features_types, counts):
+        """
+        Remove positions found in several shards: the first occurrence is
+        kept with the results counts of all of them. Only the keys and
+        results counts of all shards are loaded at once.
+        counts: dict shard index -> number of positions, updated
 
+        return: number of removed positions
+        """
+        shards = sorted(counts)
+        if not shards:
+            return 0
+        keys = []
+        stats = []
+        for shard in shards:
+            records = np.load(self._shard_path(shard), mmap_mode='r')
+            keys.append(np.array(records['key']))
+            stats.append(np.array(records['stats']))
+            del records
+        keys = np.concatenate(keys)
+        stats = np.concatenate(stats).reshape(-1, 3)
+
+        _, first, inverse = np.unique(keys, return_index=True,
+                return_inverse=True)
+        inverse = inverse.reshape(-1)
+        totals = np.zeros((len(first), 3), dtype=np.uint32)
+        np.add.at(totals, inverse, stats)
+
+        # a position is kept if it is the first occurrence of its key
+        keep = np.zeros(len(keys), dtype=bool)
+        keep[first] = True
+
+        offset = 0
+        for shard in shards:
+            count = counts[shard]
+            shard_keep = keep[offset:offset + count]
+            path = self._shard_path(shard)
+            records = np.load(path)[shard_keep]
+            records['stats'] = totals[inverse[offset:offset + count][
+                shard_keep]]
+            if self.RESULT in features_types:
+                records[self.RESULT] = self._stats_to_labels(
+                        records['stats'])
+            offset += count
+            np.save(path, records)
+            counts[shard] = len(records)
+
+        return len(keys) - len(first)
+
+    def _merge_shards(self, counts):
+        """
+        Merge shard files into a single positions file
+        counts: dict shard index -> number of positions
+        return: name of the merged file
+        """
+        name = "positions.npy"
+        output = None
+        offset = 0
+        for shard in sorted(counts):
+            shard_path = self._shard_path(shard)
+            records = np.load(shard_path)
+            if output is None:
+                output = np.lib.format.open_memmap(os.path.join(
+                    self.destination_path, name), mode='w+',
+                    dtype=records.dtype, shape=(sum(counts.values()),))
+            output[offset:offset + len(records)] = records
+            offset += len(records)
+            os.remove(shard_path)
+        if output is not None:
+            output.flush()
+            del output
+        return name
+
+    def _write_manifest(self, features_types, counts, files=None):
+        """
+        Write the index of a dataset: position files with the offset and
+        number of positions of each one, and the features types labelled
+        counts: dict shard index -> number of positions
+        files: dict shard index -> file name, the shard files by default
+        """
+        shards = []
+        offset = 0
+        for shard in sorted(counts):
+            name = files[shard] if files is not None else \
+                    os.path.basename(self._shard_path(shard))
+            shards.append({'positions': name,
+                'offset': offset,
+                'count': counts[shard]})
+            offset += counts[shard]
+
+        manifest = {'version': self.MANIFEST_VERSION,
+                'features_types': list(features_types),
+                'count': offset,
+                'shards': shards}
+        path = os.path.join(self.destination_path, "manifest.json")
+        with open(path, 'w') as output:
+            json.dump(manifest, output, indent=1)
+
+    def _dispatch_job(self, features_types, games, workers,
+            chunk_size=None, merge=False, dedup=True):
+        """
+        Dispatch chunks of games to a pool of workers, each one writing its
+        own shard, then index or merge the shards.
+        features_types: types of feature to extract
+        games: iterable of parsed games
+        workers: number of processes
+        chunk_size: number of games of a shard
+        merge: merge the shards into a single file
+        dedup: keep each position once, see _game_to_dataset
+
+        return: number of positions
+        """
+        if chunk_size is None:
+            chunk_size = self.CHUNK_SIZE
+        features_types = list(features_types)
+        jobs = ((i, chunk, features_types, dedup)
+                for i, chunk in enumerate(self._chunk(games, chunk_size)))
+
+        start = time.time()
+        counts = {}
+        if workers > 1:
+            with multiprocessing.Pool(workers) as pool:
+                for shard, count in pool.imap_unordered(self._build_shard,
+                        jobs):
+                    counts[shard] = count
+                    print("Shard %d done: %d positions" % (shard, count))
+        else:
+            for job in jobs:
+                shard, count = self._build_shard(job)
+                counts[shard] = count
+                print("Shard %d done: %d positions" % (shard, count))
+
+        if dedup:
+            removed = self._deduplicate_shards(features_types, counts)
+            print("Removed %d positions found in several shards" % removed)
+
+        total = sum(counts.values())
+        if merge:
+            name = self._merge_shards(counts)
+            self._write_manifest(features_types, {0: total}, {0: name})
+        else:
+            self._write_manifest(features_types, counts)
 
+        eta = time.time() - start
+        print("Built %d positions labelled with %s in %.3f seconds "
+                "(%.0f positions/s)" % (total, ", ".join(features_types),
+                    eta, total / eta if eta else 0))
+        return total
 
-    def build(self, workers=1):
-        features_type = [self.MATERIAL]
+    def build(self, workers=1, features_type=None, merge=False, dedup=True):
+        """
+        Build a sharded dataset labelled with all the features types at
+        once, see cnn.py to load it
+        workers: number of processes
+        merge: write a single positions file instead of shards
+        dedup: keep each position once with the results counts (wins, draws
+        and losses) of all the games it was reached in
+        return: number of positions
+        """
+        if features_type is None:
+            features_type = [self.MATERIAL]
         print("Building dataset from {}".format(self.datapath))
         print("Using %d workers" % workers)
-        with open(self.datapath, 'r') as f:
-            data = json.load(f)
-            for ftype in features_type:
-                print("Proceeding feature type: {}".format(ftype))
-                self._dispatch_job(features_type, data, workers)
-
+        print("Proceeding features types: {}".format(
+            ", ".join(features_type)))
+        return self._dispatch_job(features_type, read_games(self.datapath),
+                workers, merge=merge, dedup=dedup)
 
 
 if __name__ == "__main__":
     # processor = GameParser('data', 'data')
     # processor.run()
     workers = int(os.getenv('WORKERS', default=1))
-    builder = DataSetBuilder('data/ficsgames_2018.json', 'data/raw')
-    builder.build(workers)
+    builder = DataSetBuilder('data/ficsgames_2018.jsonl', 'data/raw')
+    builder.build(workers, DataSetBuilder.FEATURES_TYPES)
 
@@ -1,59 +1,153 @@
 # Simple server to play chess
 
+import os
 import chess
 import traceback
-from flask import Flask, Response, request
-from node import Node
-from minmax import MinMax
-from valuator import Valuator
+from flask import Flask, Response, request, jsonify
+from sessions import SessionStore, SearchService
+from stats import PROFILERS
 
 app = Flask("Chess Server app")
 
-node = Node()
-valuator = Valuator()
-minmax = MinMax(max_depth=3, valuator=valuator)
+# Number of search processes shared by all the games
+workers = int(os.getenv('WORKERS', default=1))
+
+# Opening book built by book.py, used when it exists
+book_path = os.getenv('BOOK', default='data/book.bin')
+if not os.path.exists(book_path):
+    book_path = None
+
+# Endgame bitbases generated by bitbase.py, used when they exist
+bitbase_path = os.getenv('BITBASES', default='data/bitbases')
+if not os.path.isdir(bitbase_path):
+    bitbase_path = None
+
+# Search on the predicted reply while the player thinks, PONDER=0 disables it
+ponder = os.getenv('PONDER', default='1') not in ('0', 'false')
+
+sessions = SessionStore(max_depth=3)
+search = SearchService(workers, book_path=book_path, ponder=ponder,
+        bitbase_path=bitbase_path)
+sessions.on_evict = search.forget
+
+# Promotion symbols sent by the browser
+PROMOTIONS = {'Q': chess.QUEEN, 'R': chess.ROOK, 'B': chess.BISHOP,
+        'N': chess.KNIGHT, 'K': chess.KNIGHT}
+
+def get_session():
+    """
+    Session of the game id given as parameter or cookie
+    """
+    game_id = request.args.get('game') or request.cookies.get('game')
+    return sessions.get(game_id)
+
+def game_response(session, body, status=200):
+    response = app.response_class(response=body, status=status)
+    response.set_cookie('game', session.id)
+    return response
 
 @app.route("/")
 def index():
-    board = node.board
+    session = get_session()
+    board = session.node.board
     index = open("index.html").read()
-    index.replace('zero_board', board.fen())
-    return index
+    index = index.replace('zero_board', board.fen())
+    return game_response(session, index)
 
 @app.route("/newgame")
 def new_game():
-    board = node.board
-    board.reset()
-    valuator.reset()
-    response = app.response_class(response=board.fen(), status=200)
-    return response
+    session = get_session()
+    with session.lock:
+        search.forget(session)
+        session.reset()
+        fen = session.node.board.fen()
+    return game_response(session, fen)
 
 @app.route("/move")
 def move():
+    session = get_session()
+    node = session.node
     board = node.board
-    if not board.is_game_over():
-        src = int(request.args.get('from', default=''))
-        tgt = int(request.args.get('to', default=''))
-
-        # Handle promotion case
-        promotion_symbol = None
-        if request.args.get('promotion', default='') == 'true' :
-            promotion_symbol = request.args.get('promotion_symbol', default='')
-
-        next_move = board.san(chess.Move(src, tgt, promotion=promotion_symbol))
-
-        if next_move is not None:
-            try:
-                board.push_san(next_move)
-                ai_move = minmax.next_move(node)
-                board.push(ai_move)
-            except:
-                traceback.print_exc()
-
-    response = app.response_class(response=board.fen(), status=200)
-    return response
 
+    # Return immediately with a job id to poll instead of waiting for the AI
+    run_async = request.args.get('async', default='') in ('1', 'true')
+    # Return the search statistics along with the position
+    with_stats = request.args.get('stats', default='') in ('1', 'true')
+    # Measure the search time split, and optionally profile the search
+    profile = request.args.get('profile', default=None)
+    if profile is not None and profile not in ('timing',) + PROFILERS:
+        return game_response(session, "Unknown profiler", status=400)
 
-if __name__ == "__main__":
-    app.run(debug=True)
+    with session.lock:
+        if session.job is not None:
+            return game_response(session, "AI is thinking", status=409)
 
+        job = None
+        if not board.is_game_over():
+            src = int(request.args.get('from', default=''))
+            tgt = int(request.args.get('to', default=''))
+
+            # Handle promotion case
+            promotion = None
+            if request.args.get('promotion', default='') == 'true' :
+                promotion_symbol = request.args.get('promotion_symbol',
+                        default='Q')
+                promotion = PROMOTIONS.get(promotion_symbol, chess.QUEEN)
+
+            # Optional time budget of the AI in milliseconds
+            movetime = request.args.get('movetime', default=None, type=int)
+
+            next_move = chess.Move(src, tgt, promotion=promotion)
+
+            if next_move in board.legal_moves:
+                try:
+                    node.push(next_move)
+                    if not board.is_game_over():
+                        job = search.submit(session, movetime, profile)
+                except:
+                    traceback.print_exc()
+
+        fen = board.fen()
+
+    if run_async:
+        return game_response(session, jsonify({'game': session.id,
+            'job': job, 'fen': fen}).get_data())
+
+    if job is not None:
+        search.wait(job)
+        fen = board.fen()
+
+    if with_stats:
+        status = search.status(job) if job is not None else None
+        return game_response(session, jsonify({'game': session.id,
+            'fen': fen,
+            'move': status.get('move') if status else None,
+            'stats': status.get('stats') if status else None}).get_data())
+    return game_response(session, fen)
+
+@app.route("/job/<job_id>")
+def job_status(job_id):
+    status = search.status(job_id)
+    if status is None:
+        return app.response_class(response="Unknown job", status=404)
+    return jsonify(status)
+
+@app.route("/stats")
+def stats():
+    """
+    Statistics of the last searches, and of the last search of a game when
+    a game id is given
+    """
+    summary = search.summary()
+    summary['sessions'] = len(sessions)
+    game_id = request.args.get('game')
+    if game_id is not None:
+        session = sessions.get(game_id, create=False)
+        if session is None:
+            return app.response_class(response="Unknown game", status=404)
+        summary['game'] = {'id': session.id, 'stats': session.stats}
+    return jsonify(summary)
+
+
+if __name__ == "__main__":
+    app.run(debug=True, threaded=True)
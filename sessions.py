@@ -0,0 +1,543 @@
+
+"""
+Game sessions of the chess server. Each session has its own board, and the
+AI searches run in a bounded pool of processes so that a slow search
+doesn't block the other games.
+"""
+import time
+import uuid
+import chess
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from node import Node
+from minmax import MinMax
+from valuator import Valuator
+from book import OpeningBook
+from bitbase import Bitbases
+
+
+# Search engine of a pool process, kept between searches so that its
+# transposition table stays warm
+_engine = None
+
+# Opening book and endgame bitbases of a pool process, loaded by
+# _init_worker
+_book = None
+_bitbases = None
+
+
+def _init_worker(book_path, bitbase_path=None):
+    """
+    Memory-map the opening book and the bitbases in a pool process
+    """
+    global _book, _bitbases
+    if book_path is not None:
+        _book = OpeningBook(book_path)
+    if bitbase_path is not None:
+        _bitbases = Bitbases(bitbase_path)
+
+
+def search_move(fen, moves, max_depth, movetime=None, profile=None,
+        stop=None):
+    """
+    Search the best move of a position in a pool process
+    fen: fen of the starting position of the game
+    moves: uci moves played since
+    profile: None, "timing" to measure the time spent in move generation
+    and evaluation, or one of stats.PROFILERS which also measures it
+    stop: optional event shared with the server to stop the search, the
+    best move of the last completed iteration is returned
+    return: dict with the uci of the best move, or None, and the search
+    statistics
+    """
+    global _engine
+    if _engine is None:
+        _engine = MinMax(max_depth=max_depth, valuator=Valuator(), book=_book,
+                bitbases=_bitbases)
+    _engine.max_depth = max_depth
+    _engine.timing = profile is not None
+    _engine.stop_event = stop
+
+    board = chess.Board(fen)
+    for m in moves:
+        board.push_uci(m)
+    profiler = profile if profile != 'timing' else None
+    move, stats = _engine.search(Node(board), movetime=movetime,
+            profile=profiler)
+    return {'move': move.uci() if move else None, 'stats': stats.to_dict()}
+
+
+class GameSession:
+    """
+    A game played through the server
+    """
+
+    def __init__(self, game_id, max_depth):
+        self.id = game_id
+        self.node = Node()
+        self.max_depth = max_depth
+        # reentrant: a search callback may run in the thread submitting it
+        self.lock = threading.RLock()
+        # id of the AI search in progress, of the last one played, and of
+        # the search on the predicted reply of the opponent
+        self.job = None
+        self.last_job = None
+        self.ponder = None
+        # statistics of the last AI search
+        self.stats = None
+        self.last_used = time.time()
+
+    def touch(self):
+        self.last_used = time.time()
+
+    def reset(self):
+        self.node.reset()
+        self.job = None
+        self.ponder = None
+        self.stats = None
+
+
+class SessionStore:
+    """
+    Game sessions by id. Sessions idle for more than idle_timeout seconds
+    are evicted, and so are the least recently used ones when there are
+    more than max_sessions.
+    """
+
+    MAX_SESSIONS = 64
+    IDLE_TIMEOUT = 30 * 60
+
+    def __init__(self, max_sessions=MAX_SESSIONS, idle_timeout=IDLE_TIMEOUT,
+            max_depth=3):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_depth = max_depth
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        # called with each evicted session
+        self.on_evict = None
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, game_id=None, create=True):
+        """
+        Return the session of a game, a new one is created if needed
+        game_id: id of the game, None for a new game
+        return: GameSession or None
+        """
+        with self.lock:
+            session = self.sessions.get(game_id)
+            if session is None:
+                if not create:
+                    return None
+                session = GameSession(game_id or uuid.uuid4().hex,
+                        self.max_depth)
+                self.sessions[session.id] = session
+            self.sessions.move_to_end(session.id)
+            session.touch()
+            evicted = self._evict(session)
+
+        for s in evicted:
+            if self.on_evict is not None:
+                self.on_evict(s)
+        return session
+
+    def _evict(self, current):
+        """
+        Remove idle sessions and least recently used ones
+        current: session being used, never evicted
+        return: list of evicted sessions
+        """
+        evicted = []
+        now = time.time()
+        while self.sessions:
+            game_id, session = next(iter(self.sessions.items()))
+            if session is current:
+                break
+            if len(self.sessions) <= self.max_sessions and \
+                    now - session.last_used < self.idle_timeout:
+                break
+            del self.sessions[game_id]
+            evicted.append(session)
+        return evicted
+
+
+class SearchJob:
+    """
+    A search of the SearchService
+    """
+
+    def __init__(self, session, future, moves, movetime=None, stop=None,
+            ponder=False):
+        """
+        moves: uci moves of the position searched
+        stop: event stopping the search, only given to ponder searches
+        ponder: search started on the opponent's time, on the predicted move
+        """
+        self.session = session
+        self.future = future
+        self.moves = moves
+        self.ply = len(moves)
+        self.movetime = movetime
+        self.stop = stop
+        self.ponder = ponder
+        # ponder search without depth limit, stopped after the move time
+        # once the opponent played the predicted move
+        self.infinite = ponder and movetime is not None
+        self.start = time.time()
+        # stops a ponder search once the opponent played the predicted move
+        self.timer = None
+        # set once the search is over and its move played, see
+        # SearchService.wait
+        self.done = threading.Event()
+
+
+class SearchService:
+    """
+    Run the AI searches of the sessions in a pool of processes. Searches
+    are identified by a job id that can be polled.
+
+    With ponder, once the AI played, a search on the reply the AI expects
+    from the opponent (the second move of its principal variation) runs
+    while the opponent thinks. If the opponent plays it, the search is
+    kept and goes on, otherwise it is stopped.
+    """
+
+    # Number of searches kept for the statistics
+    HISTORY_SIZE = 256
+
+    # A ponder search with a time budget stops by itself after this many
+    # times the move time, so that a player who doesn't move doesn't hold
+    # a process
+    PONDER_MOVETIME_FACTOR = 8
+
+    def __init__(self, workers=1, book_path=None, ponder=True,
+            bitbase_path=None):
+        """
+        workers: number of search processes
+        book_path: optional opening book, see book.OpeningBook
+        ponder: search on the opponent's time
+        bitbase_path: optional directory of endgame bitbases, see
+        bitbase.Bitbases
+        """
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers,
+                initializer=_init_worker, initargs=(book_path,
+                    bitbase_path))
+        self.ponder = ponder
+        # started with the first ponder search, shares the stop events with
+        # the pool processes
+        self.manager = None
+        self.jobs = {}
+        self.lock = threading.Lock()
+        # statistics of the last searches
+        self.history = deque(maxlen=self.HISTORY_SIZE)
+        self.searches = 0
+        self.errors = 0
+        self.ponder_hits = 0
+        self.ponder_misses = 0
+
+    def _pending(self):
+        """
+        Number of searches running or waiting for a process, the lock must
+        be held
+        """
+        return len([j for j in self.jobs.values() if not j.future.done()])
+
+    def _stop_event(self):
+        with self.lock:
+            if self.manager is None:
+                self.manager = multiprocessing.Manager()
+            return self.manager.Event()
+
+    def _submit(self, session, moves, max_depth, movetime=None, profile=None,
+            ponder=False):
+        """
+        Submit a search to the pool
+        return: job id
+        """
+        stop = self._stop_event() if ponder else None
+        budget = movetime
+        if ponder and movetime is not None:
+            budget = movetime * self.PONDER_MOVETIME_FACTOR
+        root = session.node.board.root()
+        future = self.executor.submit(search_move, root.fen(), moves,
+                max_depth, budget, profile, stop)
+
+        job_id = uuid.uuid4().hex
+        job = SearchJob(session, future, moves, movetime, stop, ponder)
+        with self.lock:
+            self.jobs[job_id] = job
+        future.add_done_callback(lambda f: self._done(job_id, job))
+        return job_id
+
+    def _done(self, job_id, job):
+        """
+        Done callback of a search: play its move, then wake up the threads
+        waiting for it
+        """
+        try:
+            self._play(job_id)
+        finally:
+            job.done.set()
+
+    def _keep(self, session, job_id):
+        """
+        Make a job the last job of its session, the previous one is
+        forgotten. The lock must be held.
+        """
+        if session.last_job is not None and session.last_job != job_id:
+            self.jobs.pop(session.last_job, None)
+        session.last_job = job_id
+
+    def submit(self, session, movetime=None, profile=None):
+        """
+        Start the search of the AI move of a session. The move is played on
+        the session board once found. The session lock must be held.
+        profile: see search_move
+        return: job id
+        """
+        moves = [m.uci() for m in session.node.board.move_stack]
+        if profile is None:
+            job_id = self._ponder_hit(session, moves, movetime)
+            if job_id is not None:
+                return job_id
+        if self._stop_ponder(session):
+            with self.lock:
+                self.ponder_misses += 1
+
+        # the searches of the players have priority over the ponder ones
+        with self.lock:
+            if self._pending() >= self.workers:
+                pondering = [j for j in self.jobs.items() if j[1].ponder and
+                        j[1].session is not session and
+                        j[1].session.job != j[0]]
+                for job_id, job in pondering:
+                    self.jobs.pop(job_id)
+                    job.stop.set()
+                    job.future.cancel()
+
+        job_id = self._submit(session, moves, session.max_depth, movetime,
+                profile)
+        with self.lock:
+            self._keep(session, job_id)
+        session.job = job_id
+        return job_id
+
+    def _ponder_hit(self, session, moves, movetime):
+        """
+        Keep the ponder search of a session if it searches the current
+        position
+        return: job id of the ponder search, or None
+        """
+        job_id = session.ponder
+        with self.lock:
+            job = self.jobs.get(job_id) if job_id is not None else None
+        if job is None or job.moves != moves or job.future.cancelled():
+            return None
+
+        session.ponder = None
+        with self.lock:
+            self.ponder_hits += 1
+            self._keep(session, job_id)
+        session.job = job_id
+
+        if job.future.done():
+            self._play(job_id)
+        elif job.infinite:
+            # A ponder search with a time budget goes as deep as it can. The
+            # time already spent on the position counts in the budget of the
+            # move, it is stopped right away when it is used up or when
+            # there is no budget.
+            remaining = 0
+            if movetime is not None:
+                remaining = movetime / 1000. - (time.time() - job.start)
+            if remaining <= 0:
+                job.stop.set()
+            else:
+                job.timer = threading.Timer(remaining, job.stop.set)
+                job.timer.start()
+        return job_id
+
+    def _stop_ponder(self, session):
+        """
+        Stop the ponder search of a session
+        return: True if a ponder search was stopped
+        """
+        job_id, session.ponder = session.ponder, None
+        with self.lock:
+            job = self.jobs.pop(job_id, None) if job_id is not None else None
+        if job is None:
+            return False
+        job.stop.set()
+        job.future.cancel()
+        return True
+
+    def _start_ponder(self, session, job, result):
+        """
+        Search the position after the reply expected from the opponent,
+        when a process is free. The session lock must be held.
+        """
+        pv = result['stats']['pv']
+        if not self.ponder or result['move'] is None or len(pv) < 2:
+            return
+        board = session.node.board
+        predicted = chess.Move.from_uci(pv[1])
+        if board.is_game_over() or predicted not in board.legal_moves:
+            return
+        with self.lock:
+            if self._pending() >= self.workers:
+                return
+
+        # without time budget the ponder search is the search the AI would
+        # run after the predicted move
+        max_depth = session.max_depth
+        if job.movetime is not None:
+            max_depth = MinMax.MAX_ITERATIVE_DEPTH
+        try:
+            session.ponder = self._submit(session,
+                    job.moves + [result['move'], pv[1]], max_depth,
+                    job.movetime, ponder=True)
+        except RuntimeError:
+            # shut down
+            pass
+
+    def _play(self, job_id):
+        """
+        Play the move found by a search on the board of its session
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return
+
+        session = job.session
+        with session.lock:
+            # a ponder search is only played once the opponent played the
+            # predicted move, see _ponder_hit
+            if session.job != job_id:
+                return
+            if job.timer is not None:
+                job.timer.cancel()
+            try:
+                self._play_result(session, job)
+            finally:
+                # wait returns once the job is cleared
+                session.job = None
+
+    def _play_result(self, session, job):
+        """
+        Record the result of a job and play its move. The session lock must
+        be held.
+        """
+        future = job.future
+        if future.cancelled() or future.exception() is not None:
+            with self.lock:
+                self.errors += not future.cancelled()
+            return
+
+        result = future.result()
+        with self.lock:
+            self.searches += 1
+            self.history.append(result['stats'])
+
+        # the game may have been reset during the search
+        board = session.node.board
+        if len(board.move_stack) == job.ply:
+            if result['move'] is not None:
+                session.node.push(chess.Move.from_uci(result['move']))
+            session.stats = result['stats']
+            self._start_ponder(session, job, result)
+
+    def status(self, job_id):
+        """
+        Return the status of a job
+        return: dict or None if the job is unknown
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+
+        session, future = job.session, job.future
+        if not future.done() or session.job == job_id:
+            return {'job': job_id, 'game': session.id, 'status': 'pending'}
+
+        status = {'job': job_id, 'game': session.id, 'status': 'done',
+                'fen': session.node.board.fen(), 'ponder': job.ponder}
+        if future.cancelled():
+            status['status'] = 'cancelled'
+        elif future.exception() is not None:
+            status['status'] = 'error'
+            status['error'] = str(future.exception())
+        else:
+            status['move'] = future.result()['move']
+            status['stats'] = future.result()['stats']
+        return status
+
+    def summary(self):
+        """
+        Statistics of the last searches
+        return: dict
+        """
+        with self.lock:
+            history = list(self.history)
+            pondering = len([j for j in self.jobs.values() if j.ponder and
+                j.session.job is None and not j.future.done()])
+            summary = {'searches': self.searches, 'errors': self.errors,
+                    'pending': self._pending() - pondering,
+                    'pondering': pondering,
+                    'ponder_hits': self.ponder_hits,
+                    'ponder_misses': self.ponder_misses}
+
+        searched = [s for s in history if not s['book']]
+        times = sorted(s['time'] for s in searched)
+        nodes = sum(s['nodes'] + s['qnodes'] for s in searched)
+        summary.update({'recent': len(history),
+            'book_moves': len(history) - len(searched),
+            'nodes': nodes,
+            'nps': nodes / sum(times) if sum(times) else 0,
+            'average_depth': sum(s['depth'] for s in searched) /
+                len(searched) if searched else 0,
+            'average_time': sum(times) / len(times) if times else 0,
+            'median_time': times[len(times) // 2] if times else 0,
+            'max_time': times[-1] if times else 0})
+        return summary
+
+    def wait(self, job_id):
+        """
+        Wait for the end of a job
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return
+        # the move is played by the done callback, or right away by
+        # _ponder_hit when the ponder search was already over
+        job.done.wait()
+
+    def forget(self, session):
+        """
+        Cancel and forget the jobs of a session
+        """
+        self._stop_ponder(session)
+        with self.lock:
+            job = self.jobs.pop(session.job, None) if session.job else None
+            self.jobs.pop(session.last_job, None)
+        if job is not None:
+            job.future.cancel()
+        session.job = None
+        session.last_job = None
+
+    def shutdown(self):
+        with self.lock:
+            for job in self.jobs.values():
+                if job.stop is not None:
+                    job.stop.set()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        if self.manager is not None:
+            self.manager.shutdown()
@@ -0,0 +1,212 @@
+
+"""
+Lazy SMP: several MinMax processes search the same position and share
+their results through a transposition table in shared memory.
+"""
+import os
+import sys
+import time
+import chess
+import multiprocessing
+from multiprocessing import shared_memory
+
+from node import Node
+from minmax import MinMax
+from valuator import Valuator
+from book import OpeningBook
+from bitbase import Bitbases
+from transposition import TranspositionTable
+
+
+class SharedFlag:
+    """
+    Stop flag stored in a shared memory byte, with the same interface as
+    threading.Event so it can be used as MinMax.stop_event
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def is_set(self):
+        return self.buffer[0] != 0
+
+    def set(self):
+        self.buffer[0] = 1
+
+    def clear(self):
+        self.buffer[0] = 0
+
+
+# Search engine of a worker process, created by _init_worker
+_worker = None
+
+
+def _init_worker(shm_name, table_mb, max_depth, verbose=True, book_path=None,
+        bitbase_path=None):
+    """
+    Attach a worker process to the shared transposition table and stop flag
+    book_path: optional opening book, see book.OpeningBook
+    bitbase_path: optional endgame bitbases, see bitbase.Bitbases
+    """
+    global _worker
+    shm = shared_memory.SharedMemory(name=shm_name)
+    nbytes = TranspositionTable.nbytes(table_mb)
+    table = TranspositionTable(table_mb, buffer=shm.buf[:nbytes])
+    book = OpeningBook(book_path) if book_path is not None else None
+    bitbases = Bitbases(bitbase_path) if bitbase_path is not None else None
+    minmax = MinMax(max_depth=max_depth, valuator=Valuator(), table=table,
+            book=book, verbose=verbose, bitbases=bitbases)
+    minmax.stop_event = SharedFlag(shm.buf[nbytes:])
+    _worker = (shm, minmax)
+
+
+def _search(args):
+    """
+    Search a position in a worker process
+    args: worker id, root fen, moves played since, movetime, nodes and depth
+    return: dict with the move, value, completed depth and nodes
+    """
+    worker_id, fen, moves, movetime, nodes, max_depth = args
+    _, minmax = _worker
+    minmax.max_depth = max_depth
+
+    board = chess.Board(fen)
+    for m in moves:
+        board.push_uci(m)
+    node = Node(board)
+
+    # Helpers start one ply deeper every other worker, so that they don't
+    # all search the same tree in the same order
+    start_depth = 1 + worker_id % 2
+    if worker_id > 0 and movetime is None and nodes is None:
+        minmax.max_depth += worker_id % 2
+
+    start = time.time()
+    move = minmax.next_move(node, movetime=movetime, nodes=nodes,
+            start_depth=start_depth)
+
+    # the main worker stops all the helpers
+    if worker_id == 0:
+        minmax.stop_event.set()
+
+    return {'worker': worker_id,
+            'move': move.uci() if move else None,
+            'value': minmax.value,
+            'depth': minmax.depth,
+            'pv': [m.uci() for m in minmax.pv],
+            'nodes': minmax.nodes + minmax.qnodes,
+            'time': time.time() - start}
+
+
+class ParallelSearch:
+    """
+    Run MinMax searches in a pool of processes sharing a transposition table.
+    It can be used in place of MinMax through next_move.
+    """
+
+    def __init__(self, workers=None, max_depth=MinMax.DEFAULT_MAX_DEPTH,
+            table_mb=TranspositionTable.DEFAULT_SIZE_MB, verbose=True,
+            book_path=None, bitbase_path=None):
+        """
+        book_path: optional opening book of the workers
+        bitbase_path: optional endgame bitbases of the workers
+        """
+        if workers is None:
+            workers = os.cpu_count()
+        self.workers = workers
+        self.max_depth = max_depth
+        self.table_mb = table_mb
+        self.verbose = verbose
+
+        # the table followed by one byte for the stop flag
+        nbytes = TranspositionTable.nbytes(table_mb)
+        self.shm = shared_memory.SharedMemory(create=True, size=nbytes + 1)
+        self.table = TranspositionTable(table_mb, buffer=self.shm.buf[:nbytes])
+        self.stop_event = SharedFlag(self.shm.buf[nbytes:])
+
+        self.pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                initargs=(self.shm.name, table_mb, max_depth, verbose,
+                    book_path, bitbase_path))
+
+        self.nodes = 0
+        self.results = []
+        # result of the worker whose move was played
+        self.best = None
+
+    def next_move(self, node, movetime=None, nodes=None):
+        """
+        Search the best move with all the workers. The search stops at once
+        if stop_event was set before, it is cleared at the end of the
+        search.
+        :param movetime: time budget in milliseconds
+        :param nodes: nodes budget of each worker
+        :return: best move of the deepest completed search
+        """
+        board = node.board
+        root = board.root()
+        moves = [m.uci() for m in board.move_stack]
+
+        start = time.time()
+        jobs = [(i, root.fen(), moves, movetime, nodes, self.max_depth)
+                for i in range(self.workers)]
+        self.results = self.pool.map(_search, jobs)
+        self.stop_event.clear()
+        eta = time.time() - start
+
+        self.nodes = sum(r['nodes'] for r in self.results)
+
+        # deepest completed search wins, the main worker on ties
+        best = max(self.results, key=lambda r: (r['depth'], r['worker'] == 0))
+        self.best = best
+        if self.verbose:
+            print("Best value: %s -> %s : depth %d, %d workers explored %d "
+                    "nodes in %.3f seconds" % (best['value'], best['move'],
+                        best['depth'], self.workers, self.nodes, eta))
+
+        if best['move'] is None:
+            return None
+        return chess.Move.from_uci(best['move'])
+
+    def close(self):
+        """
+        Stop the workers and free the shared memory
+        """
+        self.pool.terminate()
+        self.pool.join()
+        self.table = None
+        self.stop_event = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+def scaling(fen=chess.STARTING_FEN, movetime=5000, max_workers=None):
+    """
+    Report nodes per second of a search with 1 to max_workers workers
+    return: list of (workers, nodes, nps)
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count()
+
+    report = []
+    workers = 1
+    while True:
+        search = ParallelSearch(workers)
+        start = time.time()
+        search.next_move(Node(chess.Board(fen)), movetime=movetime)
+        eta = time.time() - start
+        search.close()
+
+        nps = search.nodes / eta
+        report.append((workers, search.nodes, nps))
+        print("%2d workers: %d nodes, %d nps, x%.2f" % (workers,
+            search.nodes, nps, nps / report[0][2]))
+
+        if workers >= max_workers:
+            break
+        workers = min(workers * 2, max_workers)
+    return report
+
+
+if __name__ == "__main__":
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    scaling(max_workers=max_workers)
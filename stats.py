@@ -0,0 +1,214 @@
+
+"""
+Statistics and profiling of the searches
+"""
+import sys
+import pstats
+import cProfile
+import threading
+from collections import Counter
+
+
+class SearchStats:
+    """
+    Statistics of a search, see MinMax.search
+    """
+
+    def __init__(self):
+        self.move = None
+        self.value = None
+        self.pv = []
+        # completed depth and deepest ply reached, quiescence included
+        self.depth = 0
+        self.seldepth = 0
+        self.book = False
+
+        self.nodes = 0
+        self.qnodes = 0
+        # depth, nodes, quiescence nodes, effective branching factor, time,
+        # value and move of each completed iteration
+        self.iterations = []
+
+        # evaluations computed and answered from the valuator memory
+        self.evals = 0
+        self.eval_hits = 0
+        self.tt_hits = 0
+        self.tt_misses = 0
+        # positions answered by the endgame bitbases
+        self.bitbase_hits = 0
+        # beta cutoffs of the main search, and the ones on the first move
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        # selective search: null move cutoffs, moves searched at a reduced
+        # depth, reduced moves searched again and quiet moves pruned
+        self.null_cutoffs = 0
+        self.reductions = 0
+        self.researches = 0
+        self.futility_prunes = 0
+        # null window searches searched again with the full window, and root
+        # searches falling outside of the aspiration window
+        self.pvs_researches = 0
+        self.aspiration_researches = 0
+
+        self.time = 0.
+        # only measured when the search timing is enabled
+        self.movegen_time = None
+        self.eval_time = None
+
+        # report of the profiler, see profile_call
+        self.profile = None
+
+    @property
+    def nps(self):
+        if not self.time:
+            return 0
+        return (self.nodes + self.qnodes) / self.time
+
+    @property
+    def first_move_cutoff_rate(self):
+        if not self.cutoffs:
+            return 0
+        return self.first_move_cutoffs / self.cutoffs
+
+    @property
+    def search_time(self):
+        """
+        Time spent outside of move generation and evaluation
+        """
+        if self.movegen_time is None:
+            return None
+        return self.time - self.movegen_time - self.eval_time
+
+    def to_dict(self):
+        """
+        Statistics as a JSON serializable dict
+        """
+        return {'move': self.move.uci() if self.move else None,
+                'value': self.value,
+                'pv': [m.uci() for m in self.pv],
+                'depth': self.depth,
+                'seldepth': self.seldepth,
+                'book': self.book,
+                'nodes': self.nodes,
+                'qnodes': self.qnodes,
+                'nps': self.nps,
+                'iterations': [dict(it) for it in self.iterations],
+                'evals': self.evals,
+                'eval_hits': self.eval_hits,
+                'tt_hits': self.tt_hits,
+                'tt_misses': self.tt_misses,
+                'bitbase_hits': self.bitbase_hits,
+                'cutoffs': self.cutoffs,
+                'first_move_cutoffs': self.first_move_cutoffs,
+                'first_move_cutoff_rate': self.first_move_cutoff_rate,
+                'null_cutoffs': self.null_cutoffs,
+                'reductions': self.reductions,
+                'researches': self.researches,
+                'futility_prunes': self.futility_prunes,
+                'pvs_researches': self.pvs_researches,
+                'aspiration_researches': self.aspiration_researches,
+                'time': self.time,
+                'movegen_time': self.movegen_time,
+                'eval_time': self.eval_time,
+                'search_time': self.search_time,
+                'profile': self.profile}
+
+
+class SamplingProfiler:
+    """
+    Sample the stack of a thread at a fixed interval. Much cheaper than
+    cProfile, so the timings stay close to the ones of a normal search.
+    """
+
+    INTERVAL = 0.001
+
+    def __init__(self, thread_id=None, interval=INTERVAL):
+        if thread_id is None:
+            thread_id = threading.get_ident()
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        # innermost function of each sample, and all functions of the stack
+        self.own = Counter()
+        self.total = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.own[self._name(frame.f_code)] += 1
+            seen = set()
+            while frame is not None:
+                name = self._name(frame.f_code)
+                if name not in seen:
+                    self.total[name] += 1
+                    seen.add(name)
+                frame = frame.f_back
+
+    def _name(self, code):
+        return "%s (%s:%d)" % (code.co_name, code.co_filename,
+                code.co_firstlineno)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self, top=20):
+        """
+        return: list of dicts with the fraction of the samples in each
+        function and in the functions it calls
+        """
+        samples = max(self.samples, 1)
+        return [{'function': name,
+                'own': self.own[name] / samples,
+                'total': self.total[name] / samples}
+                for name, _ in self.own.most_common(top)]
+
+
+def cprofile_report(profile, top=20):
+    """
+    Functions with the highest own time of a cProfile.Profile
+    return: list of dicts
+    """
+    stats = pstats.Stats(profile)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2],
+            reverse=True)
+    return [{'function': "%s (%s:%d)" % (name, filename, line),
+            'calls': calls, 'own': own_time, 'total': total_time}
+            for (filename, line, name), (_, calls, own_time, total_time, _)
+            in rows[:top]]
+
+
+# Available profilers, see profile_call
+PROFILERS = ('cprofile', 'sampling')
+
+
+def profile_call(profiler, function, *args, **kwargs):
+    """
+    Call a function under a profiler
+    profiler: one of PROFILERS
+    return: result of the function and profile report
+    """
+    if profiler == 'cprofile':
+        profile = cProfile.Profile()
+        result = profile.runcall(function, *args, **kwargs)
+        return result, cprofile_report(profile)
+
+    if profiler == 'sampling':
+        sampler = SamplingProfiler()
+        sampler.start()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            sampler.stop()
+        return result, sampler.report()
+
+    raise Exception("Unknown profiler: %s" % profiler)
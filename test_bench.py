@@ -0,0 +1,46 @@
+import unittest
+
+import bench
+
+
+class TestBench(unittest.TestCase):
+
+    def test_signature(self):
+        fens = bench.positions()[:3]
+        first = bench.bench_search(fens, 2)
+        second = bench.bench_search(fens, 2)
+        self.assertEqual(first['signature'], second['signature'])
+        self.assertEqual(first['moves'], second['moves'])
+        self.assertGreater(first['nps'], 0)
+        self.assertLessEqual(first['cache_hit_rate'], 1)
+
+    def test_network(self):
+        results = bench.bench_network(bench.positions()[:2], repeat=1,
+                depth=1)
+        self.assertGreater(results['positions'], 0)
+        for name in ('unbatched', 'batched', 'prefetch'):
+            self.assertGreater(results[name]['evals_per_s'], 0)
+        self.assertEqual(results['search_batched']['nodes'],
+                results['search_unbatched']['nodes'])
+
+    def test_dataset(self):
+        self.assertEqual(bench.random_pgn(3, seed=1),
+                bench.random_pgn(3, seed=1))
+        results = bench.bench_dataset(games=5)
+        self.assertGreater(results['positions'], 0)
+
+    def test_compare(self):
+        baseline = {'signature': 100, 'search': {'nps': 1000.},
+                'dataset': {'positions_per_s': 50.}}
+        results = {'signature': 100, 'search': {'nps': 950.},
+                'dataset': {'positions_per_s': 20.}}
+        regressions = bench.compare(results, baseline, threshold=0.1)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('dataset.positions_per_s', regressions[0])
+
+        results['signature'] = 101
+        self.assertEqual(len(bench.compare(results, baseline, 0.9)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
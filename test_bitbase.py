@@ -0,0 +1,129 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import chess
+
+from node import Node
+from minmax import MinMax
+from valuator import Valuator
+from bitbase import (Bitbases, build_bitbases, TABLES, POSITIONS,
+        NOT_WON)
+
+
+class TestBitbases(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.counts = build_bitbases(cls.directory)
+        cls.bitbases = Bitbases(cls.directory)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def _random_board(self, rng, piece_type):
+        while True:
+            board = chess.Board(None)
+            color = rng.choice(chess.COLORS)
+            king, lone_king, square = rng.sample(chess.SQUARES, 3)
+            board.set_piece_at(king, chess.Piece(chess.KING, color))
+            board.set_piece_at(lone_king, chess.Piece(chess.KING, not color))
+            board.set_piece_at(square, chess.Piece(piece_type, color))
+            board.turn = rng.choice(chess.COLORS)
+            if board.is_valid():
+                return board
+
+    def _result(self, board):
+        """
+        Result of a position from the results of its children
+        """
+        mover = 1 if board.turn == chess.WHITE else -1
+        children = []
+        for move in board.legal_moves:
+            board.push(move)
+            if board.is_checkmate():
+                children.append((-1 if board.turn == chess.WHITE else 1, 0))
+            else:
+                # underpromotions and captures are draws
+                children.append(self.bitbases.probe(board) or (0, None))
+            board.pop()
+
+        if not children:
+            return (-mover, 0) if board.is_check() else (0, None)
+        wins = [plies for result, plies in children if result == mover]
+        if wins:
+            return mover, min(wins) + 1
+        if all(result == -mover for result, _ in children):
+            return -mover, max(plies for _, plies in children) + 1
+        return 0, None
+
+    def test_tables(self):
+        self.assertEqual(len(self.bitbases), len(TABLES))
+        self.assertEqual(sorted(self.counts), sorted(TABLES.values()))
+
+    def test_consistency(self):
+        rng = random.Random(1)
+        for piece_type in TABLES:
+            for _ in range(300):
+                board = self._random_board(rng, piece_type)
+                self.assertEqual(self.bitbases.probe(board),
+                        self._result(board), board.fen())
+
+    def test_probe(self):
+        # king on the sixth rank in front of its pawn
+        self.assertEqual(self.bitbases.probe(chess.Board(
+            "4k3/8/4K3/4P3/8/8/8/8 w - - 0 1")), (1, 21))
+        self.assertEqual(self.bitbases.probe(chess.Board(
+            "4k3/8/4K3/4P3/8/8/8/8 b - - 0 1")), (1, 24))
+        # opposition, and rook pawn with the lone king in the corner
+        self.assertEqual(self.bitbases.probe(chess.Board(
+            "8/8/8/8/8/4k3/4P3/4K3 w - - 0 1")), (0, None))
+        self.assertEqual(self.bitbases.probe(chess.Board(
+            "7k/8/7K/7P/8/8/8/8 b - - 0 1")), (0, None))
+        self.assertEqual(self.bitbases.probe(chess.Board(
+            "k7/8/1K6/8/8/8/8/7R w - - 0 1")), (1, 1))
+        # the same positions with the black pieces
+        self.assertEqual(self.bitbases.probe(chess.Board(
+            "8/8/8/8/4p3/4k3/8/4K3 b - - 0 1")), (-1, 21))
+        self.assertEqual(self.bitbases.probe(chess.Board(
+            "7r/8/8/8/8/1k6/8/K7 b - - 0 1")), (-1, 1))
+
+    def test_longest_mates(self):
+        # mate in 10 moves at most with the queen and 16 with the rook
+        for piece_type, moves in ((chess.QUEEN, 10), (chess.ROOK, 16)):
+            _, dtm = self.bitbases.tables[piece_type]
+            strong = dtm[:POSITIONS]
+            self.assertEqual(strong[strong < NOT_WON].max(), 2 * moves - 1)
+
+    def test_not_in_tables(self):
+        self.assertIsNone(self.bitbases.probe(chess.Board()))
+        self.assertIsNone(self.bitbases.probe(chess.Board(
+            "4k3/8/8/8/8/8/8/2B1K3 w - - 0 1")))
+        self.assertIsNone(self.bitbases.probe(chess.Board(
+            "4k3/8/8/8/8/8/8/4K2R w K - 0 1")))
+
+    def test_bad_path(self):
+        self.assertRaises(Exception, Bitbases,
+                os.path.join(self.directory, 'missing'))
+
+    def test_search(self):
+        # KRK: the exact mate value is found at the first iteration
+        valuator = Valuator()
+        minmax = MinMax(max_depth=4, valuator=valuator, verbose=False,
+                bitbases=self.bitbases)
+        board = chess.Board("8/8/8/3k4/8/8/8/R3K3 w - - 0 1")
+        _, plies = self.bitbases.probe(board)
+        move, stats = minmax.search(Node(board))
+        self.assertEqual(stats.value, valuator.MAXVALUE - plies)
+        self.assertEqual(stats.depth, 1)
+        self.assertGreater(stats.bitbase_hits, 0)
+
+        board.push(move)
+        self.assertEqual(self.bitbases.probe(board), (1, plies - 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import chess
+import chess.polyglot
+import tempfile
+import unittest
+
+from node import Node
+from minmax import MinMax
+from valuator import Valuator
+from book import BookBuilder, OpeningBook, move_to_polyglot, \
+        polyglot_to_move
+
+
+GAMES = [
+    {'game': ['e4', 'e5', 'Nf3', 'Nc6', 'Bc4', 'Nf6', 'O-O'], 'result': 1.},
+    {'game': ['e4', 'c5', 'Nf3', 'd6'], 'result': 1.},
+    {'game': ['e4', 'e5', 'Nf3', 'Nf6'], 'result': 0.5},
+    {'game': ['d4', 'd5', 'c4'], 'result': 0.},
+]
+
+
+class TestBook(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'book.bin')
+        builder = BookBuilder(min_weight=1)
+        builder.add_games(GAMES)
+        self.count = builder.write(self.path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_polyglot_moves(self):
+        board = chess.Board(
+                "r1bqk2r/pppp1ppp/2n2n2/2b1p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 6 5")
+        castling = chess.Move.from_uci("e1g1")
+        code = move_to_polyglot(board, castling)
+        self.assertEqual(code & 0x3f, chess.H1)
+        self.assertEqual(polyglot_to_move(board, code), castling)
+
+        board = chess.Board("8/P6k/8/8/8/8/8/K7 w - - 0 1")
+        promotion = chess.Move.from_uci("a7a8n")
+        self.assertEqual(polyglot_to_move(board,
+            move_to_polyglot(board, promotion)), promotion)
+
+    def test_probe(self):
+        book = OpeningBook(self.path)
+        self.assertEqual(len(book), self.count)
+
+        node = Node()
+        # e4 weights 2 + 2 + 1, d4 is lost by white and not in the book
+        self.assertEqual(book.probe(node), [(chess.Move.from_uci("e2e4"), 5)])
+
+        node.push(chess.Move.from_uci("e2e4"))
+        self.assertEqual(book.probe(node), [(chess.Move.from_uci("e7e5"), 1)])
+
+        node = Node(chess.Board(
+            "r1bqk2r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4"))
+        self.assertEqual(book.move(node), None)
+
+    def test_python_chess_reader(self):
+        # the book can be read by other Polyglot readers
+        board = chess.Board()
+        for san in GAMES[0]['game'][:6]:
+            board.push_san(san)
+        with chess.polyglot.open_reader(self.path) as reader:
+            self.assertEqual(reader.find(board).move,
+                    chess.Move.from_uci("e1g1"))
+
+    def test_minmax_book(self):
+        minmax = MinMax(max_depth=3, valuator=Valuator(),
+                book=OpeningBook(self.path))
+        node = Node()
+        self.assertEqual(minmax.next_move(node), chess.Move.from_uci("e2e4"))
+        self.assertEqual(minmax.nodes, 0)
+
+        node.push(chess.Move.from_uci("g2g4"))
+        self.assertIn(minmax.next_move(node), node.edges())
+        self.assertGreater(minmax.nodes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
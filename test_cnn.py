@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from cnn import ChessValueDataset
+from process import GameParser, DataSetBuilder
+from test_process import PGN
+
+class TestChessValueDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        pgn = os.path.join(self.directory, 'games.pgn')
+        with open(pgn, 'w') as f:
+            f.write(PGN)
+        GameParser(pgn, self.directory).run()
+        self.builder = DataSetBuilder(os.path.join(self.directory,
+            'games.jsonl'), self.directory)
+        self.builder.CHUNK_SIZE = 1
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_sharded(self):
+        self.builder.build(2, [DataSetBuilder.MATERIAL])
+        self.assertTrue(os.path.exists(os.path.join(self.directory,
+            'manifest.json')))
+
+        dataset = ChessValueDataset(self.directory)
+        self.assertEqual(len(dataset), 12)
+        self.assertEqual(len(dataset.features), 3)
+        self.assertIsInstance(dataset.features[0], np.memmap)
+
+        # the same positions as a merged dataset
+        merged = tempfile.mkdtemp()
+        try:
+            self.builder.destination_path = merged
+            self.builder.build(1, [DataSetBuilder.MATERIAL], merge=True)
+            reference = ChessValueDataset(merged)
+            for i in range(len(dataset)):
+                self.assertEqual(dataset[i][0].tobytes(),
+                        reference[i][0].tobytes())
+                np.testing.assert_array_equal(dataset[i][1], reference[i][1])
+        finally:
+            shutil.rmtree(merged)
+
+        # slices inside a shard are not copied
+        features, labels = dataset[0:3]
+        self.assertEqual(len(features), 3)
+        self.assertFalse(features.flags['OWNDATA'])
+        features, labels = dataset[6:10]
+        self.assertEqual(len(labels), 4)
+
+    def test_batches(self):
+        self.builder.build(1, [DataSetBuilder.MATERIAL])
+        dataset = ChessValueDataset(self.directory)
+        seen = []
+        for features, labels in dataset.batches(5, seed=1, planes=True):
+            self.assertEqual(features.shape[1:], (12, 64))
+            self.assertEqual(labels.shape[1:], (3,))
+            seen.append(len(features))
+        self.assertEqual(seen, [5, 5, 2])
+
+        # shuffled batches cover every position once
+        ordered = np.concatenate([l for _, l in dataset.batches(12,
+            shuffle=False)])
+        shuffled = np.concatenate([l for _, l in dataset.batches(3, seed=2)])
+        self.assertEqual(sorted(map(tuple, ordered)),
+                sorted(map(tuple, shuffled)))
+
+    def test_soft_labels(self):
+        self.builder.build(1, [DataSetBuilder.RESULT])
+        dataset = ChessValueDataset(self.directory, "result")
+        # 1. e4 is reached in a won game and a drawn game
+        np.testing.assert_array_equal(dataset.soft_labels([0]),
+                [[0.5, 0.5, 0]])
+        for _, labels in dataset.batches(4, soft=True):
+            np.testing.assert_allclose(labels.sum(axis=1), 1)
+
+    def test_legacy_files(self):
+        dataset = ChessValueDataset(os.path.join(os.path.dirname(
+            os.path.abspath(__file__)), 'data', 'raw'))
+        self.assertEqual(len(dataset), 35)
+        self.assertEqual(dataset[0][0].shape, (64,))
+
+if __name__ == '__main__':
+    unittest.main()
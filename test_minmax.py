@@ -0,0 +1,171 @@
+import time
+import unittest
+import chess
+
+from node import Node
+from minmax import MinMax
+from valuator import Valuator
+
+class TestMinMax(unittest.TestCase):
+
+    def test_movetime(self):
+        node = Node()
+        minmax = MinMax(valuator=Valuator())
+        start = time.time()
+        move = minmax.next_move(node, movetime=200)
+        self.assertIn(move, node.edges())
+        # the clock is only checked every few nodes
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(len(node.board.move_stack), 0)
+
+    def test_nodes_budget(self):
+        node = Node()
+        minmax = MinMax(valuator=Valuator())
+        move = minmax.next_move(node, nodes=2000)
+        self.assertIn(move, node.edges())
+        self.assertLessEqual(minmax.nodes, 2000)
+
+    def test_principal_variation(self):
+        node = Node()
+        minmax = MinMax(max_depth=3, valuator=Valuator())
+        move = minmax.next_move(node)
+        self.assertEqual(minmax.pv[0], move)
+        board = chess.Board()
+        for m in minmax.pv:
+            self.assertTrue(board.is_legal(m))
+            board.push(m)
+
+    def test_quiescence(self):
+        # the pawn on d5 is defended, taking it loses the queen
+        board = chess.Board("4k3/8/2p5/3p4/8/8/3Q4/4K3 w - - 0 1")
+        blunder = chess.Move.from_uci("d2d5")
+        minmax = MinMax(max_depth=1, valuator=Valuator(), quiescence=False)
+        self.assertEqual(minmax.next_move(Node(board)), blunder)
+        minmax = MinMax(max_depth=1, valuator=Valuator())
+        self.assertNotEqual(minmax.next_move(Node(board)), blunder)
+        self.assertGreater(minmax.qnodes, 0)
+
+    def test_search_stats(self):
+        node = Node(chess.Board(
+            "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"))
+        minmax = MinMax(max_depth=3, valuator=Valuator(), timing=True)
+        move, stats = minmax.search(node)
+        self.assertEqual(stats.move, move)
+        self.assertEqual(stats.depth, 3)
+        self.assertEqual([it['depth'] for it in stats.iterations], [1, 2, 3])
+        self.assertEqual(sum(it['nodes'] for it in stats.iterations),
+                stats.nodes)
+        self.assertGreater(stats.seldepth, stats.depth)
+        self.assertGreater(stats.evals, 0)
+        self.assertGreater(stats.cutoffs, 0)
+        self.assertLessEqual(stats.first_move_cutoffs, stats.cutoffs)
+        self.assertGreater(stats.movegen_time, 0)
+        self.assertGreater(stats.eval_time, 0)
+        self.assertLess(stats.movegen_time + stats.eval_time, stats.time)
+        self.assertEqual(stats.to_dict()['pv'][0], move.uci())
+
+        # timing doesn't change the search
+        untimed = MinMax(max_depth=3, valuator=Valuator())
+        self.assertEqual(untimed.next_move(node), move)
+        self.assertEqual(untimed.nodes, minmax.nodes)
+        self.assertIsNone(untimed.stats.movegen_time)
+
+    def test_selective_search(self):
+        board = chess.Board(
+            "r1bqkbnr/1ppp1ppp/p1n5/1B2p3/4P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 0 4")
+        full = MinMax(max_depth=4, valuator=Valuator(), null_move=False,
+                reductions=False, futility=False, verbose=False)
+        _, full_stats = full.search(Node(board.copy()))
+        self.assertEqual(full_stats.null_cutoffs + full_stats.reductions +
+                full_stats.futility_prunes, 0)
+        selective = MinMax(max_depth=4, valuator=Valuator(), verbose=False)
+        _, stats = selective.search(Node(board.copy()))
+        self.assertLess(stats.nodes + stats.qnodes,
+                full_stats.nodes + full_stats.qnodes)
+
+        selective = MinMax(max_depth=5, valuator=Valuator(), verbose=False)
+        move, stats = selective.search(Node(board.copy()))
+        self.assertIn(move, board.legal_moves)
+        self.assertGreater(stats.null_cutoffs, 0)
+        self.assertGreater(stats.reductions, 0)
+        self.assertGreater(stats.futility_prunes, 0)
+
+        # effective branching factor of each iteration after the first
+        self.assertIsNone(stats.iterations[0]['ebf'])
+        for previous, it in zip(stats.iterations, stats.iterations[1:]):
+            self.assertAlmostEqual(it['ebf'], (it['nodes'] + it['qnodes']) /
+                    (previous['nodes'] + previous['qnodes']))
+
+        # each technique can be disabled on its own
+        counters = {'null_move': 'null_cutoffs', 'reductions': 'reductions',
+                'futility': 'futility_prunes'}
+        for option, counter in counters.items():
+            minmax = MinMax(max_depth=5, valuator=Valuator(), verbose=False,
+                    **{option: False})
+            minmax.search(Node(board.copy()))
+            self.assertEqual(getattr(minmax.stats, counter), 0)
+
+    def test_principal_variation_search(self):
+        board = chess.Board(
+            "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10")
+        results = []
+        for enabled in (True, False):
+            minmax = MinMax(max_depth=4, valuator=Valuator(), verbose=False,
+                    null_move=False, reductions=False, futility=False,
+                    pvs=enabled, aspiration=enabled)
+            _, stats = minmax.search(Node(board.copy()))
+            results.append(stats)
+
+        # same value as the full window search, with fewer nodes
+        pvs, full = results
+        self.assertEqual(pvs.value, full.value)
+        self.assertLess(pvs.nodes + pvs.qnodes, full.nodes + full.qnodes)
+        self.assertGreater(pvs.pvs_researches, 0)
+        self.assertEqual(full.pvs_researches + full.aspiration_researches, 0)
+
+    def test_mate_distance(self):
+        valuator = Valuator()
+        node = Node(chess.Board("8/8/2K4R/k7/8/8/8/8 w - - 0 1"))
+        minmax = MinMax(max_depth=4, valuator=valuator, verbose=False)
+        move, stats = minmax.search(node)
+        self.assertEqual(move, chess.Move.from_uci("h6h4"))
+        self.assertTrue(valuator.is_mate(stats.value))
+        self.assertEqual(valuator.mate_distance(stats.value), 3)
+        self.assertEqual(len(stats.pv), 3)
+
+        # mates stored in the table are still found at the same distance
+        minmax.max_depth = 5
+        _, stats = minmax.search(node)
+        self.assertEqual(valuator.mate_distance(stats.value), 3)
+
+        node.push(move)
+        _, stats = minmax.search(node)
+        self.assertEqual(stats.value, valuator.MAXVALUE - 2)
+
+    def test_null_move_zugzwang(self):
+        # no null move when the side to move only has pawns
+        board = chess.Board("8/8/1p6/1P1k4/8/3K4/8/8 w - - 0 1")
+        minmax = MinMax(max_depth=5, valuator=Valuator(), verbose=False)
+        minmax.search(Node(board))
+        self.assertEqual(minmax.stats.null_cutoffs, 0)
+
+    def test_game_over(self):
+        valuator = Valuator()
+        # mated at ply 1
+        positions = [("7k/6Q1/6K1/8/8/8/8/8 b - - 0 1", valuator.MAXVALUE - 1),
+                ("7k/8/6QK/8/8/8/8/8 b - - 0 1", 0),
+                ("8/8/8/4k3/8/8/2K5/3B4 w - - 0 1", 0),
+                ("8/8/8/4k3/8/8/2K5/3R4 w - - 150 100", 0)]
+        for quiescence in (True, False):
+            minmax = MinMax(valuator=valuator, quiescence=quiescence)
+            for fen, expected in positions:
+                for depth in (0, 2):
+                    # quiescence doesn't look for stalemates
+                    if quiescence and depth == 0 and fen == positions[1][0]:
+                        continue
+                    self.assertEqual(minmax.minmax(Node(chess.Board(fen)),
+                        depth, valuator.MINVALUE, valuator.MAXVALUE),
+                        expected)
+
+if __name__ == '__main__':
+    unittest.main()
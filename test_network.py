@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+import chess
+import numpy as np
+
+from node import Node, encode_boards
+from minmax import MinMax
+from network import (FEATURES, ValueNetwork, NetworkValuator,
+        boards_to_features, positions_to_features)
+
+
+class TestValueNetwork(unittest.TestCase):
+
+    def setUp(self):
+        self.network = ValueNetwork.random((16, 8), seed=1)
+
+    def test_features(self):
+        boards = [chess.Board(), chess.Board(
+            "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1")]
+        features = boards_to_features(boards)
+        self.assertEqual(features.shape, (2, FEATURES))
+        self.assertEqual(features[0].sum(), 33)
+        self.assertEqual(features[1, -1], 0)
+        np.testing.assert_array_equal(features,
+                positions_to_features(encode_boards(boards)))
+
+    def test_save_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'network.npz')
+            self.network.save(path)
+            loaded = ValueNetwork.load(path)
+        finally:
+            shutil.rmtree(directory)
+        features = boards_to_features([chess.Board()])
+        np.testing.assert_array_equal(self.network.predict(features),
+                loaded.predict(features))
+
+    def test_predict(self):
+        features = boards_to_features([chess.Board(), chess.Board(
+            "4k3/8/8/8/8/8/8/QQQQK3 w - - 0 1")])
+        probabilities = self.network.predict(features)
+        np.testing.assert_allclose(probabilities.sum(axis=1), 1)
+        for i in range(len(features)):
+            np.testing.assert_allclose(self.network.predict_one(features[i]),
+                    probabilities[i])
+
+    def test_gradients(self):
+        features = boards_to_features([chess.Board(), chess.Board(
+            "4k3/8/8/8/8/8/8/QQQQK3 b - - 0 1")])
+        labels = np.array([[0, 1, 0], [1, 0, 0]])
+        loss, weights, biases = self.network.gradients(features, labels)
+
+        # finite differences of a few parameters
+        epsilon = 1e-6
+        for layer, (i, j) in ((0, (4, 3)), (1, (2, 5)), (2, (7, 0))):
+            self.network.weights[layer][i, j] += epsilon
+            shifted, _, _ = self.network.gradients(features, labels)
+            self.network.weights[layer][i, j] -= epsilon
+            self.assertAlmostEqual((shifted - loss) / epsilon,
+                    weights[layer][i, j], places=4)
+        self.network.biases[1][3] += epsilon
+        shifted, _, _ = self.network.gradients(features, labels)
+        self.assertAlmostEqual((shifted - loss) / epsilon, biases[1][3],
+                places=4)
+
+
+class TestNetworkValuator(unittest.TestCase):
+
+    def setUp(self):
+        self.network = ValueNetwork.random((16, 8), seed=1)
+
+    def test_prefetch(self):
+        # castlings, en passant, promotions and captures
+        node = Node(chess.Board(
+            "r3k2r/1P6/8/3pP3/8/8/8/R3K2R w KQkq d6 0 1"))
+        valuator = NetworkValuator(self.network)
+        reference = NetworkValuator(self.network, batch=False)
+        moves = list(node.board.legal_moves)
+        self.assertEqual(valuator.prefetch(node, moves), len(moves))
+        self.assertEqual(reference.prefetch(node, moves), 0)
+
+        for move in moves:
+            node.push(move)
+            self.assertEqual(valuator.static_value(node),
+                    reference.static_value(node), move)
+            node.pop()
+        self.assertEqual(valuator.batches, 1)
+        self.assertEqual(valuator.batch_evals, len(moves))
+
+    def test_search(self):
+        fen = "r1bqkbnr/1ppp1ppp/p1n5/1B2p3/4P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 0 4"
+        results = []
+        for batch in (True, False):
+            valuator = NetworkValuator(self.network, batch=batch)
+            minmax = MinMax(max_depth=3, valuator=valuator, verbose=False)
+            move = minmax.next_move(Node(chess.Board(fen)))
+            results.append((move, minmax.value, minmax.nodes, minmax.qnodes))
+            self.assertEqual(valuator.batches > 0, batch)
+        self.assertEqual(results[0], results[1])
+
+    def test_load_path(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'network.npz')
+            self.network.save(path)
+            valuator = NetworkValuator(path)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(valuator(Node()), NetworkValuator(self.network)(
+            Node()))
+
+
+if __name__ == '__main__':
+    unittest.main()
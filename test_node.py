@@ -1,7 +1,12 @@
+import random
 import unittest
 import chess
+import numpy as np
+import chess.polyglot
 
-from node import Node
+from node import Node, encode_boards, decode_position, \
+        unpack_planes
+from valuator import boards_to_planes
 
 class TestNode(unittest.TestCase):
 
@@ -9,5 +14,61 @@ class TestNode(unittest.TestCase):
         zero_node = Node(chess.Board())
         self.assertEqual(zero_node.value(), 0)
 
+    def test_incremental_key(self):
+        # castling, en passant, promotion with capture and null move
+        fens = [chess.STARTING_FEN,
+                "r3k2r/pppppppp/8/8/8/8/PPPPPPPP/R3K2R w KQkq - 0 1",
+                "4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1",
+                "1r2k3/P7/8/8/8/8/8/4K3 w - - 0 1"]
+        for fen in fens:
+            node = Node(chess.Board(fen))
+            keys = [node.key()]
+            for m in node.edges():
+                node.push(m)
+                self.assertEqual(node.key(),
+                        chess.polyglot.zobrist_hash(node.board))
+                for reply in node.edges():
+                    node.push(reply)
+                    self.assertEqual(node.key(),
+                            chess.polyglot.zobrist_hash(node.board))
+                    node.pop()
+                node.pop()
+            node.push(chess.Move.null())
+            self.assertEqual(node.key(),
+                    chess.polyglot.zobrist_hash(node.board))
+            node.pop()
+            self.assertEqual(node.key(), keys[0])
+
+    def test_key_after_board_change(self):
+        node = Node()
+        node.board.push_san("e4")
+        self.assertEqual(node.key(), chess.polyglot.zobrist_hash(node.board))
+
+    def test_serialize(self):
+        rng = random.Random(7)
+        boards = [chess.Board(), chess.Board(
+            "r3k2r/8/8/3pP3/8/8/8/R3K2R w Kq d6 12 40")]
+        board = chess.Board()
+        for _ in range(400):
+            moves = list(board.legal_moves)
+            if not moves:
+                board = chess.Board()
+                continue
+            board.push(rng.choice(moves))
+            boards.append(board.copy(stack=False))
+
+        encoded = encode_boards(boards)
+        self.assertEqual(encoded.dtype.itemsize, 102)
+        for b, position in zip(boards, encoded):
+            self.assertEqual(decode_position(position).fen(), b.fen())
+            self.assertEqual(decode_position(position.tobytes()).fen(),
+                    b.fen())
+        np.testing.assert_array_equal(unpack_planes(encoded),
+                boards_to_planes(boards))
+
+        node = Node(boards[1])
+        self.assertEqual(Node.deserialize(node.serialize()).board.fen(),
+                boards[1].fen())
+
 if __name__ == '__main__':
     unittest.main()
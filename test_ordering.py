@@ -0,0 +1,65 @@
+import unittest
+import chess
+
+from node import Node
+from minmax import MinMax
+from valuator import Valuator
+from ordering import MoveOrderer, mvv_lva, see
+
+class TestMoveOrderer(unittest.TestCase):
+
+    FENS = [chess.STARTING_FEN,
+            "r3k2r/pPpppppp/8/8/3pP3/8/PPPP1PPP/R3K2R b KQkq e3 0 1",
+            "1r2k3/P7/8/8/8/8/8/4K3 w - - 0 1"]
+
+    def test_all_legal_moves(self):
+        orderer = MoveOrderer()
+        for fen in self.FENS:
+            board = chess.Board(fen)
+            orderer.cutoff(board, next(iter(board.legal_moves)), 0, 3)
+            moves = list(orderer.moves(board, 0, chess.Move.from_uci("e1g1")))
+            self.assertEqual(len(moves), len(set(moves)))
+            self.assertEqual(set(moves), set(board.legal_moves))
+
+    def test_stages(self):
+        board = chess.Board(
+            "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4")
+        tt_move = chess.Move.from_uci("g1f3")
+        moves = list(MoveOrderer().moves(board, 0, tt_move))
+        self.assertEqual(moves[0], tt_move)
+        # same victim, the least valuable attacker comes first
+        self.assertEqual(moves[1], chess.Move.from_uci("c4f7"))
+        self.assertGreater(mvv_lva(board, chess.Move.from_uci("c4f7")),
+                mvv_lva(board, chess.Move.from_uci("h5f7")))
+
+    def test_killers(self):
+        board = chess.Board()
+        orderer = MoveOrderer()
+        killer = chess.Move.from_uci("b1c3")
+        orderer.cutoff(board, killer, 2, 3)
+        self.assertEqual(next(orderer.moves(board, 2)), killer)
+        self.assertEqual(orderer.killers[2][0], killer)
+        self.assertIsNone(orderer.killers[1][0])
+
+    def test_fewer_nodes(self):
+        fen = "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP3PPP/R2QKB1R w KQ - 0 8"
+        nodes = {}
+        for ordering in (False, True):
+            minmax = MinMax(max_depth=3, valuator=Valuator(),
+                    ordering=ordering)
+            minmax.next_move(Node(chess.Board(fen)))
+            nodes[ordering] = minmax.nodes
+        self.assertLess(nodes[True], nodes[False])
+
+    def test_see(self):
+        tests = [("1k1r4/1pp4p/p7/4p3/8/P5P1/1PP4P/2K1R3 w - - 0 1", "e1e5", 100),
+                ("1k1r3q/1ppn3p/p4b2/4p3/8/P2N2P1/1PP1R1BP/2K1Q3 w - - 0 1",
+                    "d3e5", -220),
+                ("4k3/8/2p5/3p4/8/8/3Q4/4K3 w - - 0 1", "d2d5", -800),
+                ("4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1", "e5d6", 100)]
+        for fen, uci, value in tests:
+            self.assertEqual(see(chess.Board(fen), chess.Move.from_uci(uci)),
+                    value)
+
+if __name__ == '__main__':
+    unittest.main()
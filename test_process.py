@@ -0,0 +1,195 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import chess
+import numpy as np
+
+from process import GameParser, DataSetBuilder, read_games, replay_moves
+from transposition import code_to_move
+
+PGN = """[Event "FICS rated blitz game"]
+[White "a"]
+[Black "b"]
+[Result "1-0"]
+
+1. e4 e5 2. Nf3 {a comment
+on two lines} Nc6 3. Bb5 (3. Bc4 Bc5 (3... Nf6)) 3... a6 $1
+4. Bxc6 dxc6 {Black resigns} 1-0
+
+[Event "FICS rated blitz game"]
+[Result "0-1"]
+
+1. f3 e5 2. g4 Qh4# {White checkmated} 0-1
+
+[Event "FICS rated blitz game"]
+[Result "1-0"]
+
+1. d4 d5 {Black forfeits by disconnection} 1-0
+
+[Event "FICS rated blitz game"]
+[Result "1/2-1/2"]
+
+1. e4 e5 {Game drawn by mutual agreement} 1/2-1/2
+"""
+
+class TestGameParser(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pgn = os.path.join(self.directory, 'games.pgn')
+        with open(self.pgn, 'w') as f:
+            f.write(PGN)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_iter_games(self):
+        parser = GameParser(self.pgn, self.directory)
+        games = list(parser.iter_games(self.pgn))
+        self.assertEqual(len(games), 3)
+        self.assertEqual([code_to_move(c).uci() for c in games[0]['moves']],
+                ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1b5', 'a7a6', 'b5c6',
+                    'd7c6'])
+        self.assertEqual(games[0]['result'], 1.)
+        self.assertEqual(len(games[1]['moves']), 4)
+        self.assertEqual(games[1]['result'], 0.)
+        self.assertEqual(games[2]['result'], 0.5)
+
+    def test_run(self):
+        GameParser(self.pgn, self.directory).run()
+        output = os.path.join(self.directory, 'games.jsonl')
+        with open(output) as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(code_to_move(json.loads(lines[1])['moves'][-1]),
+                chess.Move.from_uci('d8h4'))
+        self.assertEqual(len(list(read_games(output))), 3)
+
+    def test_illegal_move(self):
+        with open(self.pgn, 'w') as f:
+            f.write('[Result "1-0"]\n\n1. e4 e5 2. Ke3 Nc6 1-0\n')
+        parser = GameParser(self.pgn, self.directory)
+        self.assertEqual(list(parser.iter_games(self.pgn)), [])
+
+    def test_replay_moves(self):
+        # games parsed before moves codes were stored hold SAN moves
+        games = [{'game': ['e4', 'e5', 'Nf3'], 'result': 0.},
+                {'moves': [1804, 2356, 1350], 'result': 0.}]
+        for game in games:
+            board = chess.Board()
+            for move in replay_moves(game, board):
+                board.push(move)
+            self.assertEqual(board.fen(), "rnbqkbnr/pppp1ppp/8/4p3/4P3/"
+                    "5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2")
+    def test_build(self):
+        GameParser(self.pgn, self.directory).run()
+        games = os.path.join(self.directory, 'games.jsonl')
+        outputs = {}
+        for workers in (1, 2):
+            destination = os.path.join(self.directory, str(workers))
+            os.mkdir(destination)
+            builder = DataSetBuilder(games, destination)
+            builder.CHUNK_SIZE = 1
+            builder.build(workers, [DataSetBuilder.MATERIAL,
+                DataSetBuilder.RESULT], merge=True)
+            outputs[workers] = destination
+
+        records = np.load(os.path.join(outputs[2], "positions.npy"))
+        # 8 + 4 + 2 plies, 1. e4 e5 is found twice
+        self.assertEqual(records.shape, (12,))
+        self.assertEqual(records['material'].shape, (12, 3))
+        self.assertEqual(records['result'].shape, (12, 3))
+        self.assertNotIn('moves', records.dtype.names)
+        np.testing.assert_array_equal(records, np.load(
+            os.path.join(outputs[1], "positions.npy")))
+        # shards are merged
+        self.assertEqual(sorted(os.listdir(outputs[2])),
+                ['manifest.json', 'positions.npy'])
+
+    def test_labels(self):
+        GameParser(self.pgn, self.directory).run()
+        builder = DataSetBuilder(os.path.join(self.directory, 'games.jsonl'),
+                self.directory)
+        games = list(read_games(builder.datapath))
+        records = builder._game_to_dataset(games,
+                DataSetBuilder.FEATURES_TYPES, dedup=False)
+
+        # same labels as the evaluation of each position
+        board = chess.Board()
+        i = 0
+        for game in games:
+            board.reset()
+            for move in replay_moves(game, board):
+                board.push(move)
+                material = builder.valuator.get_material_value(board)
+                squares = builder.valuator.get_all_masks_value(board,
+                        board.turn)
+                moves = builder.valuator.get_number_of_legal_moves_value(
+                        board)
+                for ftype, value in ((DataSetBuilder.MATERIAL, material),
+                        (DataSetBuilder.PIECE_SQUARE, squares),
+                        (DataSetBuilder.LEGAL_MOVES, moves)):
+                    np.testing.assert_array_equal(records[ftype][i],
+                            builder._values_to_labels(np.array([value]))[0])
+                np.testing.assert_array_equal(records['result'][i],
+                        builder._result_to_label(game['result']))
+                i += 1
+        self.assertEqual(i, len(records))
+        # checkmate: no legal move
+        np.testing.assert_array_equal(records['moves'][11], [0, 1, 0])
+
+        with self.assertRaises(Exception):
+            builder.records_dtype(['unknown'])
+
+    def test_dedup(self):
+        GameParser(self.pgn, self.directory).run()
+        builder = DataSetBuilder(os.path.join(self.directory, 'games.jsonl'),
+                self.directory)
+        games = list(read_games(builder.datapath))
+
+        records = builder._game_to_dataset(games, [DataSetBuilder.RESULT],
+                dedup=False)
+        self.assertEqual(len(records), 14)
+
+        records = builder._game_to_dataset(games, [DataSetBuilder.RESULT])
+        stats = records['stats']
+        labels = records['result']
+        self.assertEqual(len(records), 12)
+        self.assertEqual(len(set(records['key'])), 12)
+        # 1. e4 is reached in a won game and a drawn game
+        np.testing.assert_array_equal(stats[0], [1, 1, 0])
+        self.assertEqual(stats.sum(), 14)
+        self.assertEqual(labels.sum(), 12)
+
+    def test_result_labels(self):
+        GameParser(self.pgn, self.directory).run()
+        builder = DataSetBuilder(os.path.join(self.directory, 'games.jsonl'),
+                self.directory)
+        games = list(read_games(builder.datapath))
+        # 1-0, then 1. f3 e5 2. g4 Qh4# 0-1
+        for game, label in zip(games, ([1, 0, 0], [0, 0, 1])):
+            records = builder._game_to_dataset([game],
+                    [DataSetBuilder.RESULT], dedup=False)
+            np.testing.assert_array_equal(records['stats'],
+                    [label] * len(records))
+            np.testing.assert_array_equal(records['result'],
+                    [label] * len(records))
+
+    def test_dedup_across_shards(self):
+        GameParser(self.pgn, self.directory).run()
+        builder = DataSetBuilder(os.path.join(self.directory, 'games.jsonl'),
+                self.directory)
+        builder.CHUNK_SIZE = 1
+        builder.build(2, [DataSetBuilder.RESULT])
+        with open(os.path.join(self.directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest['count'], 12)
+        stats = [np.load(os.path.join(self.directory,
+            shard['positions']))['stats'] for shard in manifest['shards']]
+        np.testing.assert_array_equal(stats[0][0], [1, 1, 0])
+        self.assertEqual(sum(s.sum() for s in stats), 14)
+
+if __name__ == '__main__':
+    unittest.main()
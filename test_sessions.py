@@ -0,0 +1,236 @@
+import time
+import chess
+import unittest
+
+from sessions import SessionStore, SearchService
+
+
+class TestSessions(unittest.TestCase):
+
+    def test_sessions_are_independent(self):
+        store = SessionStore()
+        first = store.get()
+        second = store.get()
+        first.node.push(chess.Move.from_uci("e2e4"))
+
+        self.assertIsNot(first, second)
+        self.assertIs(store.get(first.id), first)
+        self.assertEqual(second.node.board.fen(), chess.STARTING_FEN)
+
+    def test_eviction(self):
+        store = SessionStore(max_sessions=2)
+        evicted = []
+        store.on_evict = evicted.append
+        first = store.get()
+        second = store.get()
+        store.get(first.id)
+        store.get()
+
+        # the least recently used session is evicted
+        self.assertEqual(len(store), 2)
+        self.assertEqual(evicted, [second])
+        self.assertIsNone(store.get(second.id, create=False))
+
+        store.idle_timeout = 0
+        store.get()
+        self.assertEqual(len(store), 1)
+
+    def test_search(self):
+        store = SessionStore(max_depth=2)
+        service = SearchService(workers=2)
+        try:
+            sessions = [store.get(), store.get()]
+            jobs = []
+            for session in sessions:
+                with session.lock:
+                    session.node.push(chess.Move.from_uci("e2e4"))
+                    jobs.append(service.submit(session))
+
+            for session, job in zip(sessions, jobs):
+                service.wait(job)
+                status = service.status(job)
+                self.assertEqual(status['status'], 'done')
+                self.assertEqual(len(session.node.board.move_stack), 2)
+                self.assertEqual(session.node.board.move_stack[-1].uci(),
+                        status['move'])
+                self.assertEqual(status['stats']['move'], status['move'])
+                self.assertEqual(session.stats, status['stats'])
+                self.assertIsNone(session.job)
+
+            summary = service.summary()
+            self.assertEqual(summary['searches'], 2)
+            self.assertGreater(summary['nodes'], 0)
+        finally:
+            service.shutdown()
+
+    def test_forget(self):
+        store = SessionStore(max_depth=3)
+        service = SearchService(workers=1)
+        try:
+            session = store.get()
+            with session.lock:
+                session.node.push(chess.Move.from_uci("e2e4"))
+                job = service.submit(session)
+                searched = service.jobs[job]
+                service.forget(session)
+                session.reset()
+
+            # the done callback runs for forgotten searches too
+            self.assertTrue(searched.done.wait(10))
+            # the move of the forgotten search is not played
+            self.assertIsNone(service.status(job))
+            self.assertEqual(session.node.board.fen(), chess.STARTING_FEN)
+        finally:
+            service.shutdown()
+
+    def test_ponder(self):
+        store = SessionStore(max_depth=3)
+        service = SearchService(workers=1)
+        try:
+            session = store.get()
+            with session.lock:
+                session.node.push(chess.Move.from_uci("e2e4"))
+                job = service.submit(session)
+            service.wait(job)
+
+            # the predicted reply is searched once the AI played
+            ponder = service.jobs[session.ponder]
+            self.assertTrue(ponder.ponder)
+            self.assertEqual(ponder.ply, 3)
+            ponder.future.result()
+
+            with session.lock:
+                session.node.push(chess.Move.from_uci(ponder.moves[-1]))
+                job = service.submit(session)
+            # the result of the ponder search is played right away
+            self.assertEqual(job, session.last_job)
+            self.assertIsNone(session.job)
+            self.assertEqual(len(session.node.board.move_stack), 4)
+            status = service.status(job)
+            self.assertTrue(status['ponder'])
+            self.assertEqual(session.node.board.move_stack[-1].uci(),
+                    status['move'])
+
+            # another move stops the ponder search
+            ponder = service.jobs[session.ponder]
+            with session.lock:
+                board = session.node.board
+                move = next(m for m in board.legal_moves
+                        if m.uci() != ponder.moves[-1])
+                session.node.push(move)
+                job = service.submit(session)
+            self.assertNotIn(ponder, service.jobs.values())
+            service.wait(job)
+            self.assertEqual(len(session.node.board.move_stack), 6)
+            self.assertFalse(service.status(job)['ponder'])
+
+            summary = service.summary()
+            self.assertEqual(summary['ponder_hits'], 1)
+            self.assertEqual(summary['ponder_misses'], 1)
+            self.assertEqual(summary['searches'], 3)
+        finally:
+            service.shutdown()
+
+    def test_ponder_movetime(self):
+        store = SessionStore(max_depth=3)
+        service = SearchService(workers=1)
+        try:
+            session = store.get()
+            with session.lock:
+                session.node.push(chess.Move.from_uci("e2e4"))
+                job = service.submit(session, movetime=200)
+            service.wait(job)
+
+            # with a time budget the ponder search has no depth limit
+            ponder = service.jobs[session.ponder]
+            self.assertTrue(ponder.infinite)
+            time.sleep(0.3)
+            self.assertFalse(ponder.future.done())
+
+            # the time spent pondering covers the budget, the search is
+            # stopped and played right away
+            start = time.time()
+            with session.lock:
+                session.node.push(chess.Move.from_uci(ponder.moves[-1]))
+                job = service.submit(session, movetime=200)
+            service.wait(job)
+            self.assertLess(time.time() - start, 0.2)
+            self.assertIsNone(ponder.timer)
+            self.assertEqual(len(session.node.board.move_stack), 4)
+            self.assertTrue(service.status(job)['ponder'])
+
+            # otherwise it goes on for the rest of the budget
+            ponder = service.jobs[session.ponder]
+            with session.lock:
+                session.node.push(chess.Move.from_uci(ponder.moves[-1]))
+                job = service.submit(session, movetime=2000)
+            self.assertIsNotNone(ponder.timer)
+            self.assertFalse(ponder.future.done())
+            service.wait(job)
+            self.assertEqual(len(session.node.board.move_stack), 6)
+            self.assertEqual(service.summary()['ponder_hits'], 2)
+        finally:
+            service.shutdown()
+
+    def test_ponder_bounded(self):
+        store = SessionStore(max_depth=3)
+        service = SearchService(workers=1)
+        service.PONDER_MOVETIME_FACTOR = 2
+        try:
+            session = store.get()
+            with session.lock:
+                session.node.push(chess.Move.from_uci("e2e4"))
+                job = service.submit(session, movetime=100)
+            service.wait(job)
+
+            # the player doesn't move: the ponder search frees the process
+            ponder = service.jobs[session.ponder]
+            ponder.future.result(timeout=5)
+            self.assertEqual(service.summary()['pondering'], 0)
+
+            # and is still played if the predicted move comes
+            with session.lock:
+                session.node.push(chess.Move.from_uci(ponder.moves[-1]))
+                job = service.submit(session, movetime=100)
+            service.wait(job)
+            self.assertEqual(len(session.node.board.move_stack), 4)
+            self.assertTrue(service.status(job)['ponder'])
+        finally:
+            service.shutdown()
+
+    def test_ponder_preempted(self):
+        store = SessionStore(max_depth=2)
+        service = SearchService(workers=1)
+        try:
+            first, second = store.get(), store.get()
+            with first.lock:
+                first.node.push(chess.Move.from_uci("e2e4"))
+                job = service.submit(first, movetime=100)
+            service.wait(job)
+            ponder = service.jobs[first.ponder]
+            self.assertEqual(service.summary()['pondering'], 1)
+
+            # the search of another game stops the ponder search holding
+            # the only process
+            with second.lock:
+                second.node.push(chess.Move.from_uci("d2d4"))
+                job = service.submit(second, movetime=100)
+            self.assertNotIn(ponder, service.jobs.values())
+            self.assertTrue(ponder.stop.is_set())
+            service.wait(job)
+            self.assertEqual(len(second.node.board.move_stack), 2)
+
+            # the predicted move is then searched again
+            with first.lock:
+                first.node.push(chess.Move.from_uci(ponder.moves[-1]))
+                job = service.submit(first, movetime=100)
+            service.wait(job)
+            self.assertFalse(service.status(job)['ponder'])
+            self.assertEqual(len(first.node.board.move_stack), 4)
+            self.assertEqual(service.summary()['ponder_hits'], 0)
+        finally:
+            service.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+import chess
+
+from node import Node
+from smp import ParallelSearch
+
+class TestParallelSearch(unittest.TestCase):
+
+    def test_next_move(self):
+        search = ParallelSearch(workers=2, max_depth=2, table_mb=1)
+        try:
+            node = Node(chess.Board(
+                "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4"))
+            self.assertEqual(search.next_move(node),
+                    chess.Move.from_uci("h5f7"))
+            self.assertEqual(len(search.results), 2)
+
+            node = Node()
+            self.assertIn(search.next_move(node, movetime=300), node.edges())
+            self.assertGreater(search.nodes, 0)
+        finally:
+            search.close()
+
+if __name__ == '__main__':
+    unittest.main()
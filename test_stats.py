@@ -0,0 +1,35 @@
+import json
+import unittest
+
+from node import Node
+from minmax import MinMax
+from valuator import Valuator
+from stats import SearchStats, profile_call
+
+
+class TestStats(unittest.TestCase):
+
+    def test_to_dict(self):
+        stats = SearchStats()
+        stats.value = Valuator.MAXVALUE - 3
+        stats.iterations.append({'depth': 1, 'nodes': 1, 'qnodes': 0,
+            'time': 0., 'value': -120, 'move': None})
+        data = json.loads(json.dumps(stats.to_dict(), allow_nan=False))
+        self.assertEqual(data['value'], Valuator.MAXVALUE - 3)
+        self.assertEqual(data['iterations'][0]['value'], -120)
+        self.assertEqual(data['first_move_cutoff_rate'], 0)
+
+    def test_profilers(self):
+        for profiler in ('cprofile', 'sampling'):
+            minmax = MinMax(max_depth=3, valuator=Valuator())
+            move, stats = minmax.search(Node(), profile=profiler)
+            self.assertIn(move, Node().edges())
+            self.assertIsInstance(stats.profile, list)
+        self.assertGreater(len(stats.profile), 0)
+
+        with self.assertRaises(Exception):
+            profile_call('unknown', len, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import io
+import shutil
+import tempfile
+import unittest
+import contextlib
+import chess
+
+import train
+from node import Node
+from cnn import ChessValueDataset
+from network import ValueNetwork, NetworkValuator
+from process import GameParser, DataSetBuilder
+from test_process import PGN
+
+# fool's mates, won by white then by black
+MATES = """[Result "1-0"]
+
+1. e4 f5 2. exf5 g5 3. Qh5# 1-0
+
+[Result "0-1"]
+
+1. f3 e5 2. g4 Qh4# 0-1
+"""
+
+
+class TestTrain(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        pgn = os.path.join(self.directory, 'games.pgn')
+        with open(pgn, 'w') as f:
+            f.write(PGN)
+        with contextlib.redirect_stdout(io.StringIO()):
+            GameParser(pgn, self.directory).run()
+            DataSetBuilder(os.path.join(self.directory, 'games.jsonl'),
+                    self.directory).build(1, [DataSetBuilder.MATERIAL])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_train(self):
+        dataset = ChessValueDataset(self.directory)
+        network = ValueNetwork.random((16,), seed=0)
+        before, _ = train.evaluate(network, dataset)
+        with contextlib.redirect_stdout(io.StringIO()):
+            losses = train.train(network, dataset, epochs=20, batch_size=4,
+                    learning_rate=1e-2, seed=0)
+        self.assertEqual(len(losses), 20)
+        self.assertLess(losses[-1], losses[0])
+        after, accuracy = train.evaluate(network, dataset)
+        self.assertLess(after, before)
+        self.assertGreater(accuracy, 0.5)
+
+    def test_main(self):
+        path = os.path.join(self.directory, 'network.npz')
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(train.main([self.directory, '--epochs', '2',
+                '--hidden', '8', '--seed', '1', '--save', path]), 0)
+        network = ValueNetwork.load(path)
+        self.assertEqual(network.weights[0].shape[1], 8)
+
+        # training goes on from a saved network
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(train.main([self.directory, '--epochs', '1',
+                '--init', path, '--save', path]), 0)
+
+    def test_result_sign(self):
+        directory = os.path.join(self.directory, 'mates')
+        os.mkdir(directory)
+        pgn = os.path.join(directory, 'mates.pgn')
+        with open(pgn, 'w') as f:
+            f.write(MATES)
+        with contextlib.redirect_stdout(io.StringIO()):
+            GameParser(pgn, directory).run()
+            DataSetBuilder(os.path.join(directory, 'mates.jsonl'),
+                    directory).build(1, [DataSetBuilder.RESULT])
+
+        for soft in (False, True):
+            dataset = ChessValueDataset(directory, "result")
+            network = ValueNetwork.random((16,), seed=0)
+            with contextlib.redirect_stdout(io.StringIO()):
+                train.train(network, dataset, epochs=50, batch_size=4,
+                        learning_rate=1e-2, soft=soft, seed=0)
+            valuator = NetworkValuator(network)
+            # the side about to mate has a positive value for white
+            for moves, sign in ((['e4', 'f5', 'exf5', 'g5'], 1),
+                    (['f3', 'e5', 'g4'], -1)):
+                board = chess.Board()
+                for move in moves:
+                    board.push_san(move)
+                self.assertGreater(sign * valuator.static_value(Node(board)),
+                        0, (moves, soft))
+
+
+if __name__ == '__main__':
+    unittest.main()
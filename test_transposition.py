@@ -0,0 +1,74 @@
+import unittest
+import chess
+
+from node import Node
+from minmax import MinMax
+from valuator import Valuator
+from transposition import TranspositionTable, move_to_code, code_to_move
+
+class TestTranspositionTable(unittest.TestCase):
+
+    def test_move_code(self):
+        for move in [chess.Move.from_uci("e2e4"), chess.Move.from_uci("a7a8q"),
+                chess.Move.from_uci("h2h1n")]:
+            self.assertEqual(code_to_move(move_to_code(move)), move)
+        self.assertIsNone(code_to_move(move_to_code(None)))
+
+    def test_store_and_probe(self):
+        table = TranspositionTable(size_mb=1)
+        move = chess.Move.from_uci("e2e4")
+        self.assertIsNone(table.probe(42))
+        table.store(42, 3, TranspositionTable.EXACT, 12, move)
+        self.assertEqual(table.probe(42), (3, TranspositionTable.EXACT,
+            12, move))
+
+        # mate values fit in the score field
+        valuator = Valuator()
+        table.store(43, 1, TranspositionTable.LOWER, valuator.MINVALUE + 3,
+                None)
+        self.assertEqual(table.probe(43)[2], valuator.MINVALUE + 3)
+
+    def test_replacement(self):
+        table = TranspositionTable(size_mb=1)
+        deep = 1
+        shallow = deep + table.buckets
+        other = deep + 2 * table.buckets
+        table.store(deep, 5, TranspositionTable.EXACT, 1, None)
+        table.store(shallow, 1, TranspositionTable.EXACT, 2, None)
+        table.store(other, 2, TranspositionTable.LOWER, 3, None)
+
+        # the deepest entry is kept, the other slot is always replaced
+        self.assertIsNotNone(table.probe(deep))
+        self.assertIsNone(table.probe(shallow))
+        self.assertEqual(table.probe(other)[2], 3)
+
+    def test_bounded_size(self):
+        table = TranspositionTable(size_mb=1)
+        size = len(table)
+        for key in range(10 * size):
+            table.store(key, 1, TranspositionTable.EXACT, 0, None)
+        self.assertEqual(len(table), size)
+
+    def test_shared_buffer(self):
+        buffer = bytearray(TranspositionTable.nbytes(1))
+        writer = TranspositionTable(size_mb=1, buffer=buffer)
+        reader = TranspositionTable(size_mb=1, buffer=buffer)
+        move = chess.Move.from_uci("g1f3")
+        writer.store(1234, 2, TranspositionTable.LOWER, -5, move)
+        self.assertEqual(reader.probe(1234), (2, TranspositionTable.LOWER,
+            -5, move))
+
+        # a partially overwritten entry is not returned
+        idx = reader._index(1234)
+        writer.scores[idx] = 7
+        self.assertIsNone(reader.probe(1234))
+
+    def test_same_move_with_table(self):
+        board = chess.Board(
+            "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4")
+        minmax = MinMax(max_depth=2, valuator=Valuator())
+        move = minmax.next_move(Node(board))
+        self.assertEqual(move, chess.Move.from_uci("h5f7"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import io
+import time
+import chess
+import unittest
+import threading
+
+from uci import UciEngine
+from transposition import TranspositionTable
+
+
+class TestUci(unittest.TestCase):
+
+    def setUp(self):
+        self.output = io.StringIO()
+        self.engine = UciEngine(self.output)
+
+    def tearDown(self):
+        self.engine.handle("quit")
+
+    def lines(self):
+        return self.output.getvalue().splitlines()
+
+    def bestmove(self):
+        if self.engine.thread is not None:
+            self.engine.thread.join(10)
+        return [l for l in self.lines() if l.startswith("bestmove")][-1]
+
+    def test_handshake(self):
+        self.engine.handle("uci")
+        self.engine.handle("isready")
+        self.assertEqual(self.lines()[-2:], ["uciok", "readyok"])
+        self.assertIn("option name Hash type spin default 16 min 1 max 4096",
+                self.lines())
+
+    def test_go_depth(self):
+        self.engine.handle("position startpos moves e2e4 e7e5")
+        self.engine.handle("go depth 2")
+        move = chess.Move.from_uci(self.bestmove().split()[1])
+        board = chess.Board()
+        board.push_uci("e2e4")
+        board.push_uci("e7e5")
+        self.assertIn(move, board.legal_moves)
+        infos = [l for l in self.lines() if l.startswith("info depth")]
+        self.assertEqual(len(infos), 2)
+        self.assertIn(" nps ", infos[-1])
+        self.assertIn(" pv ", infos[-1])
+
+    def test_mate_score(self):
+        self.engine.handle("position fen r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/"
+                "PPPP1PPP/RNB1K1NR w KQkq - 4 4")
+        self.engine.handle("go movetime 100")
+        self.assertEqual(self.bestmove(), "bestmove h5f7")
+        self.assertIn("score mate 1", self.output.getvalue())
+
+    def test_mate_distance(self):
+        self.engine.handle("position fen 8/8/2K4R/k7/8/8/8/8 w - - 0 1")
+        self.engine.handle("go depth 4")
+        self.assertEqual(self.bestmove().split()[1], "h6h4")
+        self.assertIn("score mate 2", self.output.getvalue())
+
+        self.engine.handle("position fen 8/8/2K5/k7/7R/8/8/8 b - - 0 1")
+        self.engine.handle("go depth 3")
+        self.bestmove()
+        self.assertIn("score mate -1", self.output.getvalue())
+
+    def test_stop(self):
+        self.engine.handle("position startpos")
+        self.engine.handle("go infinite")
+        time.sleep(0.2)
+        self.assertNotIn("bestmove", self.output.getvalue())
+        start = time.time()
+        self.engine.handle("stop")
+        self.assertLess(time.time() - start, 2)
+        self.assertTrue(self.bestmove().startswith("bestmove "))
+
+    def test_stop_parallel(self):
+        self.engine.handle("setoption name Threads value 2")
+        self.engine.handle("position startpos")
+        # stop sent before the search thread started
+        search = self.engine._search
+        def delayed(*args):
+            time.sleep(0.05)
+            search(*args)
+        self.engine._search = delayed
+        self.engine.handle("go infinite")
+        stop = threading.Thread(target=self.engine.handle, args=("stop",))
+        stop.start()
+        stop.join(5)
+        blocked = stop.is_alive()
+        if blocked:
+            self.engine.parallel.stop_event.set()
+            stop.join()
+        self.assertFalse(blocked)
+        self.assertTrue(self.bestmove().startswith("bestmove "))
+
+    def test_ponderhit(self):
+        self.engine.handle("position startpos")
+        self.engine.handle("go ponder wtime 3000 btime 3000")
+        time.sleep(0.2)
+        self.assertNotIn("bestmove", self.output.getvalue())
+        self.engine.handle("ponderhit")
+        self.assertTrue(self.bestmove().startswith("bestmove "))
+
+    def test_setoption(self):
+        self.engine.handle("setoption name Ponder value true")
+        self.assertNotIn("unknown option", self.output.getvalue())
+        self.engine.handle("setoption name Hash value 1")
+        self.engine.handle("go depth 1")
+        self.bestmove()
+        self.assertEqual(self.engine.minmax.table.buckets,
+                TranspositionTable.buckets_count(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
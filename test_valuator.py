@@ -1,6 +1,8 @@
+import random
 import unittest
 import chess
-from valuator import Valuator
+import numpy as np
+from valuator import Valuator, boards_to_planes
 from node import Node
 
 class TestValuator(unittest.TestCase):
@@ -15,8 +17,118 @@ class TestValuator(unittest.TestCase):
         self.assertEqual(material_val, 0)
         self.assertEqual(square_val_w + square_val_b, 0)
 
+    def test_square_tables(self):
+        valuator = Valuator()
+        for color in chess.COLORS:
+            for piece_type in valuator.PIECES_SQUARE_VALUES:
+                board = chess.Board(None)
+                for square in chess.SQUARES:
+                    board.set_piece_at(square, chess.Piece(piece_type, color))
+                    expected = valuator.get_mask_value(board, piece_type,
+                            color)
+                    if color == chess.BLACK:
+                        expected = -expected
+                    self.assertEqual(expected,
+                            valuator.SQUARE_TABLES[color][piece_type][square])
+                    board.remove_piece_at(square)
+
+    def test_incremental_value(self):
+        # regression corpus of random games, with promotions, castling
+        # and en passant
+        rng = random.Random(1234)
+        valuator = Valuator()
+        positions = 0
+        for _ in range(20):
+            node = Node()
+            for _ in range(150):
+                moves = node.edges()
+                if not moves:
+                    break
+                node.push(rng.choice(moves))
+                self.assertEqual(valuator.incremental_value(node),
+                        valuator.value(node.board))
+                positions += 1
+            # unmake all moves
+            while node.board.move_stack:
+                node.pop()
+                self.assertEqual(valuator.incremental_value(node),
+                        valuator.value(node.board))
+        self.assertGreater(positions, 1000)
+
+    def test_bitboard_value(self):
+        rng = random.Random(7)
+        valuator = Valuator()
+        boards = [chess.Board("7k/6Q1/6K1/8/8/8/8/8 b - - 0 1"),
+                chess.Board("7k/8/6QK/8/8/8/8/8 b - - 0 1"),
+                chess.Board("8/8/8/4k3/8/8/2K5/3B4 w - - 0 1"),
+                chess.Board("8/8/8/4k3/8/8/2K5/3R4 w - - 150 100")]
+        for _ in range(10):
+            board = chess.Board()
+            for _ in range(rng.randint(0, 150)):
+                moves = list(board.legal_moves)
+                if not moves:
+                    break
+                board.push(rng.choice(moves))
+            boards.append(board)
+
+        for board in boards:
+            self.assertEqual(valuator.bitboard_value(board),
+                    valuator.value(board))
+            self.assertEqual(valuator.bitboard_material_value(board),
+                    valuator.get_material_value(board))
+            for color in chess.COLORS:
+                self.assertEqual(valuator.bitboard_mask_value(board, color),
+                        valuator.get_all_masks_value(board, color))
 
+        node = Node(boards[-1])
+        self.assertEqual(Valuator(backend=Valuator.BITBOARD)(node),
+                Valuator()(node))
+        with self.assertRaises(Exception):
+            Valuator(backend="unknown")
+
+    def test_attack_mobility(self):
+        rng = random.Random(3)
+        valuator = Valuator()
+        board = chess.Board()
+        for _ in range(200):
+            moves = list(board.legal_moves)
+            if not moves:
+                board = chess.Board()
+                continue
+            board.push(rng.choice(moves))
+
+            # pseudo-legal moves, promotions counted once
+            expected = len({(m.from_square, m.to_square)
+                for m in board.generate_pseudo_legal_moves()
+                if not board.is_castling(m) and not board.is_en_passant(m)})
+            if board.turn == chess.BLACK:
+                expected = -expected
+            self.assertEqual(valuator.attack_mobility(board), expected)
+
+    def test_batch_value(self):
+        rng = random.Random(42)
+        valuator = Valuator()
+        boards = []
+        board = chess.Board()
+        for _ in range(300):
+            moves = list(board.legal_moves)
+            if not moves:
+                board = chess.Board()
+                continue
+            board.push(rng.choice(moves))
+            boards.append(board.copy())
 
+        planes = boards_to_planes(boards)
+        self.assertEqual(planes.shape, (len(boards), 12, 64))
+        turns = np.array([b.turn for b in boards])
+        material = valuator.batch_material_value(planes)
+        squares = valuator.batch_mask_value(planes, turns)
+        values = valuator.batch_value(planes, turns)
+        for i, b in enumerate(boards):
+            self.assertEqual(material[i], valuator.get_material_value(b))
+            self.assertEqual(squares[i],
+                    valuator.get_all_masks_value(b, b.turn))
+            self.assertEqual(values[i], material[i] * 10 + squares[i] * 3)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,134 @@
+"""
+Train the value network on a dataset built by process.DataSetBuilder
+
+    python train.py data/raw --feature material --epochs 10 --save network.npz
+"""
+import sys
+import time
+import argparse
+import numpy as np
+
+from cnn import ChessValueDataset
+from network import ValueNetwork, positions_to_features
+
+
+class Adam:
+    """
+    Adam optimizer updating the arrays of a network in place
+    """
+
+    def __init__(self, parameters, learning_rate=1e-3, beta1=0.9,
+            beta2=0.999, epsilon=1e-8):
+        """
+        parameters: list of arrays to optimize
+        """
+        self.parameters = parameters
+        self.learning_rate = learning_rate
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.steps = 0
+        self.moments = [np.zeros_like(p) for p in parameters]
+        self.velocities = [np.zeros_like(p) for p in parameters]
+
+    def step(self, gradients):
+        """
+        Update the parameters from their gradients
+        gradients: list of arrays, in the order of the parameters
+        """
+        self.steps += 1
+        correction1 = 1 - self.beta1 ** self.steps
+        correction2 = 1 - self.beta2 ** self.steps
+        for p, g, m, v in zip(self.parameters, gradients, self.moments,
+                self.velocities):
+            m *= self.beta1
+            m += (1 - self.beta1) * g
+            v *= self.beta2
+            v += (1 - self.beta2) * g * g
+            p -= self.learning_rate * (m / correction1) / \
+                    (np.sqrt(v / correction2) + self.epsilon)
+
+
+def evaluate(network, dataset, batch_size=1024, soft=False):
+    """
+    Loss and accuracy of a network over a dataset
+    return: loss, accuracy
+    """
+    loss = 0.
+    correct = 0
+    for positions, labels in dataset.batches(batch_size, shuffle=False,
+            soft=soft):
+        features = positions_to_features(positions)
+        probabilities = network.predict(features)
+        labels = np.asarray(labels, dtype=np.float32)
+        loss -= float((labels * np.log(np.maximum(probabilities,
+            1e-12))).sum())
+        correct += int((probabilities.argmax(axis=1) ==
+            labels.argmax(axis=1)).sum())
+    return loss / len(dataset), correct / len(dataset)
+
+
+def train(network, dataset, epochs=10, batch_size=256, learning_rate=1e-3,
+        soft=False, seed=None):
+    """
+    Train a network with mini-batches of shuffled positions
+    network: ValueNetwork, updated in place
+    dataset: cnn.ChessValueDataset of compact positions
+    soft: train on the results frequencies, see ChessValueDataset.batches
+    return: list of the mean loss of each epoch
+    """
+    optimizer = Adam(network.weights + network.biases, learning_rate)
+    rng = np.random.RandomState(seed)
+    losses = []
+    for epoch in range(epochs):
+        start = time.time()
+        total = 0.
+        for positions, labels in dataset.batches(batch_size,
+                seed=rng.randint(1 << 31), soft=soft):
+            loss, weights, biases = network.gradients(
+                    positions_to_features(positions), labels)
+            optimizer.step(weights + biases)
+            total += loss * len(positions)
+        losses.append(total / len(dataset))
+        print("Epoch %d: loss %.4f in %.3f seconds" % (epoch + 1,
+            losses[-1], time.time() - start))
+    return losses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the value network")
+    parser.add_argument('path', help="directory of the dataset")
+    parser.add_argument('--feature', default="material",
+            help="feature type of the dataset")
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--learning-rate', type=float, default=1e-3)
+    parser.add_argument('--hidden', type=int, nargs='+',
+            default=list(ValueNetwork.HIDDEN_SIZES),
+            help="units of each hidden layer")
+    parser.add_argument('--soft', action='store_true',
+            help="train on the results frequencies of the positions")
+    parser.add_argument('--init', help="network to start from")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--save', default="network.npz",
+            help="file of the trained network")
+    args = parser.parse_args(argv)
+
+    dataset = ChessValueDataset(args.path, args.feature)
+    print("Training on %d positions" % len(dataset))
+    if args.init:
+        network = ValueNetwork.load(args.init)
+    else:
+        network = ValueNetwork.random(args.hidden, args.seed)
+
+    train(network, dataset, args.epochs, args.batch_size,
+            args.learning_rate, args.soft, args.seed)
+    loss, accuracy = evaluate(network, dataset, soft=args.soft)
+    print("Loss %.4f, accuracy %.3f" % (loss, accuracy))
+    network.save(args.save)
+    print("Network saved in %s" % args.save)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
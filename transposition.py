@@ -0,0 +1,169 @@
+
+import chess
+import numpy as np
+
+
+def move_to_code(move):
+    """
+    Encode a move into a 16 bits integer
+    from square on bits 0-5, to square on bits 6-11, promotion on bits 12-14
+    move: chess.Move or None
+    return: int
+    """
+    if not move:
+        return 0
+    return move.from_square | (move.to_square << 6) | \
+            ((move.promotion or 0) << 12)
+
+
+def code_to_move(code):
+    """
+    Decode a 16 bits integer into a move
+    return: chess.Move or None
+    """
+    if not code:
+        return None
+    promotion = (code >> 12) & 7
+    return chess.Move(code & 63, (code >> 6) & 63, promotion or None)
+
+
+class TranspositionTable:
+    """
+    Fixed size hash table of searched positions indexed by zobrist keys.
+
+    Each bucket holds two entries: the first one is only replaced by a
+    deeper search (depth-preferred), the second one is always replaced.
+
+    Entries are stored in flat arrays that can live in a shared memory
+    buffer. Keys are stored xored with the entry data so that an entry
+    half written by another process is seen as a miss.
+    """
+
+    # Bound types
+    EMPTY = 0
+    EXACT = 1
+    LOWER = 2
+    UPPER = 3
+
+    BUCKET_SIZE = 2
+
+    # Size in bytes of one entry: key, score, move, depth and flag
+    ENTRY_SIZE = 8 + 4 + 2 + 1 + 1
+
+    DEFAULT_SIZE_MB = 16
+
+    def __init__(self, size_mb=DEFAULT_SIZE_MB, buffer=None):
+        """
+        size_mb: size of the table in megabytes
+        buffer: optional buffer of at least nbytes(size_mb) bytes holding
+        the table, like multiprocessing.shared_memory.SharedMemory.buf
+        """
+        self.buckets = self.buckets_count(size_mb)
+        size = self.buckets * self.BUCKET_SIZE
+
+        if buffer is None:
+            buffer = bytearray(self.nbytes(size_mb))
+
+        # Fields are laid out one after the other, largest first
+        offset = 0
+        arrays = []
+        for dtype in (np.uint64, np.int32, np.uint16, np.int8, np.uint8):
+            array = np.frombuffer(buffer, dtype=dtype, count=size,
+                    offset=offset)
+            offset += array.nbytes
+            arrays.append(array)
+        self.keys, self.scores, self.moves, self.depths, self.flags = arrays
+
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def buckets_count(cls, size_mb):
+        return max(1, int(size_mb * 1024 * 1024) //
+                (cls.ENTRY_SIZE * cls.BUCKET_SIZE))
+
+    @classmethod
+    def nbytes(cls, size_mb):
+        """
+        Number of bytes used by a table of size_mb megabytes
+        """
+        return cls.buckets_count(size_mb) * cls.BUCKET_SIZE * cls.ENTRY_SIZE
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _index(self, key):
+        return (key % self.buckets) * self.BUCKET_SIZE
+
+    @staticmethod
+    def _checksum(depth, flag, score, code):
+        """
+        Xor of all the data of an entry
+        """
+        return (score & 0xffffffff) << 32 ^ code ^ (depth & 0xff) << 16 ^ \
+                flag << 24
+
+    def _entry_key(self, i):
+        """
+        Zobrist key of the position stored in an entry
+        """
+        return int(self.keys[i]) ^ self._checksum(int(self.depths[i]),
+                int(self.flags[i]), int(self.scores[i]), int(self.moves[i]))
+
+    def probe(self, key):
+        """
+        Look for a position in the table
+        key: zobrist key of the position
+        return: (depth, flag, score, move) or None
+        """
+        idx = self._index(key)
+        for i in (idx, idx + 1):
+            # read each field once, the checksum detects concurrent writes
+            depth, flag = int(self.depths[i]), int(self.flags[i])
+            score, code = int(self.scores[i]), int(self.moves[i])
+            if flag != self.EMPTY and int(self.keys[i]) ^ \
+                    self._checksum(depth, flag, score, code) == key:
+                self.hits += 1
+                return depth, flag, score, code_to_move(code)
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, flag, score, move):
+        """
+        Store a search result in the table
+        key: zobrist key of the position
+        depth: remaining depth the position was searched at
+        flag: EXACT, LOWER or UPPER bound
+        score: integer value of the position
+        move: best move found or None
+        """
+        idx = self._index(key)
+        used = self.flags[idx] != self.EMPTY
+        same = used and self._entry_key(idx) == key
+        if not same and used and self.depths[idx] > depth:
+            # Keep the deeper entry and use the always-replace slot
+            idx += 1
+            same = self.flags[idx] != self.EMPTY and \
+                    self._entry_key(idx) == key
+        elif same and self.depths[idx] > depth:
+            return
+
+        # Keep the best move of a previous search of the same position
+        if move is None and same:
+            code = int(self.moves[idx])
+        else:
+            code = move_to_code(move)
+
+        self.depths[idx] = depth
+        self.flags[idx] = flag
+        self.scores[idx] = score
+        self.moves[idx] = code
+        self.keys[idx] = key ^ self._checksum(depth, flag, score, code)
+
+    def clear(self):
+        """
+        Empty the table
+        """
+        self.flags[:] = self.EMPTY
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,373 @@
+
+"""
+UCI front-end of the engine, so it can be driven by chess GUIs and match
+runners like cutechess-cli:
+
+    cutechess-cli -engine cmd="python uci.py" -engine cmd=... -each tc=10+0.1
+"""
+import sys
+import time
+import chess
+import threading
+
+from node import Node
+from minmax import MinMax
+from valuator import Valuator
+from book import OpeningBook
+from bitbase import Bitbases
+from smp import ParallelSearch
+from transposition import TranspositionTable
+
+
+class UciEngine:
+    """
+    Parse the UCI commands and run the searches in a background thread, so
+    that stop and ponderhit are handled while searching.
+    """
+
+    NAME = "BalooChessEngine"
+    AUTHOR = "BalooChessEngine authors"
+
+    # Moves left assumed by the time management when movestogo is missing
+    MOVES_TO_GO = 30
+    # Time kept for the communication with the GUI, in milliseconds
+    MOVE_OVERHEAD = 50
+
+    MAX_HASH_MB = 4096
+    MAX_THREADS = 64
+
+    def __init__(self, output=None):
+        self.output = output if output is not None else sys.stdout
+        self.node = Node()
+        self.hash_mb = TranspositionTable.DEFAULT_SIZE_MB
+        self.threads = 1
+        self.book = None
+        self.book_path = None
+        self.bitbases = None
+        self.bitbase_path = None
+
+        self.minmax = None
+        self.parallel = None
+
+        self.thread = None
+        self.stop_event = threading.Event()
+        # set when the bestmove of an infinite or ponder search can be sent
+        self.release = threading.Event()
+        self.timer = None
+        self.limits = {}
+        self.search_turn = chess.WHITE
+        self.lock = threading.Lock()
+
+    def send(self, line):
+        with self.lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def _engine(self):
+        """
+        Search engine with the current options
+        """
+        if self.threads > 1:
+            if self.parallel is None:
+                self.parallel = ParallelSearch(self.threads,
+                        table_mb=self.hash_mb, verbose=False,
+                        book_path=self.book_path,
+                        bitbase_path=self.bitbase_path)
+            return self.parallel
+
+        if self.minmax is None:
+            self.minmax = MinMax(valuator=Valuator(),
+                    table=TranspositionTable(self.hash_mb), book=self.book,
+                    verbose=False, bitbases=self.bitbases)
+            self.minmax.stop_event = self.stop_event
+            self.minmax.on_iteration = self._info
+        return self.minmax
+
+    def _close_parallel(self):
+        if self.parallel is not None:
+            self.parallel.close()
+            self.parallel = None
+
+    def _info(self, iteration):
+        """
+        Send the info line of a completed iteration
+        """
+        turn = self.search_turn
+        value = iteration['value']
+        elapsed = iteration['time']
+        pv = iteration['pv']
+
+        valuator = self.minmax.valuator
+        if value is not None and valuator.is_mate(value):
+            # mate in moves from the distance in plies
+            mate = (valuator.mate_distance(value) + 1) // 2
+            white_wins = value > 0
+            score = "mate %d" % (mate if white_wins == turn else -mate)
+        else:
+            cp = int(round((value or 0) / 10))
+            score = "cp %d" % (cp if turn == chess.WHITE else -cp)
+
+        line = "info depth %d seldepth %d score %s nodes %d nps %d time %d" % (
+                iteration['depth'], iteration['seldepth'], score,
+                iteration['nodes'],
+                iteration['nodes'] / elapsed if elapsed else 0,
+                elapsed * 1000)
+        if pv:
+            line += " pv " + " ".join(m.uci() for m in pv)
+        self.send(line)
+
+    def setoption(self, tokens):
+        """
+        setoption name <name> value <value>
+        """
+        if 'name' not in tokens:
+            return
+        if 'value' in tokens:
+            name = " ".join(tokens[tokens.index('name') + 1:
+                tokens.index('value')])
+            value = " ".join(tokens[tokens.index('value') + 1:])
+        else:
+            name = " ".join(tokens[tokens.index('name') + 1:])
+            value = ""
+
+        name = name.lower()
+        if name == 'hash':
+            self.hash_mb = max(1, min(int(value), self.MAX_HASH_MB))
+            if self.minmax is not None:
+                self.minmax.table = TranspositionTable(self.hash_mb)
+            self._close_parallel()
+        elif name == 'threads':
+            self.threads = max(1, min(int(value), self.MAX_THREADS))
+            self._close_parallel()
+        elif name == 'bookfile':
+            self.book_path = value or None
+            self.book = OpeningBook(value) if value else None
+            if self.minmax is not None:
+                self.minmax.book = self.book
+            self._close_parallel()
+        elif name == 'bitbasepath':
+            self.bitbase_path = value or None
+            self.bitbases = Bitbases(value) if value else None
+            if self.minmax is not None:
+                self.minmax.bitbases = self.bitbases
+            self._close_parallel()
+        elif name == 'ponder':
+            # the GUI sends go ponder when it is enabled, nothing to do
+            pass
+        else:
+            self.send("info string unknown option %s" % name)
+
+    def position(self, tokens):
+        """
+        position [startpos | fen <fen>] [moves <move> ...]
+        """
+        moves = []
+        if 'moves' in tokens:
+            moves = tokens[tokens.index('moves') + 1:]
+            tokens = tokens[:tokens.index('moves')]
+
+        if tokens and tokens[0] == 'fen':
+            board = chess.Board(" ".join(tokens[1:]))
+        else:
+            board = chess.Board()
+        for m in moves:
+            board.push_uci(m)
+        self.node = Node(board)
+
+    def _parse_go(self, tokens):
+        limits = {'ponder': 'ponder' in tokens,
+                'infinite': 'infinite' in tokens}
+        for name in ('depth', 'movetime', 'nodes', 'wtime', 'btime', 'winc',
+                'binc', 'movestogo'):
+            if name in tokens:
+                limits[name] = int(tokens[tokens.index(name) + 1])
+        return limits
+
+    def _movetime(self, limits, turn):
+        """
+        Time budget of a move in milliseconds, from the clock when there is
+        no movetime
+        """
+        if 'movetime' in limits:
+            return limits['movetime']
+        clock = limits.get('wtime' if turn == chess.WHITE else 'btime')
+        if clock is None:
+            return None
+        increment = limits.get('winc' if turn == chess.WHITE else 'binc', 0)
+        moves_to_go = limits.get('movestogo', self.MOVES_TO_GO)
+        budget = clock / max(moves_to_go, 1) + increment * 0.8
+        budget = min(budget, clock / 2) - self.MOVE_OVERHEAD
+        return max(int(budget), 1)
+
+    def go(self, tokens):
+        """
+        Start a search in the background
+        """
+        self.stop()
+        limits = self._parse_go(tokens)
+        self.limits = limits
+        self.stop_event.clear()
+        self.release.clear()
+        if not limits['ponder'] and not limits['infinite']:
+            self.release.set()
+
+        self.search_turn = self.node.board.turn
+        # The processes of the parallel search are forked here and not in
+        # the search thread: a forked process closes its stdin, which blocks
+        # while the loop is waiting for a command.
+        engine = self._engine()
+        # cleared before the thread starts, so that a stop sent right after
+        # go is not lost
+        if engine is self.parallel:
+            self.parallel.stop_event.clear()
+        self.thread = threading.Thread(target=self._search,
+                args=(engine, Node(self.node.board.copy()), limits),
+                daemon=True)
+        self.thread.start()
+
+    def _search(self, engine, node, limits):
+        turn = node.board.turn
+
+        movetime = nodes = None
+        max_depth = MinMax.DEFAULT_MAX_DEPTH
+        if limits['ponder'] or limits['infinite']:
+            # searched until stop or ponderhit
+            max_depth = MinMax.MAX_ITERATIVE_DEPTH
+        else:
+            movetime = self._movetime(limits, turn)
+            nodes = limits.get('nodes')
+            if 'depth' in limits:
+                max_depth = limits['depth']
+            elif movetime is not None or nodes is not None:
+                max_depth = MinMax.MAX_ITERATIVE_DEPTH
+        engine.max_depth = max_depth
+
+        start = time.time()
+        ponder = None
+        if engine is self.parallel:
+            move = engine.next_move(node, movetime=movetime, nodes=nodes)
+            best = engine.best
+            if best is not None and len(best['pv']) > 1:
+                ponder = chess.Move.from_uci(best['pv'][1])
+            elapsed = time.time() - start
+            self.send("info depth %d nodes %d nps %d time %d" % (
+                best['depth'] if best else 0, engine.nodes,
+                engine.nodes / elapsed if elapsed else 0, elapsed * 1000))
+        else:
+            move, stats = engine.search(node, movetime=movetime, nodes=nodes)
+            if stats.book:
+                self.send("info string book move")
+            if len(stats.pv) > 1:
+                ponder = stats.pv[1]
+
+        # the best move of an infinite search is only sent after stop
+        self.release.wait()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        if move is None:
+            self.send("bestmove 0000")
+        elif ponder is not None:
+            self.send("bestmove %s ponder %s" % (move.uci(), ponder.uci()))
+        else:
+            self.send("bestmove %s" % move.uci())
+
+    def _stop_search(self):
+        self.stop_event.set()
+        if self.parallel is not None:
+            self.parallel.stop_event.set()
+
+    def ponderhit(self):
+        """
+        The opponent played the expected move, the ponder search goes on
+        with the time budget of the move
+        """
+        if self.thread is None or not self.thread.is_alive():
+            return
+        movetime = self._movetime(self.limits, self.search_turn)
+        if movetime is None:
+            self.limits['infinite'] = True
+            self.release.set()
+            return
+        self.timer = threading.Timer(movetime / 1000., self._stop_search)
+        self.timer.start()
+        self.release.set()
+
+    def stop(self):
+        """
+        Stop the current search and wait for its bestmove
+        """
+        if self.thread is None:
+            return
+        self._stop_search()
+        self.release.set()
+        self.thread.join()
+        self.thread = None
+
+    def new_game(self):
+        self.stop()
+        if self.minmax is not None:
+            self.minmax.table.clear()
+        self._close_parallel()
+        self.node = Node()
+
+    def handle(self, line):
+        """
+        Handle a command
+        return: False on quit
+        """
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, tokens = tokens[0], tokens[1:]
+
+        if command == 'uci':
+            self.send("id name %s" % self.NAME)
+            self.send("id author %s" % self.AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max %d" %
+                    (TranspositionTable.DEFAULT_SIZE_MB, self.MAX_HASH_MB))
+            self.send("option name Threads type spin default 1 min 1 max %d"
+                    % self.MAX_THREADS)
+            self.send("option name Ponder type check default false")
+            self.send("option name BookFile type string default <empty>")
+            self.send("option name BitbasePath type string default <empty>")
+            self.send("uciok")
+        elif command == 'isready':
+            self.send("readyok")
+        elif command == 'setoption':
+            self.stop()
+            self.setoption(tokens)
+        elif command == 'ucinewgame':
+            self.new_game()
+        elif command == 'position':
+            self.stop()
+            self.position(tokens)
+        elif command == 'go':
+            self.go(tokens)
+        elif command == 'stop':
+            self.stop()
+        elif command == 'ponderhit':
+            self.ponderhit()
+        elif command == 'quit':
+            self.stop()
+            self._close_parallel()
+            return False
+        else:
+            self.send("info string unknown command %s" % command)
+        return True
+
+    def loop(self, input=None):
+        """
+        Read the commands until quit or the end of the input
+        """
+        input = input if input is not None else sys.stdin
+        for line in input:
+            if not self.handle(line.strip()):
+                return
+        self.stop()
+        self._close_parallel()
+
+
+if __name__ == "__main__":
+    UciEngine().loop()
@@ -1,6 +1,80 @@
 import chess
 import numpy as np
 
+
+def flatten_square_tables(tables):
+    """
+    Flatten the 8*8 piece-square tables into 64 entries tables indexed by
+    square, for both colors
+    return: dict color -> piece_type -> list of 64 ints
+    """
+    flat = {}
+    for color in chess.COLORS:
+        flat[color] = {}
+        for piece_type, table in tables.items():
+            rows = table if color == chess.WHITE else table[::-1]
+            flat[color][piece_type] = [rows[sq // 8][sq % 8]
+                    for sq in chess.SQUARES]
+    return flat
+
+
+# Order of the 12 piece planes of a position: white pieces then black ones
+PLANES = [(color, piece_type) for color in (chess.WHITE, chess.BLACK)
+        for piece_type in chess.PIECE_TYPES]
+
+
+def board_to_bitboards(board):
+    """
+    Return the 12 piece bitboards of a board in PLANES order
+    board: chess.Board
+    return: list of 12 ints
+    """
+    return [board.pieces_mask(piece_type, color)
+            for color, piece_type in PLANES]
+
+
+def boards_to_planes(boards):
+    """
+    Stack boards into a (N, 12, 64) bool array, planes in PLANES order
+    boards: list of chess.Board
+    return: numpy array
+    """
+    bitboards = np.array([board_to_bitboards(b) for b in boards],
+            dtype='<u8').reshape(-1, len(PLANES))
+    bits = np.unpackbits(bitboards.view(np.uint8), bitorder='little')
+    return bits.reshape(-1, len(PLANES), 64).astype(bool)
+
+
+def planes_weights(pieces_values, square_tables):
+    """
+    Signed (12, 64) weight tables of the material and the piece-square
+    values, in PLANES order
+    return: material weights, square weights
+    """
+    material = np.zeros((len(PLANES), 64), dtype=np.int64)
+    squares = np.zeros((len(PLANES), 64), dtype=np.int64)
+    for i, (color, piece_type) in enumerate(PLANES):
+        sign = 1 if color == chess.WHITE else -1
+        material[i] = pieces_values[piece_type] * sign
+        squares[i] = np.array(square_tables[color][piece_type]) * sign
+    return material, squares
+
+
+def byte_tables(weights):
+    """
+    Lookup tables of the sum of weights of the squares set in each byte of
+    the bitboards, so a bitboard is scored with 8 lookups instead of one per
+    square
+    weights: (12, 64) array, see planes_weights
+    return: tables[plane][byte][bits] nested lists of ints
+    """
+    bits = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1,
+            bitorder='little').astype(np.int64)
+    # (12, 8 bytes, 8 bits) @ (8 bits, 256) -> (12, 8, 256)
+    tables = np.asarray(weights).reshape(len(PLANES), 8, 8) @ bits.T
+    return tables.tolist()
+
+
 class Valuator:
     """
     Simple value function that value a board
@@ -64,31 +138,66 @@ class Valuator:
             [20, 20,  0,  0,  0,  0, 20, 20],
             [20, 30, 10,  0,  0, 10, 30, 20]]}
 
-    MAXVALUE = float('inf')
+    # Precomputed piece-square tables: SQUARE_TABLES[color][piece_type][square]
+    SQUARE_TABLES = flatten_square_tables(PIECES_SQUARE_VALUES)
+
+    # Weight tables of the batch evaluation, in PLANES order
+    MATERIAL_WEIGHTS, SQUARE_WEIGHTS = planes_weights(PIECES_VALUES,
+            SQUARE_TABLES)
+
+    # Signed piece-square tables of the bitboard evaluation, in PLANES order
+    SQUARE_BYTE_TABLES = byte_tables(SQUARE_WEIGHTS)
+
+    # Value of a checkmate, a mate found n plies away from the root of a
+    # search is worth MAXVALUE - n so that the shortest mate is preferred.
+    # Values are integers so that null windows can be used.
+    MAXVALUE = 1000000
     MINVALUE = -MAXVALUE
 
+    # Longest mate distance, values beyond MAXVALUE - MAX_MATE_PLY are mates
+    MAX_MATE_PLY = 1000
+
     # Value for a zero board
     ZEROVALUE = 126.5
 
 
-    def __init__(self):
+    # Maximum number of values kept in memory
+    MEMORY_SIZE = 1 << 18
+
+    # Evaluation backends: material and piece-square totals updated by the
+    # node on each move, or computed from the board bitboards
+    INCREMENTAL = "incremental"
+    BITBOARD = "bitboard"
+    BACKENDS = (INCREMENTAL, BITBOARD)
+
+    def __init__(self, memory_size=MEMORY_SIZE, backend=INCREMENTAL):
+        if backend not in self.BACKENDS:
+            raise Exception("Unknown evaluation backend: %s" % backend)
         self.count = 0
+        # calls answered from memory
+        self.hits = 0
         self.memory = {}
+        self.memory_size = memory_size
+        self.backend = backend
 
     def __call__(self, node):
         """
         Each time Valuator is called, we increment counter
-        node: node with a chess board
-        return: value of the board
+        node: node with a chess board, the game must not be over
+        return: static value of the board
         """
 
         self.count += 1
-        if node.key() in self.memory:
-            return self.memory[node.key()]
+        key = node.key()
+        if key in self.memory:
+            self.hits += 1
+            return self.memory[key]
 
-        board = node.board
-        value = self.value(board)
-        self.memory[node.key()] = value
+        value = self.static_value(node)
+        # Memory is bounded, forget everything once it is full
+        if len(self.memory) >= self.memory_size:
+            self.memory.clear()
+        self.memory[key] = value
         return value
 
     def piece_to_value(self, piece_type, color):
@@ -184,8 +293,225 @@ class Valuator:
 
         return value
 
+    def is_draw(self, board):
+        """
+        Draw by insufficient material, 75 moves rule or fivefold repetition,
+        the game over conditions that don't need the legal moves
+        board: chess.Board
+        return: bool
+        """
+        # insufficient material needs a board without pawns, rooks, queens
+        if not (board.pawns | board.rooks | board.queens) and \
+                board.is_insufficient_material():
+            return True
+        return board.halfmove_clock >= 150 or board.is_fivefold_repetition()
+
+    def terminal_value(self, board, ply=0):
+        """
+        Value of a board without legal moves: checkmate or stalemate
+        board: chess.Board
+        ply: distance from the root of the search
+        return: int
+        """
+        if board.is_check():
+            return self.MINVALUE + ply if board.turn == chess.WHITE \
+                    else self.MAXVALUE - ply
+        return 0
+
+    def is_mate(self, value):
+        """
+        Tell if a value is a checkmate found by the search
+        """
+        return abs(value) >= self.MAXVALUE - self.MAX_MATE_PLY
+
+    def mate_distance(self, value):
+        """
+        Number of plies to the checkmate of a mate value, see is_mate
+        """
+        return self.MAXVALUE - abs(value)
+
+    def _game_over_value(self, board, legal_moves):
+        """
+        Same game over detection as board.is_game_over, without generating
+        the legal moves again
+        legal_moves: number of legal moves of the board
+        return: value of the finished game, or None
+        """
+        if legal_moves == 0:
+            return self.terminal_value(board)
+        if self.is_draw(board):
+            return 0
+        return None
+
+    def incremental_value(self, node):
+        """
+        Same as value but material and piece-square totals are read from the
+        node, which updates them on each push and pop.
+        node: Node
+        return: float
+        """
+        board = node.board
+        legal_moves = board.legal_moves.count()
+        result = self._game_over_value(board, legal_moves)
+        if result is not None:
+            return result
+
+        material, squares = node.evaluation()
+        if board.turn == chess.WHITE:
+            square_value = squares[chess.WHITE]
+            mobility = legal_moves
+        else:
+            square_value = -squares[chess.BLACK]
+            mobility = -legal_moves
+
+        value = material * 10
+        value += square_value * 3
+        value += mobility
+
+        return value
+
+    def bitboard_material_value(self, board):
+        """
+        Same as get_material_value, with a popcount of each bitboard
+        board: chess.Board
+        return: int
+        """
+        value = 0
+        for piece_type in chess.PIECE_TYPES:
+            mask = board.pieces_mask(piece_type, chess.WHITE)
+            count = mask.bit_count()
+            mask = board.pieces_mask(piece_type, chess.BLACK)
+            count -= mask.bit_count()
+            value += self.PIECES_VALUES[piece_type] * count
+        return value
+
+    def bitboard_mask_value(self, board, color):
+        """
+        Same as get_all_masks_value, from the byte lookup tables
+        board: chess.Board
+        color: chess.WHITE or chess.BLACK
+        return: int
+        """
+        val = 0
+        offset = 0 if color == chess.WHITE else len(chess.PIECE_TYPES)
+        for piece_type in chess.PIECE_TYPES:
+            tables = self.SQUARE_BYTE_TABLES[offset + piece_type - 1]
+            mask = board.pieces_mask(piece_type, color)
+            i = 0
+            while mask:
+                val += tables[i][mask & 0xff]
+                mask >>= 8
+                i += 1
+        return val
+
+    def bitboard_value(self, board):
+        """
+        Same as value, but material and piece-square values are computed from
+        the bitboards of the board, and the legal moves are generated once.
+        board: chess.Board
+        return: float
+        """
+        legal_moves = board.legal_moves.count()
+        result = self._game_over_value(board, legal_moves)
+        if result is not None:
+            return result
+
+        value = self.bitboard_material_value(board) * 10
+        value += self.bitboard_mask_value(board, board.turn) * 3
+        value += legal_moves if board.turn == chess.WHITE else -legal_moves
+
+        return value
+
+    def batch_material_value(self, planes):
+        """
+        Material value of N positions at once
+        planes: (N, 12, 64) array, see boards_to_planes
+        return: (N,) int array, same as get_material_value
+        """
+        return np.einsum('nps,ps->n', planes, self.MATERIAL_WEIGHTS)
+
+    def batch_mask_value(self, planes, colors):
+        """
+        Piece-square value of N positions at once
+        planes: (N, 12, 64) array, see boards_to_planes
+        colors: (N,) bool array, color to compute the value for
+        return: (N,) int array, same as get_all_masks_value
+        """
+        half = len(PLANES) // 2
+        white = np.einsum('nps,ps->n', planes[:, :half],
+                self.SQUARE_WEIGHTS[:half])
+        black = np.einsum('nps,ps->n', planes[:, half:],
+                self.SQUARE_WEIGHTS[half:])
+        return np.where(np.asarray(colors, dtype=bool), white, black)
+
+    def batch_value(self, planes, turns):
+        """
+        Material and piece-square value of N positions at once. The legal
+        moves count and game over detection are not part of it.
+        planes: (N, 12, 64) array, see boards_to_planes
+        turns: (N,) bool array, side to move of each position
+        return: (N,) int array
+        """
+        return self.batch_material_value(planes) * 10 + \
+                self.batch_mask_value(planes, turns) * 3
+
+    def attack_mobility(self, board):
+        """
+        Pseudo-legal mobility of the side to move from the attack bitboards:
+        pieces moves to squares not occupied by their side, pawns pushes and
+        captures. Castling and en passant are not counted, nor checks.
+        board: chess.Board
+        return: int, positive for white
+        """
+        turn = board.turn
+        own = board.occupied_co[turn]
+        them = board.occupied_co[not turn]
+        empty = ~board.occupied & chess.BB_ALL
+
+        count = 0
+        for square in chess.scan_reversed(own & ~board.pawns):
+            count += (board.attacks_mask(square) & ~own).bit_count()
+
+        pawns = own & board.pawns
+        if turn == chess.WHITE:
+            single = (pawns << 8) & empty
+            double = ((single & chess.BB_RANK_3) << 8) & empty
+            captures = (((pawns & ~chess.BB_FILE_A) << 7) & them).bit_count()
+            captures += (((pawns & ~chess.BB_FILE_H) << 9) & them).bit_count()
+        else:
+            single = (pawns >> 8) & empty
+            double = ((single & chess.BB_RANK_6) >> 8) & empty
+            captures = (((pawns & ~chess.BB_FILE_A) >> 9) & them).bit_count()
+            captures += (((pawns & ~chess.BB_FILE_H) >> 7) & them).bit_count()
+        count += single.bit_count() + double.bit_count() + captures
+
+        return count if turn == chess.WHITE else -count
+
+    def static_value(self, node):
+        """
+        Value of a position that is not over: the search detects the end of
+        the game from its own move generation, see terminal_value and is_draw.
+        The legal moves count is replaced by attack_mobility.
+        node: Node
+        return: int
+        """
+        board = node.board
+        if self.backend == self.BITBOARD:
+            value = self.bitboard_material_value(board) * 10
+            value += self.bitboard_mask_value(board, board.turn) * 3
+        else:
+            material, squares = node.evaluation()
+            if board.turn == chess.WHITE:
+                square_value = squares[chess.WHITE]
+            else:
+                square_value = -squares[chess.BLACK]
+            value = material * 10 + square_value * 3
+        return value + self.attack_mobility(board)
+
     def reset(self):
         """
-        Reset counter
+        Reset counter and memory
         """
         self.count = 0
+        self.hits = 0
+        self.memory.clear()